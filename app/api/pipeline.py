@@ -0,0 +1,462 @@
+import asyncio
+import time
+import logging
+from contextlib import contextmanager
+from functools import cached_property
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.utils.logger import logger as request_logger
+from app.utils.redaction import Redactor
+from app.utils.executor import run_blocking
+from app.utils.admission import admission, Overloaded, Permit
+from app.retrieval.registry import retriever_registry
+from app.retrieval.base import retrieval_io_executor
+from app.llm import vertex_stream, none_extractive, intent_router
+from app.llm.intent_router import Intent
+from app.llm.answer_cache import answer_cache
+from app.llm.context_packer import pack_for_prompt
+from app.llm.circuit_breaker import generation_breaker, breaker_states
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("redact", "intent", "retrieve", "pack", "generate", "log")
+
+SYSTEM_INSTRUCTIONS = {
+    Intent.GREETING: "You are a friendly AI assistant. Greet the user warmly and ask how you can help them today. Do NOT use search results.",
+    Intent.CLOSURE: "The user is finishing the conversation or saying thanks. Respond politely and wish them a great day!",
+    Intent.OFF_TOPIC: "You are a helpful AI assistant. The user has asked something outside your specialized knowledge of the uploaded documents. Politely inform them that you are focused on the documentation and ask if they have questions about that.",
+}
+
+# Replies without an LLM (none mode, or generation shed / circuit open)
+CANNED_REPLIES = {
+    Intent.GREETING: "Hello! I am your local AI assistant. How can I help you explore the OpsUI Application today?",
+    Intent.CLOSURE: "You're very welcome! If you have more questions later, feel free to ask. Have a great day!",
+    Intent.OFF_TOPIC: "I'm optimized for technical documentation queries. Please ask about the software or app details!",
+}
+
+# Replies when the LLM fails or times out on a non-RAG intent
+FALLBACK_REPLIES = {
+    Intent.GREETING: "Hello! I am your AI assistant. How can I help you today?",
+    Intent.CLOSURE: "You're welcome! Let me know if you need anything else.",
+    Intent.OFF_TOPIC: "I'm focused on the technical documentation provided.",
+}
+
+NO_CONTEXT_REPLY = "I'm sorry, I couldn't find any specific information about that in the documents. Could you please rephrase your question?"
+
+
+def make_citation(chunk: dict) -> dict:
+    meta = chunk.get('meta', {})
+    citation = {
+        "id": chunk.get('chunkId', 'unknown'),
+        "title": meta.get('docTitle', 'Untitled'),
+        "score": float(chunk.get('score', 0))
+    }
+    # Page (or section) range from the chunk store, when the source had pages
+    if meta.get('page'):
+        citation.update(page=meta['page'], pageEnd=meta.get('pageEnd', meta['page']), pageUnit=meta.get('pageUnit', 'page'))
+    return citation
+
+def generation_mode() -> str:
+    """
+    settings.MODE, or "none" while the generation circuit is open, so answers come from the
+    extractive path at once instead of waiting on a failing Vertex. In vertex mode the
+    returned "vertex" is a breaker admission: follow it with get_llm_response.
+    """
+    if settings.MODE == "vertex" and not generation_breaker.allow():
+        return "none"
+    return settings.MODE
+
+async def acquire_generation() -> Tuple[str, Optional[Permit]]:
+    """
+    Generation mode for a request and, in vertex mode, its generation-stage permit, which
+    get_llm_response releases when the answer ends. A request that doesn't get into the
+    generation stage in time is answered extractively, as while the circuit is open.
+    """
+    if settings.MODE != "vertex":
+        return settings.MODE, None
+    try:
+        permit = await admission.acquire("generation")
+    except Overloaded as e:
+        logger.warning(f"Shedding generation, answering extractively: {e}")
+        return "none", None
+    mode = generation_mode()
+    if mode != "vertex":
+        permit.release()
+        return mode, None
+    return mode, permit
+
+async def release_when_done(generator, permit: Permit):
+    try:
+        async for token in generator:
+            yield token
+    finally:
+        permit.release()
+        await generator.aclose()
+
+async def get_llm_response(mode: str, query: str, chunks: list, system_instruction: str = None,
+                           permit: Optional[Permit] = None):
+    if mode == "vertex":
+        generator = vertex_stream.generate_response_stream(query, chunks, system_instruction)
+    else:
+        generator = none_extractive.generate_response_stream(query, chunks, system_instruction)
+    return generator if permit is None else release_when_done(generator, permit)
+
+async def until_deadline(source, deadline: Optional[float]):
+    """Yields from an async generator until it ends; raises asyncio.TimeoutError once the loop clock passes deadline."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError()
+            try:
+                item = await asyncio.wait_for(source.__anext__(), remaining)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await source.aclose()
+
+async def lookup_similar_answer(query: str, top_k: int, index_version: Optional[str]):
+    """
+    Near-duplicate answer cache lookup. Returns (entry, query_embedding); the embedding is
+    kept so the answer can be stored under it. Only vector retrieval modes embed queries,
+    and the embedding is cached, so retrieval reuses it instead of calling Vertex again.
+    """
+    if not answer_cache.semantic_enabled or settings.RETRIEVAL_MODE.lower() not in ("faiss", "hybrid"):
+        return None, None
+    try:
+        from app.embeddings.vertex_embedder import VertexEmbedder
+        query_embedding = await run_blocking(retrieval_io_executor(), VertexEmbedder().embed_query, query)
+    except Exception as e:
+        logger.warning(f"Answer cache: query embedding failed, skipping similarity lookup: {e}")
+        return None, None
+    return answer_cache.get_similar(query_embedding, top_k, index_version), query_embedding
+
+async def prepare_rag_context(query: str, top_k: int, index_version: Optional[str]) -> Tuple[Optional[dict], Optional[list], list]:
+    """Semantic answer cache lookup, then retrieval on a miss. Returns (cached entry, query embedding, chunks)."""
+    cached, query_embedding = await lookup_similar_answer(query, top_k, index_version)
+    if cached:
+        return cached, query_embedding, []
+    retriever = retriever_registry.get()
+    chunks = await retriever.aretrieve(query, top_k=top_k)
+    return None, query_embedding, chunks
+
+
+class StageTimer:
+    """
+    Wall time per pipeline stage in ms, and the stages that went over their timeout.
+    Awaited stages are cut off at the timeout (bounded()); the in-process CPU stages can't be
+    interrupted, so overrunning one is only recorded.
+    """
+
+    def __init__(self, timeouts: Dict[str, float]):
+        self.timeouts = timeouts
+        self.ms: Dict[str, float] = {}
+        self.timed_out: List[str] = []
+
+    def deadline(self, stage: str) -> Optional[float]:
+        timeout = self.timeouts.get(stage)
+        return asyncio.get_running_loop().time() + timeout if timeout else None
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = self.ms.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+            self.ms[stage] = round(elapsed_ms, 2)
+            timeout = self.timeouts.get(stage)
+            if timeout and elapsed_ms > timeout * 1000 and stage not in self.timed_out:
+                self.timed_out.append(stage)
+                logger.warning(f"Pipeline stage '{stage}' took {elapsed_ms:.0f}ms, over its {timeout:g}s timeout")
+
+    async def bounded(self, stage: str, awaitable):
+        return await asyncio.wait_for(awaitable, self.timeouts.get(stage))
+
+    def merge(self, ms: Dict[str, float], timed_out: List[str]):
+        for stage, elapsed_ms in ms.items():
+            self.ms[stage] = round(self.ms.get(stage, 0.0) + elapsed_ms, 2)
+        self.timed_out.extend(stage for stage in timed_out if stage not in self.timed_out)
+
+    def report(self) -> Dict[str, float]:
+        return {stage: self.ms[stage] for stage in STAGES if stage in self.ms}
+
+
+class ChatRun:
+    """One chat request: its query, the request log fields and the per-stage timings."""
+
+    def __init__(self, pipeline: "ChatPipeline", query: str, top_k: int, session_id: str):
+        self.query = query
+        self.top_k = top_k
+        self.session_id = session_id
+        self.index_version = retriever_registry.version
+        self.started = time.time()
+        self.timer = StageTimer(pipeline.timeouts)
+        with self.timer.measure("redact"):
+            redacted = Redactor.redact(query)
+        self.log_data: Dict[str, Any] = {
+            "sessionId": session_id,
+            "query": redacted,
+            "retrieval_mode": settings.RETRIEVAL_MODE,
+            "index_version": self.index_version,
+            "mode": settings.MODE,
+        }
+
+    @cached_property
+    def local_intent(self) -> Optional[str]:
+        """
+        Intent from the rules and the local classifier (None: only the LLM can decide).
+        Computed once per request; admission and the pipeline's intent stage both use it.
+        """
+        with self.timer.measure("intent"):
+            return intent_router.predict_local_intent(self.query)
+
+    def record(self, result: Dict[str, Any]):
+        """Takes in the 'result' event of a pipeline run (possibly shared with other requests)."""
+        result = dict(result)
+        self.timer.merge(result.pop("timings", {}), result.pop("timed_out", []))
+        self.log_data.update(result)
+
+
+class ChatPipeline:
+    """
+    The chat pipeline shared by every chat endpoint, in stages:
+
+      redact    query redacted for the request log (ChatRun)
+      intent    rules and local classifier, then the LLM if they can't decide
+      retrieve  semantic answer cache, then the retriever; speculatively alongside an LLM intent call
+      pack      retrieved chunks merged, deduplicated and fitted to the prompt budget
+      generate  Vertex stream or extractive answer, with the canned and fallback replies
+      log       request log record (finish)
+
+    Each stage is timed and has a timeout (0 = none). An intent call that times out counts
+    as a RAG query, a retrieval that times out as no results, and a generation that times
+    out before its first token falls back to the extractive answer.
+
+    events() is the part identical requests can share (intent through generation); ChatRun
+    and finish() are per request, so the timings of a coalesced request combine both.
+    """
+
+    def __init__(self, timeouts: Dict[str, float]):
+        self.timeouts = {stage: timeout for stage, timeout in timeouts.items() if timeout > 0}
+
+    def start(self, query: str, top_k: int, session_id: str) -> ChatRun:
+        return ChatRun(self, query, top_k, session_id)
+
+    def cached_answer(self, run: ChatRun) -> Optional[dict]:
+        """Exact (normalized) repeat from the answer cache; skips every stage up to log."""
+        return answer_cache.get(run.query, run.top_k, run.index_version)
+
+    async def _retrieve(self, timer: StageTimer, query: str, top_k: int, index_version: Optional[str]):
+        with timer.measure("retrieve"):
+            try:
+                return await timer.bounded("retrieve", prepare_rag_context(query, top_k, index_version))
+            except asyncio.TimeoutError:
+                logger.warning(f"Retrieval timed out after {self.timeouts['retrieve']:g}s; answering without context")
+                return None, None, []
+
+    async def _detect_intent(self, timer: StageTimer, query: str, top_k: int, index_version: Optional[str],
+                             local_intent: Optional[str]) -> Tuple[str, Optional[tuple], Optional[str]]:
+        """
+        Returns (intent, RAG context from prepare_rag_context or None, speculation outcome).
+
+        local_intent is the run's rules and classifier result (ChatRun.local_intent). When the
+        LLM has to decide, RAG preparation starts at the same time as the intent call, since
+        nearly every such query is a RAG query; for any other intent its result is discarded.
+        """
+        intent = local_intent
+        if intent is not None:
+            if intent != Intent.RAG_QUERY:
+                return intent, None, None
+            return intent, await self._retrieve(timer, query, top_k, index_version), None
+
+        rag_task = asyncio.create_task(self._retrieve(timer, query, top_k, index_version))
+        # A discarded task may still fail; retrieve its exception so it isn't reported as unhandled
+        rag_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            with timer.measure("intent"):
+                try:
+                    intent = await timer.bounded("intent", intent_router.predict_remote_intent(query))
+                except asyncio.TimeoutError:
+                    logger.warning(f"LLM intent timed out after {self.timeouts['intent']:g}s; treating as a RAG query")
+                    intent = Intent.RAG_QUERY
+            if intent != Intent.RAG_QUERY:
+                rag_task.cancel()
+                return intent, None, "discarded"
+            return intent, await rag_task, "used"
+        finally:
+            if not rag_task.done():
+                rag_task.cancel()
+
+    async def events(self, run: ChatRun, retrieval_permit: Optional[Permit] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Intent, retrieval, packing and generation for the run's query, as ('meta' | 'token',
+        payload) events, then ('result', fields for the request log, with the stage timings).
+        retrieval_permit is released as soon as intent and retrieval are done.
+        """
+        query, top_k, index_version = run.query, run.top_k, run.index_version
+        timer = StageTimer(self.timeouts)
+        try:
+            intent, rag_context, speculation = await self._detect_intent(
+                timer, query, top_k, index_version, run.local_intent,
+            )
+        finally:
+            if retrieval_permit is not None:
+                retrieval_permit.release()
+        logger.info(f"Detected intent: {intent}")
+
+        chunks = []
+        context = []
+        context_report = None
+        query_embedding = None
+        cache_status = None
+
+        if intent == Intent.RAG_QUERY:
+            # A near-duplicate of a cached question can still skip generation
+            cached, query_embedding, chunks = rag_context
+            if cached:
+                yield "meta", {'citations': cached['citations'], 'retrievalMode': settings.RETRIEVAL_MODE, 'intent': intent, 'cached': True}
+                for token in cached['tokens']:
+                    yield "token", token
+                yield "result", {
+                    "intent": intent,
+                    "answer_cache": "semantic_hit",
+                    "answer_cache_similarity": cached['similarity'],
+                    "speculative_retrieval": speculation,
+                    "response_length": sum(len(t) for t in cached['tokens']),
+                    "timings": timer.ms,
+                    "timed_out": timer.timed_out,
+                }
+                return
+            answer_cache.record_miss()
+            cache_status = "miss"
+
+            # Merge overlapping chunks, drop duplicates and fit the prompt token budget;
+            # citations cover exactly the chunks whose text reaches the model
+            with timer.measure("pack"):
+                packed = pack_for_prompt(chunks)
+                context = packed.passages
+                context_report = packed.report()
+                chunks = [c for c in chunks if c['chunkId'] in packed.chunk_ids]
+
+        citations = [make_citation(c) for c in chunks]
+        yield "meta", {'citations': citations, 'retrievalMode': settings.RETRIEVAL_MODE, 'intent': intent}
+
+        tokens = []
+        with timer.measure("generate"):
+            # The timeout covers the wait for a generation slot as well
+            deadline = timer.deadline("generate")
+            mode, generation_permit = await acquire_generation()
+
+            if intent != Intent.RAG_QUERY and mode == "none":
+                tokens.append(CANNED_REPLIES[intent])
+                yield "token", tokens[-1]
+
+            elif intent == Intent.RAG_QUERY and not chunks and mode == "none":
+                tokens.append(NO_CONTEXT_REPLY)
+                yield "token", tokens[-1]
+
+            else:
+                complete = False
+                generator = await get_llm_response(mode, query, context, SYSTEM_INSTRUCTIONS.get(intent), generation_permit)
+                try:
+                    async for token in until_deadline(generator, deadline):
+                        tokens.append(token)
+                        yield "token", token
+                    complete = True
+                except asyncio.TimeoutError:
+                    logger.warning(f"Generation timed out after {self.timeouts['generate']:g}s ({len(tokens)} tokens sent)")
+                    if intent != Intent.RAG_QUERY:
+                        tokens.append(FALLBACK_REPLIES[intent])
+                        yield "token", tokens[-1]
+                    elif tokens:
+                        tokens.append("\n\n[Answer cut short: generation timed out]")
+                        yield "token", tokens[-1]
+                    else:
+                        # Nothing sent yet: the extractive answer is still useful. The
+                        # circuit is told by vertex_stream, which knows whether the time went
+                        # on the upstream or on waiting for a slot
+                        mode = "none"
+                        async for token in none_extractive.generate_response_stream(query, context):
+                            tokens.append(token)
+                            yield "token", token
+                except Exception as e:
+                    if intent != Intent.RAG_QUERY:
+                        # Small talk doesn't need the LLM to succeed
+                        tokens.append(FALLBACK_REPLIES[intent])
+                        yield "token", tokens[-1]
+                    else:
+                        err_str = str(e)
+                        if "401" in err_str or "403" in err_str:
+                            logger.warning("Auth error. Refreshing token.")
+                            from app.llm.vertex_r2d2_client import VertexR2D2Client
+                            VertexR2D2Client.refresh_on_error()
+                            tokens.append('[Auth Error: Token refreshed, please retry]')
+                        else:
+                            tokens.append(f'[Error: {err_str}]')
+                        yield "token", tokens[-1]
+
+                # Only complete, successful answers are cached; extractive fallbacks are not
+                if complete and intent == Intent.RAG_QUERY and mode == settings.MODE:
+                    answer_cache.put(query, top_k, index_version, intent, citations, tokens, query_embedding)
+
+        yield "result", {
+            "intent": intent,
+            "answer_cache": cache_status,
+            "context": context_report,
+            "speculative_retrieval": speculation,
+            "retrieved_chunks": [c['chunkId'] for c in chunks],
+            "retrieved_scores": [c.get('score', 0) for c in chunks],
+            "response_length": sum(len(t) for t in tokens),
+            "generation_mode": mode,
+            "circuit": breaker_states(),
+            "timings": timer.ms,
+            "timed_out": timer.timed_out,
+        }
+
+    def finish(self, run: ChatRun, message: str, **fields) -> Dict[str, Any]:
+        """
+        Writes the request log record; returns the summary for the client ('done' event or
+        JSON fields): latency, stage timings and whether the answer came from the cache.
+        The 'log' timing covers building the record, not writing it.
+        """
+        with run.timer.measure("log"):
+            run.log_data.update(fields)
+            latency = time.time() - run.started
+            run.log_data['latency'] = latency
+            run.log_data['circuit'] = run.log_data.get('circuit') or breaker_states()
+            run.log_data['timed_out'] = run.timer.timed_out
+        timings = run.timer.report()
+        run.log_data['timings'] = timings
+        request_logger.info(message, extra={"structured_data": run.log_data})
+
+        summary = {'latency': latency, 'timings': timings}
+        if run.log_data.get('answer_cache') in ("hit", "semantic_hit"):
+            summary['cached'] = True
+        return summary
+
+
+async def collect(events: AsyncIterator[Tuple[str, Any]]) -> Tuple[dict, str, dict]:
+    """Drains pipeline events into (meta, answer text, result fields), for non-streaming callers."""
+    meta, tokens, result = {}, [], {}
+    async for kind, payload in events:
+        if kind == "meta":
+            meta = payload
+        elif kind == "token":
+            tokens.append(payload)
+        elif kind == "result":
+            result = payload
+    return meta, "".join(tokens), result
+
+
+chat_pipeline = ChatPipeline({
+    "redact": settings.PIPELINE_REDACT_TIMEOUT,
+    "intent": settings.PIPELINE_INTENT_TIMEOUT,
+    "retrieve": settings.PIPELINE_RETRIEVE_TIMEOUT,
+    "pack": settings.PIPELINE_PACK_TIMEOUT,
+    "generate": settings.PIPELINE_GENERATE_TIMEOUT,
+    "log": settings.PIPELINE_LOG_TIMEOUT,
+})
@@ -1,27 +1,135 @@
 import asyncio
 import json
 import uuid
-import time
-from typing import Optional
+from typing import AsyncIterator, Hashable, Optional, Tuple
 from fastapi import APIRouter, Request, Query
 from fastapi.responses import StreamingResponse, JSONResponse
 
 from app.config import settings
 from app.utils.logger import logger
-from app.utils.redaction import Redactor
-from app.retrieval.factory import get_retriever
+from app.utils.singleflight import SingleFlight
+from app.utils.admission import admission, Overloaded, Permit
+from app.embeddings.embedding_cache import normalize_query
+from app.api.pipeline import ChatRun, chat_pipeline, collect
 
-# Import LLM handlers
-from app.llm import vertex_stream, none_extractive, intent_router
 from app.llm.intent_router import Intent
 
 router = APIRouter()
 
-async def get_llm_response(mode: str, query: str, chunks: list, system_instruction: str = None):
-    if mode == "vertex":
-        return vertex_stream.generate_response_stream(query, chunks, system_instruction)
-    else:
-        return none_extractive.generate_response_stream(query, chunks, system_instruction)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+def is_cheap_request(run: ChatRun) -> bool:
+    """Greetings and the like answered from canned text (none mode) need no admission."""
+    return settings.MODE == "none" and run.local_intent not in (None, Intent.RAG_QUERY)
+
+def overloaded_response(error: Overloaded, log_data: dict) -> JSONResponse:
+    log_data['overloaded'] = error.stage
+    logger.warning("Chat Request Rejected: overloaded", extra={"structured_data": log_data})
+    return JSONResponse(
+        {"error": "The server is busy, please retry shortly", "stage": error.stage},
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+async def admit_request(run: ChatRun) -> Tuple[Optional[Permit], Optional[JSONResponse]]:
+    """
+    Admission for a request that will run the pipeline: (retrieval-stage permit, None), or
+    (None, 503 response) when the retrieval queue, or the generation queue it will need
+    later, is full, or no retrieval slot frees up within the deadline.
+    """
+    if is_cheap_request(run):
+        return None, None
+    try:
+        admission.check("retrieval", *(("generation",) if settings.MODE == "vertex" else ()))
+        return await admission.acquire("retrieval"), None
+    except Overloaded as e:
+        return None, overloaded_response(e, run.log_data)
+
+# In-flight pipeline runs, keyed like the answer cache; shared by both chat endpoints
+chat_flights = SingleFlight("chat")
+
+def flight_key(run: ChatRun) -> Hashable:
+    """
+    Requests with the same key share one pipeline run. Same key as the exact answer cache:
+    normalize_query only folds case, whitespace and trailing punctuation, so "C#" never
+    joins a "C++" run.
+    """
+    if not settings.CHAT_COALESCING:
+        return uuid.uuid4()
+    return run.index_version, run.top_k, normalize_query(run.query)
+
+async def start_pipeline(run: ChatRun) -> Tuple[Optional[AsyncIterator], Optional[JSONResponse]]:
+    """
+    Pipeline events for a request: (subscription, None), or (None, 503 response).
+    Joins an identical request already in flight (its events so far are replayed), or
+    starts a run once admitted; joining costs nothing, so it needs no admission.
+    """
+    key = flight_key(run)
+    retrieval_permit = None
+    if not chat_flights.in_flight(key):
+        retrieval_permit, rejection = await admit_request(run)
+        if rejection is not None:
+            return None, rejection
+    events, leader = chat_flights.join(
+        key, lambda: chat_pipeline.events(run, retrieval_permit),
+        on_finish=retrieval_permit.release if retrieval_permit else None,
+    )
+    if not leader and retrieval_permit is not None:
+        # An identical request started while this one waited for admission
+        retrieval_permit.release()
+    run.log_data['coalesced'] = not leader
+    return events, None
+
+class ClientDisconnected(Exception):
+    pass
+
+async def until_disconnected(request: Request, source):
+    """
+    Yields from an async generator until it ends or the client goes away. Between items the
+    connection is polled every STREAM_DISCONNECT_POLL seconds; on a disconnect the pending
+    read is cancelled and the source closed, which stops the upstream generation, and
+    ClientDisconnected is raised.
+    """
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(source.__anext__())
+            while not pending.done():
+                await asyncio.wait({pending}, timeout=settings.STREAM_DISCONNECT_POLL)
+                if not pending.done() and await request.is_disconnected():
+                    raise ClientDisconnected()
+            try:
+                item = pending.result()
+            except StopAsyncIteration:
+                return
+            pending = None
+            yield item
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        await source.aclose()
+
+def stream_cached_answer(entry: dict, run: ChatRun) -> StreamingResponse:
+    """Replays a cached answer over SSE with the same events as a live generation."""
+    async def event_generator():
+        yield f"event: meta\ndata: {json.dumps({'citations': entry['citations'], 'retrievalMode': settings.RETRIEVAL_MODE, 'intent': entry['intent'], 'cached': True})}\n\n"
+        for token in entry['tokens']:
+            yield f"event: token\ndata: {json.dumps(token)}\n\n"
+
+        done = chat_pipeline.finish(
+            run, "Chat Request Completed",
+            intent=entry['intent'], answer_cache="hit", response_length=sum(len(t) for t in entry['tokens']),
+        )
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.get("/chat/stream")
 async def chat_stream(
@@ -30,111 +138,32 @@ async def chat_stream(
     sessionId: str = Query(default_factory=lambda: str(uuid.uuid4())),
     topK: int = Query(3, description="Number of chunks to retrieve")
 ):
-    start_time = time.time()
-    redacted_q = Redactor.redact(q)
-    
-    # 1. Intent Detection
-    intent = await intent_router.predict_intent(q)
-    logger.info(f"Detected intent for {sessionId}: {intent}")
-
-    # 2. Decision Logic based on Intent
-    chunks = []
-    system_instruction = None
-
-    if intent == Intent.GREETING:
-        system_instruction = "You are a friendly AI assistant. Greet the user warmly and ask how you can help them today. Do NOT use search results."
-    elif intent == Intent.CLOSURE:
-        system_instruction = "The user is finishing the conversation or saying thanks. Respond politely and wish them a great day!"
-    elif intent == Intent.OFF_TOPIC:
-        system_instruction = "You are a helpful AI assistant. The user has asked something outside your specialized knowledge of the uploaded documents. Politely inform them that you are focused on the documentation and ask if they have questions about that."
-    else:
-        # RAG_QUERY: Proceed with retrieval
-        retriever = get_retriever()
-        chunks = retriever.retrieve(q, top_k=topK)
-
-    # 3. Prepare Log Data
-    log_data = {
-        "sessionId": sessionId,
-        "query": redacted_q,
-        "intent": intent,
-        "retrieval_mode": settings.RETRIEVAL_MODE,
-        "mode": settings.MODE,
-        "retrieved_chunks": [c['chunkId'] for c in chunks],
-        "retrieved_scores": [c.get('score', 0) for c in chunks]
-    }
-    
+    run = chat_pipeline.start(q, topK, sessionId)
+
+    # Answer cache: an exact (normalized) repeat skips intent, retrieval and generation
+    cached = chat_pipeline.cached_answer(run)
+    if cached:
+        return stream_cached_answer(cached, run)
+
+    events, rejection = await start_pipeline(run)
+    if rejection is not None:
+        return rejection
+
     async def event_generator():
         try:
-            # 1. Send 'meta' event with citations and intent
-            citations = [
-                {
-                    "id": c.get('chunkId', 'unknown'), 
-                    "title": c.get('meta', {}).get('docTitle', 'Untitled'), 
-                    "score": float(c.get('score', 0))
-                } 
-                for c in chunks
-            ]
-            yield f"event: meta\ndata: {json.dumps({'citations': citations, 'retrievalMode': settings.RETRIEVAL_MODE, 'intent': intent})}\n\n"
-            
-            # 2. Get LLM generator
-            full_response = ""
-            
-            # Handle direct resolution intents (GREETING, CLOSURE, OFF_TOPIC)
-            if intent in [Intent.GREETING, Intent.CLOSURE, Intent.OFF_TOPIC]:
-                if settings.MODE == "none":
-                    if intent == Intent.GREETING:
-                        full_response = "Hello! I am your local AI assistant. How can I help you explore the OpsUI Application today?"
-                    elif intent == Intent.CLOSURE:
-                        full_response = "You're very welcome! If you have more questions later, feel free to ask. Have a great day!"
-                    else:
-                        full_response = "I'm optimized for technical documentation queries. Please ask about the software or app details!"
-                else:
-                    try:
-                        generator = await get_llm_response(settings.MODE, q, chunks, system_instruction)
-                        async for token in generator:
-                            full_response += token
-                            yield f"event: token\ndata: {json.dumps(token)}\n\n"
-                    except Exception as llm_e:
-                        # LLM Fallback for Vertex mode
-                        static_map = {
-                            Intent.GREETING: "Hello! I am your AI assistant. How can I help you today?",
-                            Intent.CLOSURE: "You're welcome! Let me know if you need anything else.",
-                            Intent.OFF_TOPIC: "I'm focused on the technical documentation provided."
-                        }
-                        full_response = static_map.get(intent, "Hello!")
-                
-                if full_response:
-                    yield f"event: token\ndata: {json.dumps(full_response)}\n\n"
-            
-            # Handle RAG_QUERY
-            elif intent == Intent.RAG_QUERY:
-                if not chunks and settings.MODE == "none":
-                    full_response = "I'm sorry, I couldn't find any specific information about that in the documents. Could you please rephrase your question?"
-                    yield f"event: token\ndata: {json.dumps(full_response)}\n\n"
-                else:
-                    try:
-                        generator = await get_llm_response(settings.MODE, q, chunks, system_instruction)
-                        async for token in generator:
-                            full_response += token
-                            yield f"event: token\ndata: {json.dumps(token)}\n\n"
-                    except Exception as e:
-                        err_str = str(e)
-                        if "401" in err_str or "403" in err_str:
-                            logger.warning("Auth error. Refreshing token.")
-                            from app.llm.vertex_r2d2_client import VertexR2D2Client
-                            VertexR2D2Client.refresh_on_error()
-                            yield f"event: token\ndata: {json.dumps('[Auth Error: Token refreshed, please retry]')}\n\n"
-                        else:
-                            yield f"event: token\ndata: {json.dumps(f'[Error: {err_str}]')}\n\n"
-                
-            # 3. Log completion and send 'done'
-            latency = time.time() - start_time
-            log_data['latency'] = latency
-            log_data['response_length'] = len(full_response)
-            logger.info("Chat Request Completed", extra={"structured_data": log_data})
-            
-            yield f"event: done\ndata: {json.dumps({'latency': latency})}\n\n"
-            
+            # Disconnecting only ends this subscription; generation stops once nobody is reading
+            async for kind, payload in until_disconnected(request, events):
+                if kind == "result":
+                    run.record(payload)
+                    continue
+                yield f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+
+            done = chat_pipeline.finish(run, "Chat Request Completed")
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+        except ClientDisconnected:
+            # There is nobody to send 'done' to
+            chat_pipeline.finish(run, "Chat Request Cancelled: client disconnected", client_disconnected=True)
         except Exception as e:
             logger.error(f"Event generator crash: {e}")
             yield f"event: done\ndata: {{}}\n\n"
@@ -142,11 +171,7 @@ async def chat_stream(
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
+        headers=SSE_HEADERS
     )
 
 @router.post("/chat")
@@ -157,87 +182,25 @@ async def chat_post(
     q = body.get("q")
     sessionId = body.get("sessionId", str(uuid.uuid4()))
     topK = body.get("topK", 3)
-    
+
     if not q:
         return JSONResponse({"error": "Missing query"}, status_code=400)
 
-    start_time = time.time()
-    redacted_q = Redactor.redact(q)
-    
-    # Intent Detection
-    intent = await intent_router.predict_intent(q)
-    
-    chunks = []
-    system_instruction = None
-
-    if intent == Intent.GREETING:
-        system_instruction = "You are a friendly AI assistant. Greet the user warmly."
-    elif intent == Intent.CLOSURE:
-        system_instruction = "The user is saying goodbye or thank you. Wish them well."
-    elif intent == Intent.OFF_TOPIC:
-        system_instruction = "Helpful AI assistant, but politely decline off-topic questions."
-    else:
-        retriever = get_retriever()
-        chunks = retriever.retrieve(q, top_k=topK)
-
-    # Generate
-    full_response = ""
-    
-    # Handle direct resolution intents (GREETING, CLOSURE, OFF_TOPIC)
-    if intent in [Intent.GREETING, Intent.CLOSURE, Intent.OFF_TOPIC]:
-        if settings.MODE == "none":
-            if intent == Intent.GREETING:
-                full_response = "Hello! I am your local AI assistant. How can I help you explore the OpsUI Application today?"
-            elif intent == Intent.CLOSURE:
-                full_response = "You're very welcome! Have a great day!"
-            else:
-                full_response = "I'm optimized for technical documentation queries. Please ask about the software!"
-        else:
-            try:
-                generator = await get_llm_response(settings.MODE, q, chunks, system_instruction)
-                async for token in generator:
-                    full_response += token
-            except Exception:
-                # Fallback to static if LLM fails
-                static_map = {
-                    Intent.GREETING: "Hello! I am your AI assistant. How can I help you today?",
-                    Intent.CLOSURE: "You're welcome! Let me know if you need anything else.",
-                    Intent.OFF_TOPIC: "I'm focused on the technical documentation provided."
-                }
-                full_response = static_map.get(intent, "Hello!")
-    
-    # Handle RAG_QUERY
-    elif intent == Intent.RAG_QUERY:
-        if not chunks and settings.MODE == "none":
-            full_response = "I'm sorry, I couldn't find any specific information about that in the documents."
-        else:
-            try:
-                generator = await get_llm_response(settings.MODE, q, chunks, system_instruction)
-                async for token in generator:
-                    full_response += token
-            except Exception as e:
-                full_response = f"[Error: {str(e)}]"
-        
-    latency = time.time() - start_time
-    
-    # Log
-    log_data = {
-        "sessionId": sessionId,
-        "query": redacted_q,
-        "intent": intent,
-        "retrieval_mode": settings.RETRIEVAL_MODE,
-        "mode": settings.MODE,
-        "retrieved_chunks": [c['chunkId'] for c in chunks],
-        "latency": latency
-    }
-    logger.info("Chat POST Request Completed", extra={"structured_data": log_data})
-    
-    return JSONResponse({
-        "answer": full_response,
-        "intent": intent,
-        "citations": [
-            {"id": c['chunkId'], "title": c['meta'].get('docTitle'), "score": c.get('score')} 
-            for c in chunks
-        ],
-        "latency": latency
-    })
+    run = chat_pipeline.start(q, topK, sessionId)
+
+    cached = chat_pipeline.cached_answer(run)
+    if cached:
+        summary = chat_pipeline.finish(
+            run, "Chat POST Request Completed",
+            intent=cached['intent'], answer_cache="hit", response_length=sum(len(t) for t in cached['tokens']),
+        )
+        return JSONResponse(dict(answer="".join(cached['tokens']), intent=cached['intent'], citations=cached['citations'], **summary))
+
+    events, rejection = await start_pipeline(run)
+    if rejection is not None:
+        return rejection
+
+    meta, answer, result = await collect(events)
+    run.record(result)
+    summary = chat_pipeline.finish(run, "Chat POST Request Completed")
+    return JSONResponse(dict(answer=answer, intent=meta['intent'], citations=meta['citations'], **summary))
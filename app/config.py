@@ -10,10 +10,18 @@ class Settings:
     BASE_DIR = Path(__file__).parent.parent.resolve()
     DATA_DIR = (BASE_DIR / "data").resolve()
     LOGS_DIR = (BASE_DIR / "logs").resolve()
+    ARTIFACTS_DIR = (DATA_DIR / "artifacts").resolve()
     
     # Mode Configuration
     MODE = os.getenv("MODE", "vertex")  # vertex | none
-    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "faiss")  # faiss | tfidf | brute
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "faiss")  # faiss | tfidf | brute | hybrid
+    RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", str(min(8, os.cpu_count() or 1))))  # CPU-bound search pool
+    RETRIEVAL_IO_WORKERS = int(os.getenv("RETRIEVAL_IO_WORKERS", "16"))  # query-embedding (network) pool
+    QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))  # max wait to gather concurrent queries, 0 disables
+    QUERY_EMBED_BATCH = int(os.getenv("QUERY_EMBED_BATCH", "16"))  # query embeddings per request
+    SEARCH_BATCH = int(os.getenv("SEARCH_BATCH", "32"))  # query vectors per FAISS search call
+    INDEX_WATCH_INTERVAL = float(os.getenv("INDEX_WATCH_INTERVAL", "10"))  # seconds, 0 disables hot-reload
+    INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() in ("1", "true", "yes")  # memory-map index artifacts so workers share them
     
     # GCP Configuration
     GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
@@ -27,15 +35,90 @@ class Settings:
     R2D2_SOEID_HEADER = os.getenv("R2D2_SOEID_HEADER", "x-r2d2-soeid")
     R2D2_SOEID = os.getenv("R2D2_SOEID")
     HELIX_TOKEN_CMD = os.getenv("HELIX_TOKEN_CMD", "helix auth access-token print -a")
+    HELIX_TOKEN_LIFETIME = float(os.getenv("HELIX_TOKEN_LIFETIME", str(45 * 60)))  # seconds a token is trusted
+    HELIX_TOKEN_TIMEOUT = float(os.getenv("HELIX_TOKEN_TIMEOUT", "30"))  # seconds before the token command is killed
+    TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))  # background refresh this long before expiry
+    TOKEN_MIN_REFRESH_INTERVAL = float(os.getenv("TOKEN_MIN_REFRESH_INTERVAL", "30"))  # ignore auth errors right after a refresh
     SSL_CERT_FILE = os.getenv("SSL_CERT_FILE")
 
+    # Upstream Scheduler (every Vertex call: generation, intent, embeddings)
+    UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))  # calls in flight across all operations
+    UPSTREAM_GENERATE_LIMIT = int(os.getenv("UPSTREAM_GENERATE_LIMIT", "8"))  # concurrent answer streams
+    UPSTREAM_INTENT_LIMIT = int(os.getenv("UPSTREAM_INTENT_LIMIT", "4"))
+    UPSTREAM_QUERY_EMBED_LIMIT = int(os.getenv("UPSTREAM_QUERY_EMBED_LIMIT", "4"))
+    UPSTREAM_BATCH_EMBED_LIMIT = int(os.getenv("UPSTREAM_BATCH_EMBED_LIMIT", "4"))  # index builds / ingestion
+    UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", "1.0"))  # seconds of pause after a 429, doubling per repeat
+    UPSTREAM_HTTP_TIMEOUT = float(os.getenv("UPSTREAM_HTTP_TIMEOUT", "120"))  # seconds per read on pooled connections
+
+    # Circuit Breakers (generation and LLM intent calls)
+    BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # recent calls considered
+    BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))  # calls needed before the circuit can open
+    BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))  # share of failed or slow calls that opens it
+    BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # fallback-only time before probing again
+    BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+    GENERATION_SLOW_SECONDS = float(os.getenv("GENERATION_SLOW_SECONDS", "10"))  # time to first token counted as failure
+    INTENT_SLOW_SECONDS = float(os.getenv("INTENT_SLOW_SECONDS", "3"))
+
+    # Hybrid Retrieval (vector + BM25)
+    HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")  # rrf | weighted
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+    HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+    HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+    HYBRID_LEG_TIMEOUT = float(os.getenv("HYBRID_LEG_TIMEOUT", "2.0"))  # seconds per leg
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # results fetched per leg before fusion
+    HYBRID_WORKERS = int(os.getenv("HYBRID_WORKERS", "8"))
+
+    # Context Packing (prompt passages built from retrieved chunks)
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # estimated tokens, 0 = no cap
+    CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.9"))  # shingle Jaccard
+
+    # Admission Control (chat endpoints; cache hits and, in none mode, greetings etc. bypass it)
+    ADMISSION_RETRIEVAL_LIMIT = int(os.getenv("ADMISSION_RETRIEVAL_LIMIT", "16"))  # requests in intent + retrieval at once
+    ADMISSION_GENERATION_LIMIT = int(os.getenv("ADMISSION_GENERATION_LIMIT", "8"))  # Vertex generations at once
+    ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))  # waiting requests per stage before 503s
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))  # seconds a request may wait for a stage
+    ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))  # Retry-After seconds on a 503
+
+    # Chat Pipeline: per-stage timeouts in seconds, 0 = none. Awaited stages (intent, retrieve,
+    # generate) are cut off; the in-process ones (redact, pack, log) are only flagged when over
+    PIPELINE_REDACT_TIMEOUT = float(os.getenv("PIPELINE_REDACT_TIMEOUT", "0.1"))
+    PIPELINE_INTENT_TIMEOUT = float(os.getenv("PIPELINE_INTENT_TIMEOUT", "5"))  # LLM intent call; then treated as a RAG query
+    PIPELINE_RETRIEVE_TIMEOUT = float(os.getenv("PIPELINE_RETRIEVE_TIMEOUT", "10"))  # then answered without context
+    PIPELINE_PACK_TIMEOUT = float(os.getenv("PIPELINE_PACK_TIMEOUT", "0.5"))
+    PIPELINE_GENERATE_TIMEOUT = float(os.getenv("PIPELINE_GENERATE_TIMEOUT", "120"))  # whole answer, including the wait for a slot
+    PIPELINE_LOG_TIMEOUT = float(os.getenv("PIPELINE_LOG_TIMEOUT", "0.1"))
+
+    # Streaming
+    CHAT_COALESCING = os.getenv("CHAT_COALESCING", "true").lower() in ("1", "true", "yes")  # identical in-flight chat requests share one pipeline run
+    STREAM_DISCONNECT_POLL = float(os.getenv("STREAM_DISCONNECT_POLL", "0.5"))  # seconds between client-disconnect checks
+
+    # Answer Cache (complete RAG responses, keyed by index version)
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))  # 0 disables
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+    ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))  # cosine threshold for near-duplicates, 0 disables
+
+    # Intent Classifier (trained by scripts/train_intent.py)
+    INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", str(ARTIFACTS_DIR / "intent_model.pkl"))
+    INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.7"))  # below this, ask the LLM
+    INTENT_WORKERS = int(os.getenv("INTENT_WORKERS", "16"))  # threads for blocking LLM intent calls
+
     # Embedding Config
     EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))
     EMBED_RETRY = int(os.getenv("EMBED_RETRY", "3"))
+    EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # embedding batches in flight at once
+    EMBED_RPM = float(os.getenv("EMBED_RPM", "0"))  # requests per minute, 0 = unlimited
+    EMBED_TEXTS_PER_MINUTE = float(os.getenv("EMBED_TEXTS_PER_MINUTE", "0"))  # 0 = unlimited
+    EMBED_MAX_BATCH_CHARS = int(os.getenv("EMBED_MAX_BATCH_CHARS", "60000"))  # payload cap per request
+    BUILD_BATCH_SIZE = int(os.getenv("BUILD_BATCH_SIZE", "512"))  # chunks per embed/checkpoint step in build_index
+    EMBED_STORE_PATH = os.getenv("EMBED_STORE_PATH", str(DATA_DIR / "cache" / "chunk_embeddings.sqlite"))  # reused across index builds
+    EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))  # in-memory query embeddings, 0 disables
+    EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "86400"))  # seconds
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")  # SQLite file shared by workers, empty disables
 
     # Ingestion Configuration
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))  # parser processes
     
     # Ensure directories exist
     DATA_DIR.mkdir(exist_ok=True)
@@ -0,0 +1,151 @@
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Dict, Any
+import numpy as np
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Only sentence-ending punctuation is dropped, and only at the end of the query
+_TRAILING_PUNCT = "?!. "
+
+
+def normalize_query(text: str) -> str:
+    """
+    Case, whitespace and trailing '?', '!', '.' variations of a query map to the same key.
+    Other symbols are kept: "C++" and "C#", or "2+2" and "2-2", are different questions.
+    """
+    return " ".join(text.lower().split()).rstrip(_TRAILING_PUNCT)
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed on (embedding model, normalized query text).
+
+    - Memory tier: LRU bounded by max_entries, entries expire after ttl seconds.
+    - Disk tier (optional): SQLite file in WAL mode, so every uvicorn worker on the
+      host shares the embeddings any of them has fetched.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, disk_path: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, path: Path):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(path), check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+            )
+            conn.commit()
+            self._disk = conn
+            logger.info(f"Query embedding disk cache at {path}")
+        except sqlite3.Error as e:
+            logger.error(f"Query embedding disk cache unavailable ({path}): {e}")
+
+    @staticmethod
+    def key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        key = self.key(text, model)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._memory[key]
+
+        vector = self._disk_get(key, now)
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._memory_put(key, vector, now)
+        return vector
+
+    def put(self, text: str, model: str, vector: List[float]):
+        key = self.key(text, model)
+        now = time.time()
+        self._memory_put(key, vector, now)
+        self._disk_put(key, vector, now)
+
+    def _memory_put(self, key: str, vector: List[float], now: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = (now + self.ttl, vector)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[List[float]]:
+        if self._disk is None:
+            return None
+        try:
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT vector, created FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Query embedding disk cache read failed: {e}")
+            return None
+        if row is None or row[1] + self.ttl <= now:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def _disk_put(self, key: str, vector: List[float], now: float):
+        if self._disk is None:
+            return
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        try:
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector, created) VALUES (?, ?, ?)",
+                    (key, blob, now),
+                )
+                self._disk.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Query embedding disk cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._memory),
+                "disk": self._disk is not None,
+            }
+
+
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=settings.EMBED_CACHE_SIZE,
+    ttl=settings.EMBED_CACHE_TTL,
+    disk_path=Path(settings.EMBED_CACHE_PATH) if settings.EMBED_CACHE_PATH else None,
+)
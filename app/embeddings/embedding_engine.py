@@ -0,0 +1,273 @@
+import re
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Callable, Optional, Dict, Any
+from app.config import settings
+from app.llm.upstream import is_rate_limited
+
+logger = logging.getLogger(__name__)
+
+# 429s are expected under load and retried with backoff, but not forever
+_MAX_RATE_LIMIT_RETRIES = 10
+
+
+# Wording of Vertex's 400s for a request that is too big (tokens, instances or payload)
+_SIZE_HINTS = ("too large", "too long", "exceed", "token count", "maximum")
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP status of an API error: google.genai errors carry .code and start with it."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    match = re.match(r"\s*(\d{3})\b", str(error))
+    return int(match.group(1)) if match else None
+
+
+def is_auth_error(error: Exception) -> bool:
+    return error_status(error) in (401, 403)
+
+
+def is_size_error(error: Exception) -> bool:
+    """The batch is too big for one request; smaller batches can succeed."""
+    status = error_status(error)
+    return status == 413 or (status == 400 and any(hint in str(error).lower() for hint in _SIZE_HINTS))
+
+
+def is_non_retryable(error: Exception) -> bool:
+    """
+    Invalid argument, permission, model not found and the like: client errors that fail the
+    same way on every retry and for every part of the batch.
+    """
+    status = error_status(error)
+    return status is not None and 400 <= status < 500 and status not in (408, 429) and not is_size_error(error)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute, with a burst of
+    about one second's worth of tokens. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(self.rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        """Blocks until amount tokens are available, then takes them."""
+        if self.rate <= 0:
+            return
+        # A request larger than the bucket waits for a full bucket and leaves it in debt,
+        # which later callers pay off
+        needed = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class EmbeddingEngine:
+    """
+    Embeds a list of texts with several batches in flight at once.
+
+    - concurrency: batches sent in parallel (one worker thread each)
+    - request_bucket / text_bucket: requests-per-minute and texts-per-minute limits
+    - batch size and in-flight limit adapt: both are halved when the endpoint answers 429,
+      then grown back (batch size by one per success, in-flight limit by one per round of
+      successes) up to max_batch / concurrency; a batch is also cut at max_batch_chars
+    - a batch that keeps failing on transient errors (5xx, timeouts, connection errors) is
+      split in half rather than retried text by text; one rejected as too large is split at
+      once; other client errors (400, 403, 404) raise at once, after at most one retry with
+      a refreshed token for 401/403
+
+    embed_batch_fn is a single API call (list of texts -> list of vectors), so the engine
+    can be pointed at a fake embedding server or a plain function. When its calls go
+    through a scheduler that already pauses everyone after a 429, rate_limit_pause returns
+    the end of that pause (time.monotonic()) and the engine waits for it instead of adding
+    a backoff of its own.
+    """
+
+    def __init__(self, embed_batch_fn: Callable[[List[str]], List[List[float]]],
+                 concurrency: int, max_batch: int, max_batch_chars: int,
+                 requests_per_minute: float = 0, texts_per_minute: float = 0, retry: int = 3,
+                 on_auth_error: Optional[Callable[[], None]] = None,
+                 rate_limit_pause: Optional[Callable[[], float]] = None):
+        self.embed_batch_fn = embed_batch_fn
+        self.concurrency = max(1, concurrency)
+        self.max_batch = max(1, max_batch)
+        self.max_batch_chars = max_batch_chars
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.text_bucket = TokenBucket(texts_per_minute)
+        self.retry = max(1, retry)
+        self.on_auth_error = on_auth_error
+        self.rate_limit_pause = rate_limit_pause
+        self.batch_size = self.max_batch
+        self.in_flight_limit = self.concurrency
+        self._successes = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embedding")
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "rateLimited": 0, "retries": 0, "splits": 0}
+
+    def _next_batch(self, texts: List[str], start: int, end: int) -> int:
+        """End index of the next batch carved from texts[start:end]."""
+        with self._lock:
+            size = self.batch_size
+        stop = min(end, start + size)
+        if self.max_batch_chars > 0:
+            chars = 0
+            for i in range(start, stop):
+                chars += len(texts[i])
+                if chars > self.max_batch_chars and i > start:
+                    return i
+        return stop
+
+    def _call(self, batch: List[str]) -> List[List[float]]:
+        self.request_bucket.acquire(1)
+        self.text_bucket.acquire(len(batch))
+        vectors = self.embed_batch_fn(batch)
+        if len(vectors) != len(batch):
+            raise RuntimeError(f"Embedding endpoint returned {len(vectors)} vectors for {len(batch)} texts")
+        return vectors
+
+    def _on_success(self, count: int):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["texts"] += count
+            self.batch_size = min(self.max_batch, self.batch_size + 1)
+            self._successes += 1
+            if self._successes >= self.in_flight_limit:
+                self._successes = 0
+                self.in_flight_limit = min(self.concurrency, self.in_flight_limit + 1)
+
+    def _on_rate_limited(self):
+        with self._lock:
+            self._stats["rateLimited"] += 1
+            self.batch_size = max(1, self.batch_size // 2)
+            self.in_flight_limit = max(1, self.in_flight_limit // 2)
+            self._successes = 0
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Returns one vector per text, in input order."""
+        if not texts:
+            return []
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        # Work items: [start, end, failures, throttles, not_before]; requeued items go to the front
+        pending = deque([[0, len(texts), 0, 0, 0.0]])
+        in_flight: Dict[Any, list] = {}
+        # Set on 429: the whole endpoint is saturated, so nothing new is sent before this time
+        resume_at = 0.0
+
+        while pending or in_flight:
+            now = time.monotonic()
+            while len(in_flight) < self.in_flight_limit and now >= resume_at:
+                item = next((it for it in pending if it[4] <= now), None)
+                if item is None:
+                    break
+                pending.remove(item)
+                start, end = item[0], item[1]
+                stop = self._next_batch(texts, start, end)
+                if stop < end:
+                    pending.appendleft([stop, end, 0, 0, 0.0])
+                future = self._executor.submit(self._call, texts[start:stop])
+                in_flight[future] = [start, stop, item[2], item[3], 0.0]
+
+            timeout = None
+            if pending and len(in_flight) < self.in_flight_limit:
+                # Below the in-flight cap with nothing sent: the next batch is held back by its
+                # retry delay or the 429 pause, so wake when that ends. At the cap, only a
+                # finishing batch can change anything
+                next_at = max(resume_at, min(it[4] for it in pending))
+                timeout = max(0.0, next_at - now)
+            if not in_flight:
+                time.sleep(timeout or 0.0)
+                continue
+
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    resume_at = max(resume_at, self._handle_failure(e, item, pending))
+                    continue
+                results[item[0]:item[1]] = vectors
+                self._on_success(item[1] - item[0])
+
+        return results
+
+    def _handle_failure(self, error: Exception, item: list, pending: deque) -> float:
+        """Requeues a failed batch; returns the time before which no new batch may be sent."""
+        start, stop, failures, throttles = item[:4]
+        if is_rate_limited(error) and throttles < _MAX_RATE_LIMIT_RETRIES:
+            self._on_rate_limited()
+            if self.rate_limit_pause is not None:
+                resume_at = self.rate_limit_pause()
+            else:
+                resume_at = time.monotonic() + min(0.5 * 2 ** throttles, 30)
+            logger.warning(
+                f"Rate limited; batch size now {self.batch_size}, {self.in_flight_limit} in flight, "
+                f"pausing {max(0.0, resume_at - time.monotonic()):.1f}s."
+            )
+            pending.appendleft([start, stop, failures, throttles + 1, 0.0])
+            return resume_at
+
+        if is_auth_error(error) and self.on_auth_error:
+            logger.warning("Auth error during embedding. Refreshing token.")
+            self.on_auth_error()
+
+        if is_non_retryable(error):
+            # An expired token is the one client error a retry can fix, and only once
+            if not (is_auth_error(error) and self.on_auth_error and failures == 0):
+                raise error
+            with self._lock:
+                self._stats["retries"] += 1
+            pending.appendleft([start, stop, failures + 1, throttles, 0.0])
+            return 0.0
+
+        if not is_size_error(error) and failures + 1 < self.retry:
+            with self._lock:
+                self._stats["retries"] += 1
+            logger.warning(f"Embedding batch [{start}:{stop}] attempt {failures} failed: {error}")
+            pending.appendleft([start, stop, failures + 1, throttles, time.monotonic() + 2 ** failures])
+            return 0.0
+        if stop - start > 1:
+            mid = (start + stop) // 2
+            logger.error(f"Embedding batch [{start}:{stop}] failed: {error}. Splitting in half.")
+            with self._lock:
+                self._stats["splits"] += 1
+            pending.appendleft([mid, stop, 0, throttles, 0.0])
+            pending.appendleft([start, mid, 0, throttles, 0.0])
+            return 0.0
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, batchSize=self.batch_size, inFlightLimit=self.in_flight_limit)
+
+
+def create_engine(embed_batch_fn: Callable[[List[str]], List[List[float]]],
+                  on_auth_error: Optional[Callable[[], None]] = None,
+                  rate_limit_pause: Optional[Callable[[], float]] = None) -> EmbeddingEngine:
+    return EmbeddingEngine(
+        embed_batch_fn,
+        concurrency=settings.EMBED_CONCURRENCY,
+        max_batch=settings.EMBED_BATCH_SIZE,
+        max_batch_chars=settings.EMBED_MAX_BATCH_CHARS,
+        requests_per_minute=settings.EMBED_RPM,
+        texts_per_minute=settings.EMBED_TEXTS_PER_MINUTE,
+        retry=settings.EMBED_RETRY,
+        on_auth_error=on_auth_error,
+        rate_limit_pause=rate_limit_pause,
+    )
@@ -0,0 +1,90 @@
+import sqlite3
+import hashlib
+import logging
+from pathlib import Path
+from typing import List, Dict, Callable, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on bound parameters is 999
+_QUERY_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent chunk embeddings keyed on (sha256 of chunk text, embedding model).
+    Lets index builds reuse vectors for unchanged chunks instead of re-embedding the corpus.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings "
+            "(hash TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (hash, model))"
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes: List[str], model: str) -> Dict[str, np.ndarray]:
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), _QUERY_BATCH):
+            batch = unique[i:i + _QUERY_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT hash, vector FROM chunk_embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [model, *batch],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray], model: str):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunk_embeddings (hash, model, vector) VALUES (?, ?, ?)",
+            [(h, model, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items.items()],
+        )
+        self._conn.commit()
+
+    def count(self, model: str) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM chunk_embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+def embed_with_store(texts: List[str], store: EmbeddingStore, model: str,
+                     embed_fn: Callable[[List[str]], List[List[float]]],
+                     persist_every: int = 256) -> Tuple[np.ndarray, int, int]:
+    """
+    Returns (float32 matrix aligned with texts, vectors reused, vectors fetched).
+    Only texts missing from the store (deduplicated) go through embed_fn. Vectors are
+    persisted every persist_every texts, so an interrupted build keeps what it already paid for.
+    """
+    hashes = [text_hash(t) for t in texts]
+    known = store.get_many(hashes, model)
+
+    missing = {}
+    for h, text in zip(hashes, texts):
+        if h not in known and h not in missing:
+            missing[h] = text
+
+    pending = list(missing.items())
+    for i in range(0, len(pending), persist_every):
+        batch = pending[i:i + persist_every]
+        fetched = embed_fn([text for _, text in batch])
+        new_vectors = {h: np.asarray(v, dtype=np.float32) for (h, _), v in zip(batch, fetched)}
+        store.put_many(new_vectors, model)
+        known.update(new_vectors)
+
+    # Duplicate chunk texts within the batch count as reused after their first fetch
+    reused = len(texts) - len(missing)
+    matrix = np.stack([known[h] for h in hashes]) if hashes else np.empty((0, 0), dtype=np.float32)
+    return matrix, reused, len(missing)
@@ -1,76 +1,96 @@
 import logging
-import time
-from typing import List
+import threading
+from functools import partial
+from typing import Dict, List, Optional
 from app.config import settings
 from app.llm.vertex_r2d2_client import VertexR2D2Client
+from app.embeddings.embedding_cache import query_embedding_cache
+from app.embeddings.embedding_engine import EmbeddingEngine, create_engine
+from app.llm.upstream import upstream_scheduler, BATCH_EMBED, QUERY_EMBED
+from app.utils.micro_batcher import MicroBatcher
 from google.genai.types import EmbedContentConfig
 
 logger = logging.getLogger(__name__)
 
 class VertexEmbedder:
+    _engines: Dict[str, EmbeddingEngine] = {}
+    _query_batcher: Optional[MicroBatcher] = None
+    _engine_lock = threading.Lock()
+
     def __init__(self):
         self.model = settings.VERTEX_EMBEDDING_MODEL
-        self.retry_count = settings.EMBED_RETRY
 
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
         """
-        Embeds a list of texts using Vertex AI via R2D2 using adaptive batching.
+        Embeds a list of texts using Vertex AI via R2D2. Batches run concurrently under the
+        configured rate limits, with adaptive batch sizes (see EmbeddingEngine); order is preserved.
         """
-        results = []
-        batch_size = settings.EMBED_BATCH_SIZE
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
-            try:
-                batch_embeddings = self._embed_batch_with_retry(batch)
-                results.extend(batch_embeddings)
-            except Exception as e:
-                logger.error(f"Batch embedding failed: {e}. Falling back to sequential embedding.")
-                # Fallback: Sequential
-                for text in batch:
-                    try:
-                        single_res = self._embed_batch_with_retry([text])
-                        results.extend(single_res)
-                    except Exception as inner_e:
-                        logger.error(f"Single embedding failed for text snippet: {inner_e}")
-                        # Return zero vector or skip (here we assume downstream handles filtering or crashing is acceptable)
-                        # For generated index consistency, we should probably raise or return empty
-                        raise inner_e
-        return results
+        return self.engine().embed(texts)
 
     def embed_query(self, text: str) -> List[float]:
-        """Embeds a single query string."""
-        return self.embed_texts([text])[0]
+        """Embeds a single query string, served from the query embedding cache when possible."""
+        cached = query_embedding_cache.get(text, self.model)
+        if cached is not None:
+            return cached
+        # Concurrent queries share one embed_content call (see query_batcher)
+        embedding = self.query_batcher().call(text)
+        query_embedding_cache.put(text, self.model, embedding)
+        return embedding
+
+    @classmethod
+    def engine(cls, operation: str = BATCH_EMBED) -> EmbeddingEngine:
+        """
+        Process-wide engine per upstream operation, so rate limits and the adapted batch size
+        hold across embedder instances, and query embeddings never wait behind a bulk build.
+        """
+        engine = cls._engines.get(operation)
+        if engine is None:
+            with cls._engine_lock:
+                engine = cls._engines.get(operation)
+                if engine is None:
+                    engine = create_engine(
+                        partial(cls._embed_batch, operation=operation),
+                        on_auth_error=VertexR2D2Client.refresh_on_error,
+                        # The scheduler owns the 429 backoff shared by every Vertex caller
+                        rate_limit_pause=upstream_scheduler.paused_until,
+                    )
+                    cls._engines[operation] = engine
+        return engine
+
+    @classmethod
+    def query_batcher(cls) -> MicroBatcher:
+        """
+        Gathers query embeddings requested at about the same time into one request, on the
+        query engine (separate from bulk embedding, and ahead of it in the upstream queue).
+        """
+        if cls._query_batcher is None:
+            with cls._engine_lock:
+                if cls._query_batcher is None:
+                    cls._query_batcher = MicroBatcher(
+                        "query_embed",
+                        cls._embed_queries,
+                        max_batch=settings.QUERY_EMBED_BATCH,
+                        max_wait=settings.QUERY_BATCH_WAIT_MS / 1000,
+                        max_running=settings.UPSTREAM_QUERY_EMBED_LIMIT,
+                    )
+        return cls._query_batcher
+
+    @classmethod
+    def _embed_queries(cls, texts: List[str]) -> List[List[float]]:
+        # The same question asked by several users at once is embedded once
+        unique = list(dict.fromkeys(texts))
+        vectors = dict(zip(unique, cls.engine(QUERY_EMBED).embed(unique)))
+        return [vectors[t] for t in texts]
 
-    def _embed_batch_with_retry(self, texts: List[str]) -> List[List[float]]:
-        """Helpers to call the API with retry logic for 401/429."""
+    @staticmethod
+    def _embed_batch(texts: List[str], operation: str = BATCH_EMBED) -> List[List[float]]:
+        """One embed_content call; retries, backoff and batching are handled by the engine."""
         client = VertexR2D2Client.get_client()
-        
-        for attempt in range(self.retry_count):
-            try:
-                response = client.models.embed_content(
-                    model=self.model,
-                    contents=texts,
-                    config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT") # Adjust based on use-case
-                )
-                # response.embeddings is a list of ContentEmbedding objects
-                return [e.values for e in response.embeddings]
-            
-            except Exception as e:
-                err_str = str(e)
-                if "401" in err_str or "403" in err_str:
-                    logger.warning("Auth error during embedding. Refreshing token.")
-                    VertexR2D2Client.refresh_on_error()
-                    client = VertexR2D2Client.get_client() # Get fresh client
-                elif "429" in err_str:
-                    wait_time = 2 ** attempt
-                    logger.warning(f"Rate limited. Waiting {wait_time}s.")
-                    time.sleep(wait_time)
-                else:
-                    # If it's not a transient error we can fix, iterate or re-raise
-                    if attempt == self.retry_count - 1:
-                        raise e
-                    logger.warning(f"Embedding attempt {attempt} failed: {e}")
-                    time.sleep(1)
-        
-        raise RuntimeError("Embedding failed after retries")
+        with upstream_scheduler.slot(operation):
+            response = client.models.embed_content(
+                model=settings.VERTEX_EMBEDDING_MODEL,
+                contents=texts,
+                config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT") # Adjust based on use-case
+            )
+        # response.embeddings is a list of ContentEmbedding objects
+        return [e.values for e in response.embeddings]
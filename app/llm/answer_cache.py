@@ -0,0 +1,153 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from app.config import settings
+from app.embeddings.embedding_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+class AnswerCache:
+    """
+    Cache of complete RAG answers (citations + generated tokens).
+
+    Entries are keyed on (index version, topK, normalized query); a new index build
+    therefore never serves answers grounded in the old one. When a similarity threshold
+    is configured, a query that misses exactly can still hit an entry whose query
+    embedding has cosine similarity >= threshold (near-duplicate phrasing).
+    """
+
+    def __init__(self, max_entries: int, ttl: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        # Unit query embeddings, one row per entry that has one, kept up to date on put and
+        # removal so a lookup is a single matrix-vector product. Freed rows are zeroed and reused
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: List[Optional[Tuple]] = []
+        self._rows: Dict[Tuple, int] = {}
+        self._free_rows: List[int] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.similarity_threshold > 0
+
+    def get(self, query: str, top_k: int, version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Exact lookup on the normalized query. Cheap; done before any upstream call."""
+        key = (version, top_k, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expiresAt"] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+        return None
+
+    def get_similar(self, query_embedding: List[float], top_k: int, version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Near-duplicate lookup by cosine similarity of query embeddings."""
+        if not self.semantic_enabled or query_embedding is None:
+            return None
+        query_vec = self._unit(query_embedding)
+        now = time.time()
+
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(query_vec):
+                return None
+            similarities = self._matrix[:len(self._row_keys)] @ query_vec
+            # Best first; rows of other versions / topK are skipped, freed rows score 0
+            candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+            for row in candidates[np.argsort(-similarities[candidates], kind="stable")]:
+                key = self._row_keys[row]
+                if key is None or key[0] != version or key[1] != top_k:
+                    continue
+                entry = self._entries[key]
+                if entry["expiresAt"] <= now:
+                    continue
+                self._entries.move_to_end(key)
+                self.semantic_hits += 1
+                return dict(entry, similarity=float(similarities[row]))
+        return None
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, query: str, top_k: int, version: Optional[str], intent: str,
+            citations: List[Dict[str, Any]], tokens: List[str], query_embedding: Optional[List[float]] = None):
+        if self.max_entries <= 0:
+            return
+        key = (version, top_k, normalize_query(query))
+        entry = {
+            "intent": intent,
+            "citations": citations,
+            "tokens": tokens,
+            "embedding": self._unit(query_embedding) if query_embedding is not None else None,
+            "expiresAt": time.time() + self.ttl,
+        }
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            # Entries from superseded index versions can never hit again
+            for stale in [k for k in self._entries if k[0] != version]:
+                self._remove(stale)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            if entry["embedding"] is not None:
+                self._add_row(key, entry["embedding"])
+
+    def _add_row(self, key: Tuple, vector: np.ndarray):
+        if self._matrix is None or self._matrix.shape[1] != len(vector):
+            # First embedding, or the embedding model changed and older ones can't be compared
+            self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            self._row_keys = []
+            self._rows = {}
+            self._free_rows = []
+            for other, entry in self._entries.items():
+                if other != key:
+                    entry["embedding"] = None
+        row = self._free_rows.pop() if self._free_rows else len(self._row_keys)
+        if row == len(self._row_keys):
+            self._row_keys.append(None)
+        self._matrix[row] = vector
+        self._row_keys[row] = key
+        self._rows[key] = row
+
+    def _remove(self, key: Tuple):
+        del self._entries[key]
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._matrix[row] = 0
+            self._row_keys[row] = None
+            self._free_rows.append(row)
+
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "semanticHits": self.semantic_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_SIZE,
+    ttl=settings.ANSWER_CACHE_TTL,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY,
+)
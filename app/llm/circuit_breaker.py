@@ -0,0 +1,151 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last `window` calls to an upstream. A call fails when it raises
+    or takes longer than slow_seconds. Once at least min_calls are recorded and the failure
+    share reaches failure_rate the circuit opens: allow() returns False, so callers take their
+    fallback at once instead of waiting on a failing upstream. After open_seconds it is
+    half-open and lets half_open_probes calls through; a good probe closes it, a bad one
+    reopens it.
+
+    Callers that get True from allow() report back with record_success(latency),
+    record_failure() or, for a call abandoned before it showed either, release().
+    """
+
+    def __init__(self, name: str, window: int, min_calls: int, failure_rate: float,
+                 slow_seconds: float, open_seconds: float, half_open_probes: int = 1):
+        self.name = name
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self._outcomes = deque(maxlen=max(1, window))  # True = failed or slow
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0, "slowCalls": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self._state
+
+    def _update_state(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit '{self.name}' half-open: probing upstream")
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._update_state(now)
+            if self._state == CLOSED:
+                return True
+            # A probe that never reported back (caller went away) doesn't block recovery
+            if self._state == HALF_OPEN and (
+                self._probes < self.half_open_probes or now - self._probe_started > self.open_seconds
+            ):
+                if self._probes >= self.half_open_probes:
+                    self._probes = 0
+                self._probes += 1
+                self._probe_started = now
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def _open(self, now: float, reason: str):
+        self._state = OPEN
+        self._opened_at = now
+        self._stats["opened"] += 1
+        logger.warning(f"Circuit '{self.name}' opened for {self.open_seconds:g}s: {reason}")
+
+    def _record(self, failed: bool):
+        now = time.monotonic()
+        if self._state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._open(now, "probe failed")
+            else:
+                self._state = CLOSED
+                self._outcomes.clear()
+                logger.info(f"Circuit '{self.name}' closed: probe succeeded")
+            return
+        if self._state == OPEN:
+            # Late report from a call admitted before the circuit opened
+            return
+        self._outcomes.append(failed)
+        failures = sum(self._outcomes)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._open(now, f"{failures}/{len(self._outcomes)} recent calls failed or were slow")
+
+    def record_success(self, latency: float):
+        with self._lock:
+            slow = self.slow_seconds > 0 and latency > self.slow_seconds
+            if slow:
+                self._stats["slowCalls"] += 1
+            self._record(slow)
+
+    def record_failure(self):
+        with self._lock:
+            self._record(True)
+
+    def release(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._update_state(now)
+            calls = len(self._outcomes)
+            return dict(
+                self._stats,
+                state=self._state,
+                recentCalls=calls,
+                failureRate=sum(self._outcomes) / calls if calls else 0.0,
+                retryIn=max(0.0, self._opened_at + self.open_seconds - now) if self._state == OPEN else 0.0,
+            )
+
+
+def _create_breaker(name: str, slow_seconds: float) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        window=settings.BREAKER_WINDOW,
+        min_calls=settings.BREAKER_MIN_CALLS,
+        failure_rate=settings.BREAKER_FAILURE_RATE,
+        slow_seconds=slow_seconds,
+        open_seconds=settings.BREAKER_OPEN_SECONDS,
+        half_open_probes=settings.BREAKER_HALF_OPEN_PROBES,
+    )
+
+
+# Generation latency is time to first token
+generation_breaker = _create_breaker("generation", settings.GENERATION_SLOW_SECONDS)
+intent_breaker = _create_breaker("intent", settings.INTENT_SLOW_SECONDS)
+
+
+def breaker_states() -> Dict[str, str]:
+    return {"generation": generation_breaker.state, "intent": intent_breaker.state}
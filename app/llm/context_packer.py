@@ -0,0 +1,149 @@
+import re
+import logging
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a Gemini token in English text; good enough for budgeting, no tokenizer needed
+CHARS_PER_TOKEN = 4
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _chunk_index(chunk: Dict[str, Any]) -> Optional[int]:
+    """Position of the chunk in its document, from the '<docId>_<n>' chunk id."""
+    _, _, suffix = str(chunk.get('chunkId', '')).rpartition('_')
+    return int(suffix) if suffix.isdigit() else None
+
+
+def _merge_text(first: str, second: str) -> Optional[str]:
+    """first + second with their shared overlap written once, or None if they don't overlap."""
+    if second in first:
+        return first
+    probe = second[:32]
+    pos = first.find(probe, max(0, len(first) - len(second)))
+    while pos != -1:
+        if second.startswith(first[pos:]):
+            return first + second[len(first) - pos:]
+        pos = first.find(probe, pos + 1)
+    return None
+
+
+def _shingles(text: str) -> set:
+    words = _WORD_PATTERN.findall(text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+class PackedContext:
+    def __init__(self, passages: List[Dict[str, Any]], input_tokens: int, dropped: int, duplicates: int):
+        self.passages = passages
+        self.input_tokens = input_tokens
+        self.tokens = sum(estimate_tokens(p['text']) for p in passages)
+        self.dropped = dropped
+        self.duplicates = duplicates
+
+    @property
+    def chunk_ids(self) -> set:
+        """Every retrieved chunk whose text made it into the prompt."""
+        return {chunk_id for p in self.passages for chunk_id in p['chunkIds']}
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "passages": len(self.passages),
+            "tokens": self.tokens,
+            "tokensSaved": self.input_tokens - self.tokens,
+            "duplicates": self.duplicates,
+            "droppedForBudget": self.dropped,
+        }
+
+
+def _merge_document(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merges chunks of one document that overlap or are next to each other into passages."""
+    ordered = sorted(chunks, key=lambda c: (_chunk_index(c) is None, _chunk_index(c) or 0))
+    passages = []
+    for chunk in ordered:
+        index = _chunk_index(chunk)
+        last = passages[-1] if passages else None
+        if last is not None and index is not None and last['lastIndex'] is not None:
+            merged = _merge_text(last['text'], chunk['text'])
+            if merged is None and index == last['lastIndex'] + 1:
+                merged = last['text'] + "\n" + chunk['text']
+            if merged is not None:
+                last['text'] = merged
+                last['chunkIds'].append(chunk['chunkId'])
+                last['score'] = max(last['score'], chunk.get('score', 0.0))
+                last['lastIndex'] = index
+                if chunk['meta'].get('pageEnd'):
+                    last['meta']['pageEnd'] = max(last['meta'].get('pageEnd', 0), chunk['meta']['pageEnd'])
+                continue
+        passages.append({
+            "chunkId": chunk['chunkId'],
+            "chunkIds": [chunk['chunkId']],
+            "text": chunk['text'],
+            "meta": dict(chunk['meta']),
+            "score": chunk.get('score', 0.0),
+            "lastIndex": index,
+        })
+    return passages
+
+
+def pack_context(chunks: List[Dict[str, Any]], token_budget: int, duplicate_threshold: float) -> PackedContext:
+    """
+    Turns retrieved chunks into prompt passages:
+      1. chunks of the same document that overlap or are adjacent become one passage,
+         with the overlapping text written once;
+      2. passages whose 3-word shingles overlap an already kept passage by at least
+         duplicate_threshold (Jaccard) are dropped; their chunk ids stay with the kept one;
+      3. passages are taken in score order while they fit token_budget (0 = no budget).
+    Passages keep the chunk dict shape ('chunkId', 'text', 'meta', 'score') plus 'chunkIds'.
+    """
+    input_tokens = sum(estimate_tokens(c['text']) for c in chunks)
+
+    by_doc = defaultdict(list)
+    for chunk in chunks:
+        by_doc[chunk.get('meta', {}).get('docId') or chunk.get('chunkId')].append(chunk)
+    passages = [p for doc_chunks in by_doc.values() for p in _merge_document(doc_chunks)]
+    passages.sort(key=lambda p: p['score'], reverse=True)
+
+    kept: List[Tuple[Dict[str, Any], set]] = []
+    duplicates = 0
+    for passage in passages:
+        shingles = _shingles(passage['text'])
+        twin = next(
+            (k for k, k_shingles in kept
+             if len(shingles & k_shingles) / max(1, len(shingles | k_shingles)) >= duplicate_threshold),
+            None,
+        )
+        if twin is not None:
+            twin['chunkIds'].extend(passage['chunkIds'])
+            duplicates += 1
+            continue
+        kept.append((passage, shingles))
+
+    selected, used, dropped = [], 0, 0
+    for passage, _ in kept:
+        tokens = estimate_tokens(passage['text'])
+        if token_budget > 0 and used + tokens > token_budget:
+            if selected:
+                dropped += 1
+                continue
+            # The best passage alone is over budget: keep its beginning rather than nothing
+            passage['text'] = passage['text'][:token_budget * CHARS_PER_TOKEN]
+            tokens = estimate_tokens(passage['text'])
+        passage.pop('lastIndex', None)
+        selected.append(passage)
+        used += tokens
+
+    packed = PackedContext(selected, input_tokens, dropped, duplicates)
+    logger.info(f"Context packed: {len(chunks)} chunks -> {packed.report()}")
+    return packed
+
+
+def pack_for_prompt(chunks: List[Dict[str, Any]]) -> PackedContext:
+    return pack_context(chunks, settings.CONTEXT_TOKEN_BUDGET, settings.CONTEXT_DUPLICATE_THRESHOLD)
@@ -0,0 +1,102 @@
+import json
+import pickle
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+from sklearn.pipeline import FeatureUnion, Pipeline
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def load_labeled_queries(path: Path) -> Tuple[List[str], List[str]]:
+    """Reads a JSONL file of {"query": ..., "intent": ...} lines."""
+    queries, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            queries.append(row["query"])
+            labels.append(row["intent"])
+    return queries, labels
+
+
+class IntentClassifier:
+    """
+    Local intent model: word + character n-gram TF-IDF features into a logistic regression.
+    predict() returns the most likely intent with its probability, so callers can send
+    low-confidence queries to the LLM instead.
+    """
+
+    def __init__(self, pipeline: Pipeline):
+        self.pipeline = pipeline
+
+    @classmethod
+    def train(cls, queries: List[str], labels: List[str]) -> "IntentClassifier":
+        features = FeatureUnion([
+            ("words", TfidfVectorizer(lowercase=True, ngram_range=(1, 2), sublinear_tf=True)),
+            # Character n-grams cope with typos and short, one-word queries
+            ("chars", TfidfVectorizer(lowercase=True, analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True)),
+        ])
+        pipeline = Pipeline([
+            ("features", features),
+            ("model", LogisticRegression(max_iter=1000, C=10.0, class_weight="balanced")),
+        ])
+        pipeline.fit(queries, labels)
+        return cls(pipeline)
+
+    def predict(self, query: str) -> Tuple[str, float]:
+        probabilities = self.pipeline.predict_proba([query])[0]
+        best = probabilities.argmax()
+        return str(self.pipeline.classes_[best]), float(probabilities[best])
+
+    def predict_many(self, queries: List[str]) -> List[Tuple[str, float]]:
+        probabilities = self.pipeline.predict_proba(queries)
+        classes = self.pipeline.classes_
+        return [(str(classes[row.argmax()]), float(row.max())) for row in probabilities]
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.pipeline, f)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentClassifier":
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+
+_classifier: Optional[IntentClassifier] = None
+_classifier_mtime: Optional[float] = None
+_lock = threading.Lock()
+
+
+def get_intent_classifier() -> Optional[IntentClassifier]:
+    """
+    The trained model at INTENT_MODEL_PATH, or None if there is none.
+    Reloaded when the file changes, so retraining needs no restart.
+    """
+    global _classifier, _classifier_mtime
+    path = Path(settings.INTENT_MODEL_PATH)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    if mtime != _classifier_mtime:
+        with _lock:
+            if mtime != _classifier_mtime:
+                try:
+                    _classifier = IntentClassifier.load(path)
+                    logger.info(f"Loaded intent classifier from {path}")
+                except Exception as e:
+                    logger.error(f"Failed to load intent classifier {path}: {e}")
+                    _classifier = None
+                _classifier_mtime = mtime
+    return _classifier
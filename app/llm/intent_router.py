@@ -1,9 +1,15 @@
 import logging
 import json
 import re
+import time
+from typing import Optional
 from google.genai import types
 from app.config import settings
 from app.llm.vertex_r2d2_client import VertexR2D2Client
+from app.llm.intent_classifier import get_intent_classifier
+from app.llm.upstream import upstream_scheduler, INTENT
+from app.llm.circuit_breaker import intent_breaker, CircuitOpenError
+from app.utils.executor import get_executor, run_blocking
 
 logger = logging.getLogger(__name__)
 
@@ -45,21 +51,8 @@ def resolve_local_intent(query: str) -> str:
         
     return None
 
-async def predict_intent(query: str) -> str:
-    """
-    Classifies the user query into GREETING, CLOSURE, OFF_TOPIC, or RAG_QUERY.
-    """
-    # 1. Try local resolution first (Fast & Free)
-    local_intent = resolve_local_intent(query)
-    if local_intent:
-        logger.info(f"Local intent resolved: {local_intent}")
-        return local_intent
-
-    # 2. Local fallback if in NONE mode
-    if settings.MODE == "none":
-        return Intent.RAG_QUERY
-
-    # 3. Use Vertex AI for complex intent detection
+def classify_with_llm(query: str) -> str:
+    """Asks Gemini for the intent. Raises on upstream errors, and at once while the intent circuit is open."""
     prompt = f"""
     Classify the following user query into one of these categories:
     - GREETING: General greetings like "hello", "hi", "how are you".
@@ -72,27 +65,72 @@ async def predict_intent(query: str) -> str:
     Return ONLY the category name in uppercase.
     Category:"""
 
+    # While the intent circuit is open, fail at once so callers use their local fallback
+    if not intent_breaker.allow():
+        raise CircuitOpenError("intent circuit open")
+
     try:
         client = VertexR2D2Client.get_client()
+    except Exception:
+        intent_breaker.record_failure()
+        raise
+    
+    config = types.GenerateContentConfig(
+        temperature=0.0,
+        max_output_tokens=10,
+    )
+
+    with upstream_scheduler.slot(INTENT):
+        started = time.monotonic()
+        try:
+            response = client.models.generate_content(
+                model=settings.VERTEX_GENERATION_MODEL,
+                contents=prompt,
+                config=config
+            )
+        except Exception:
+            intent_breaker.record_failure()
+            raise
+        intent_breaker.record_success(time.monotonic() - started)
+
+    intent = response.text.strip().upper()
+    
+    valid_intents = [Intent.GREETING, Intent.CLOSURE, Intent.OFF_TOPIC, Intent.RAG_QUERY]
+    if intent not in valid_intents:
+        return Intent.RAG_QUERY
         
-        config = types.GenerateContentConfig(
-            temperature=0.0,
-            max_output_tokens=10,
-        )
-
-        response = client.models.generate_content(
-            model=settings.VERTEX_GENERATION_MODEL,
-            contents=prompt,
-            config=config
-        )
-
-        intent = response.text.strip().upper()
-        
-        valid_intents = [Intent.GREETING, Intent.CLOSURE, Intent.OFF_TOPIC, Intent.RAG_QUERY]
-        if intent not in valid_intents:
-            return Intent.RAG_QUERY
-            
-        return intent
+    return intent
+
+def predict_local_intent(query: str) -> Optional[str]:
+    """
+    Intent from the rules or a confident local classifier, without any upstream call.
+    Returns None when only the LLM can decide.
+    """
+    # 1. Try local resolution first (Fast & Free)
+    local_intent = resolve_local_intent(query)
+    if local_intent:
+        logger.info(f"Local intent resolved: {local_intent}")
+        return local_intent
+
+    # 2. Trained local classifier; only low-confidence queries go on to the LLM
+    classifier = get_intent_classifier()
+    if classifier is not None:
+        intent, confidence = classifier.predict(query)
+        if confidence >= settings.INTENT_CONFIDENCE_THRESHOLD:
+            logger.info(f"Classifier intent resolved: {intent} ({confidence:.2f})")
+            return intent
+        logger.info(f"Classifier unsure ({intent}, {confidence:.2f}); asking the LLM")
+    return None
+
+async def predict_remote_intent(query: str) -> str:
+    """LLM intent for queries predict_local_intent could not resolve."""
+    # 3. Local fallback if in NONE mode
+    if settings.MODE == "none":
+        return Intent.RAG_QUERY
+
+    # 4. Use Vertex AI for complex intent detection (off the event loop)
+    try:
+        return await run_blocking(get_executor("intent", settings.INTENT_WORKERS), classify_with_llm, query)
 
     except Exception as e:
         logger.error(f"Intent prediction via LLM failed: {e}")
@@ -103,3 +141,9 @@ async def predict_intent(query: str) -> str:
         if any(w in q_low for w in ["hello", "hi"]):
              return Intent.GREETING
         return Intent.RAG_QUERY
+
+async def predict_intent(query: str) -> str:
+    """
+    Classifies the user query into GREETING, CLOSURE, OFF_TOPIC, or RAG_QUERY.
+    """
+    return predict_local_intent(query) or await predict_remote_intent(query)
@@ -17,6 +17,11 @@ async def generate_response_stream(
     
     for i, chunk in enumerate(context_chunks, 1):
         title = chunk['meta'].get('docTitle', 'Unknown')
+        page = chunk['meta'].get('page')
+        if page:
+            page_end = chunk['meta'].get('pageEnd', page)
+            unit = chunk['meta'].get('pageUnit', 'page')
+            title += f", {unit} {page}" if page_end == page else f", {unit}s {page}-{page_end}"
         score = chunk.get('score', 0.0)
         text = chunk['text']
         
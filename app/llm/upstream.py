@@ -0,0 +1,269 @@
+import ssl
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, Optional, Tuple
+import httpx
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Upstream operations, most urgent first: a user is waiting on generation and on the
+# per-query calls; index-build embedding can always wait
+GENERATE = "generate"
+INTENT = "intent"
+QUERY_EMBED = "query_embed"
+BATCH_EMBED = "batch_embed"
+PRIORITIES = {GENERATE: 0, INTENT: 1, QUERY_EMBED: 1, BATCH_EMBED: 2}
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return "429" in str(error) or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class _Waiter:
+    __slots__ = ("operation", "notify", "granted", "abandoned")
+
+    def __init__(self, operation: str, notify):
+        self.operation = operation
+        self.notify = notify
+        self.granted = False
+        self.abandoned = False
+
+
+class UpstreamScheduler:
+    """
+    Admission for every call to Vertex, shared by threads and coroutines.
+
+    - At most max_concurrency calls in flight overall, and limits[operation] per operation.
+    - Callers that can't start wait in one queue ordered by operation priority, then arrival.
+    - A 429 from any caller pauses all new calls (backoff doubling per consecutive 429,
+      reset by a success) instead of every module backing off on its own.
+    """
+
+    def __init__(self, max_concurrency: int, limits: Dict[str, int], backoff: float, max_backoff: float = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limits = limits
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._op_in_flight = {op: 0 for op in PRIORITIES}
+        self._paused_until = 0.0
+        self._rate_limit_streak = 0
+        self._timer: Optional[threading.Timer] = None
+        self._stats = {op: {"calls": 0, "rateLimited": 0, "waitMsTotal": 0.0, "waitMsMax": 0.0} for op in PRIORITIES}
+
+    # --- admission (called with the lock held) ---
+
+    def _can_start(self, operation: str) -> bool:
+        return (
+            self._in_flight < self.max_concurrency
+            and self._op_in_flight[operation] < self.limits.get(operation, self.max_concurrency)
+        )
+
+    def _start(self, operation: str):
+        self._in_flight += 1
+        self._op_in_flight[operation] += 1
+
+    def _dispatch(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            if self._timer is None:
+                self._timer = threading.Timer(self._paused_until - now, self._resume)
+                self._timer.daemon = True
+                self._timer.start()
+            return
+        granted, blocked = [], []
+        while self._queue and self._in_flight < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.abandoned:
+                continue
+            if not self._can_start(waiter.operation):
+                blocked.append(entry)
+                continue
+            self._start(waiter.operation)
+            waiter.granted = True
+            granted.append(waiter)
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+        for waiter in granted:
+            waiter.notify()
+
+    def _resume(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _enqueue(self, operation: str, notify) -> Optional[_Waiter]:
+        """Starts the call right away if allowed (returns None), otherwise queues a waiter."""
+        with self._lock:
+            if not self._queue and time.monotonic() >= self._paused_until and self._can_start(operation):
+                self._start(operation)
+                return None
+            waiter = _Waiter(operation, notify)
+            heapq.heappush(self._queue, (PRIORITIES.get(operation, len(PRIORITIES)), next(self._seq), waiter))
+            # The queue may only hold waiters blocked by their own operation's limit; this
+            # call can still start now if its operation and the global cap have room
+            self._dispatch()
+            return waiter
+
+    def _abandon(self, waiter: _Waiter):
+        with self._lock:
+            if waiter.granted:
+                self._finish_locked(waiter.operation)
+            else:
+                waiter.abandoned = True
+
+    def _finish_locked(self, operation: str):
+        self._in_flight -= 1
+        self._op_in_flight[operation] -= 1
+        self._dispatch()
+
+    def _finish(self, operation: str, waited: float, error: Optional[BaseException]):
+        with self._lock:
+            stats = self._stats[operation]
+            stats["calls"] += 1
+            stats["waitMsTotal"] += waited * 1000
+            stats["waitMsMax"] = max(stats["waitMsMax"], waited * 1000)
+            if error is not None and isinstance(error, Exception) and is_rate_limited(error):
+                stats["rateLimited"] += 1
+                self._rate_limit_streak += 1
+                pause = min(self.backoff * 2 ** (self._rate_limit_streak - 1), self.max_backoff)
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                logger.warning(f"Upstream rate limited on '{operation}'; pausing new calls for {pause:.1f}s")
+            elif error is None:
+                self._rate_limit_streak = 0
+            self._finish_locked(operation)
+
+    # --- public API ---
+
+    @contextmanager
+    def slot(self, operation: str):
+        """Blocking admission for thread callers: `with upstream_scheduler.slot(INTENT): ...`"""
+        started = time.monotonic()
+        event = threading.Event()
+        waiter = self._enqueue(operation, event.set)
+        if waiter is not None:
+            event.wait()
+        waited = time.monotonic() - started
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(operation, waited, error)
+
+    @asynccontextmanager
+    async def aslot(self, operation: str):
+        """Admission for coroutines; waiting never blocks the event loop."""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(operation, notify)
+        if waiter is not None:
+            try:
+                await future
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        waited = time.monotonic() - started
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(operation, waited, error)
+
+    def paused_until(self) -> float:
+        """time.monotonic() before which no new call starts (in the past when not paused)."""
+        with self._lock:
+            return self._paused_until
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = {op: 0 for op in PRIORITIES}
+            for _, _, waiter in self._queue:
+                if not waiter.abandoned:
+                    queued[waiter.operation] += 1
+            operations = {
+                op: {
+                    "inFlight": self._op_in_flight[op],
+                    "queued": queued[op],
+                    "limit": self.limits.get(op, self.max_concurrency),
+                    "calls": s["calls"],
+                    "rateLimited": s["rateLimited"],
+                    "waitMsMean": s["waitMsTotal"] / s["calls"] if s["calls"] else 0.0,
+                    "waitMsMax": s["waitMsMax"],
+                }
+                for op, s in self._stats.items()
+            }
+            return {
+                "inFlight": self._in_flight,
+                "queued": sum(queued.values()),
+                "maxConcurrency": self.max_concurrency,
+                "pausedFor": max(0.0, self._paused_until - time.monotonic()),
+                "operations": operations,
+            }
+
+
+upstream_scheduler = UpstreamScheduler(
+    max_concurrency=settings.UPSTREAM_MAX_CONCURRENCY,
+    limits={
+        GENERATE: settings.UPSTREAM_GENERATE_LIMIT,
+        INTENT: settings.UPSTREAM_INTENT_LIMIT,
+        QUERY_EMBED: settings.UPSTREAM_QUERY_EMBED_LIMIT,
+        BATCH_EMBED: settings.UPSTREAM_BATCH_EMBED_LIMIT,
+    },
+    backoff=settings.UPSTREAM_BACKOFF,
+)
+
+
+_http_clients: Optional[Tuple[httpx.Client, httpx.AsyncClient]] = None
+_http_lock = threading.Lock()
+
+
+def http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Process-wide HTTP clients handed to every google.genai Client, so keep-alive
+    connections survive token refreshes and are shared by all callers.
+    """
+    global _http_clients
+    if _http_clients is None:
+        with _http_lock:
+            if _http_clients is None:
+                verify = ssl.create_default_context(cafile=settings.SSL_CERT_FILE) if settings.SSL_CERT_FILE else True
+                limits = httpx.Limits(
+                    max_connections=settings.UPSTREAM_MAX_CONCURRENCY * 2,
+                    max_keepalive_connections=settings.UPSTREAM_MAX_CONCURRENCY,
+                )
+                timeout = httpx.Timeout(settings.UPSTREAM_HTTP_TIMEOUT, connect=10.0)
+                _http_clients = (
+                    httpx.Client(verify=verify, limits=limits, timeout=timeout),
+                    httpx.AsyncClient(verify=verify, limits=limits, timeout=timeout),
+                )
+    return _http_clients
+
+
+async def close_http_clients():
+    global _http_clients
+    with _http_lock:
+        clients, _http_clients = _http_clients, None
+    if clients is not None:
+        clients[0].close()
+        await clients[1].aclose()
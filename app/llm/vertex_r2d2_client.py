@@ -2,11 +2,13 @@ import os
 import time
 import subprocess
 import logging
+import threading
 from typing import Optional
 from google.genai import Client
 from google.oauth2.credentials import Credentials
 from google.genai.types import HttpOptions
 from app.config import settings
+from app.llm.upstream import http_clients
 
 logger = logging.getLogger(__name__)
 
@@ -15,30 +17,52 @@ class VertexR2D2Client:
     _client: Optional[Client] = None
     _token: Optional[str] = None
     _token_expiry: float = 0
-    _TOKEN_LIFETIME = 45 * 60  # 45 minutes
+    _token_refreshed_at: float = 0
+    # Single flight: one Helix call at a time; others wait and reuse its token
+    _refresh_lock = threading.Lock()
+    _refresher: Optional[threading.Thread] = None
+    _stop_event = threading.Event()
+    _stats = {"refreshes": 0, "failures": 0, "lastRefreshMs": None, "maxRefreshMs": None, "lastError": None}
 
     @classmethod
     def get_client(cls) -> Client:
         """
         Returns a configured Google Gen AI Client with R2D2/Helix authentication.
-        Handles token caching and refresh.
+        Handles token caching and refresh. With the background refresher running the
+        token is renewed ahead of expiry, so this normally returns the current client
+        without touching Helix.
         """
+        client = cls._client
+        if client is not None and time.time() < cls._token_expiry:
+            return client
+
         # Set Enterprise TLS if provided
         if settings.SSL_CERT_FILE:
             os.environ["SSL_CERT_FILE"] = settings.SSL_CERT_FILE
 
-        if not cls._token or time.time() > cls._token_expiry:
-            cls._refresh_token()
-            cls._client = None  # Force client recreation with new token
+        cls._refresh_if_needed(margin=0)
+        return cls._client
 
-        if not cls._client:
+    @classmethod
+    def _refresh_if_needed(cls, margin: float) -> bool:
+        """
+        Makes sure there is a client whose token is valid for at least margin more seconds.
+        Whoever holds the lock does the work; callers queued behind it find it done.
+        """
+        with cls._refresh_lock:
+            token_valid = cls._token is not None and time.time() < cls._token_expiry - margin
+            if token_valid and cls._client is not None:
+                return False
+            if not token_valid:
+                cls._refresh_token()
+            # Build the new client before publishing it; callers keep the old one until then
             cls._create_client()
-
-        return cls._client
+            return True
 
     @classmethod
     def _refresh_token(cls):
         """Executes helix command to get a fresh access token."""
+        started = time.time()
         try:
             logger.info("Executing Helix command to fetch access token...")
             if not settings.HELIX_TOKEN_CMD:
@@ -49,23 +73,84 @@ class VertexR2D2Client:
                 shell=True,
                 check=True, 
                 stdout=subprocess.PIPE, 
-                text=True
+                text=True,
+                timeout=settings.HELIX_TOKEN_TIMEOUT
             )
             token = result.stdout.strip()
             if not token:
                 raise ValueError("Helix command returned empty token")
             
             cls._token = token
-            cls._token_expiry = time.time() + cls._TOKEN_LIFETIME
-            logger.info("Successfully refreshed Helix token")
+            cls._token_refreshed_at = time.time()
+            cls._token_expiry = cls._token_refreshed_at + settings.HELIX_TOKEN_LIFETIME
+            cls._record_refresh(started, None)
+            logger.info(f"Successfully refreshed Helix token in {(time.time() - started) * 1000:.0f} ms")
             
         except subprocess.CalledProcessError as e:
             logger.error(f"Helix command failed: {e}")
+            cls._record_refresh(started, e)
             raise RuntimeError("Failed to obtain Helix token") from e
         except Exception as e:
             logger.error(f"Error refreshing token: {e}")
+            cls._record_refresh(started, e)
             raise
 
+    @classmethod
+    def _record_refresh(cls, started: float, error: Optional[Exception]):
+        elapsed_ms = (time.time() - started) * 1000
+        stats = cls._stats
+        stats["lastRefreshMs"] = elapsed_ms
+        stats["maxRefreshMs"] = max(stats["maxRefreshMs"] or 0.0, elapsed_ms)
+        if error is None:
+            stats["refreshes"] += 1
+        else:
+            stats["failures"] += 1
+            stats["lastError"] = str(error)
+
+    @classmethod
+    def start_refresher(cls):
+        """Starts the background thread that renews the token TOKEN_REFRESH_MARGIN seconds before expiry."""
+        if cls._refresher is not None:
+            return
+        cls._stop_event.clear()
+        cls._refresher = threading.Thread(target=cls._refresh_loop, name="helix-token-refresher", daemon=True)
+        cls._refresher.start()
+
+    @classmethod
+    def stop_refresher(cls):
+        cls._stop_event.set()
+        if cls._refresher is not None:
+            cls._refresher.join(timeout=5)
+            cls._refresher = None
+
+    @classmethod
+    def _refresh_loop(cls):
+        failures = 0
+        while not cls._stop_event.is_set():
+            renew_at = cls._token_expiry - settings.TOKEN_REFRESH_MARGIN
+            if time.time() >= renew_at:
+                try:
+                    if settings.SSL_CERT_FILE:
+                        os.environ["SSL_CERT_FILE"] = settings.SSL_CERT_FILE
+                    cls._refresh_if_needed(margin=settings.TOKEN_REFRESH_MARGIN)
+                    failures = 0
+                except Exception as e:
+                    # The current token stays in use while it is valid; retry with backoff
+                    failures += 1
+                    logger.warning(f"Background token refresh failed ({failures} in a row): {e}")
+                    cls._stop_event.wait(min(5 * 2 ** failures, 300))
+                    continue
+                renew_at = cls._token_expiry - settings.TOKEN_REFRESH_MARGIN
+            cls._stop_event.wait(max(1.0, renew_at - time.time()))
+
+    @classmethod
+    def status(cls) -> dict:
+        return dict(
+            cls._stats,
+            refresher=cls._refresher is not None,
+            tokenExpiresIn=max(0.0, cls._token_expiry - time.time()) if cls._token else None,
+        )
+
     @classmethod
     def _create_client(cls):
         """Constructs the google.genai.Client with R2D2 configuration."""
@@ -93,20 +178,29 @@ class VertexR2D2Client:
         # Use google.oauth2.credentials.Credentials to wrap the raw token
         creds = Credentials(cls._token)
 
-        cls._client = Client(
+        # Shared HTTP clients: a token refresh builds a new Client, but the pooled
+        # keep-alive connections (and their TLS sessions) carry over
+        httpx_client, httpx_async_client = http_clients()
+
+        client = Client(
             vertexai=True,
             project=settings.GOOGLE_CLOUD_PROJECT,
             location=settings.GOOGLE_CLOUD_LOCATION,
             credentials=creds,
             http_options=HttpOptions(
                 base_url=settings.R2D2_VERTEX_BASE_URL,
-                headers=headers
+                headers=headers,
+                httpx_client=httpx_client,
+                httpx_async_client=httpx_async_client,
             )
         )
+        cls._client = client
 
     @classmethod
     def refresh_on_error(cls):
         """Force a token refresh on the next call. Use when 401/403 is encountered."""
+        # Requests that failed with the previous token report in after a refresh; ignore them
+        if time.time() - cls._token_refreshed_at < settings.TOKEN_MIN_REFRESH_INTERVAL:
+            return
         logger.warning("Invalidating current token due to auth error.")
-        cls._token = None
         cls._token_expiry = 0
@@ -3,13 +3,16 @@ import json
 import time
 from app.config import settings
 from app.llm.vertex_r2d2_client import VertexR2D2Client
+from app.llm.upstream import upstream_scheduler, GENERATE
+from app.llm.circuit_breaker import generation_breaker
 from google.genai import types
 
 logger = logging.getLogger(__name__)
 
 async def generate_response_stream(query: str, context_chunks: list, system_instruction: str = None):
     """
-    Streams raw tokens from Vertex AI Gemini using R2D2 client.
+    Streams raw tokens from Vertex AI Gemini using R2D2 client (async API).
+    Closing this generator cancels the upstream stream.
     """
     
     # Construct prompt
@@ -32,6 +35,9 @@ async def generate_response_stream(query: str, context_chunks: list, system_inst
     Answer:
     """
 
+    # The caller checked generation_breaker.allow(); every exit below reports back to it
+    first_token_latency = None
+    started = None
     try:
         client = VertexR2D2Client.get_client()
         
@@ -42,19 +48,52 @@ async def generate_response_stream(query: str, context_chunks: list, system_inst
             system_instruction=system_instruction
         )
 
-        response_stream = client.models.generate_content_stream(
-            model=settings.VERTEX_GENERATION_MODEL,
-            contents=prompt,
-            config=config
-        )
+        # The slot is held for the whole stream: an open stream is upstream work in flight.
+        # Generation is first in the upstream queue, ahead of intent and embedding calls.
+        async with upstream_scheduler.aslot(GENERATE):
+            # Latency for the circuit breaker: time to first token, not counting the upstream queue
+            started = time.monotonic()
+            # Async client: reading tokens never blocks the event loop. Tokens are pulled one at
+            # a time as the caller consumes them, so a slow reader slows the upstream read
+            # instead of growing a buffer.
+            response_stream = await client.aio.models.generate_content_stream(
+                model=settings.VERTEX_GENERATION_MODEL,
+                contents=prompt,
+                config=config
+            )
 
-        # Stream raw tokens
-        for chunk in response_stream:
-            text_chunk = chunk.text
-            if text_chunk:
-                yield text_chunk
+            # Stream raw tokens
+            try:
+                async for chunk in response_stream:
+                    text_chunk = chunk.text
+                    if text_chunk:
+                        if first_token_latency is None:
+                            first_token_latency = time.monotonic() - started
+                        yield text_chunk
+            finally:
+                # Closing early (client went away, task cancelled) releases the upstream connection
+                aclose = getattr(response_stream, "aclose", None)
+                if aclose is not None:
+                    await aclose()
 
     except Exception as e:
+        generation_breaker.record_failure()
         logger.error(f"Vertex AI generation error: {e}")
         # Re-raise to let the API layer handle or report the error
         raise e
+    except BaseException:
+        # Closed or cancelled by the caller (disconnect, generation timeout). Only time spent
+        # upstream says anything about Vertex: a stream that got past the slow threshold
+        # without a token stalled and counts as a failure; a call still waiting for its
+        # slot (or cut short sooner) is released.
+        if first_token_latency is not None:
+            generation_breaker.record_success(first_token_latency)
+        elif started is not None and 0 < generation_breaker.slow_seconds < time.monotonic() - started:
+            generation_breaker.record_failure()
+        else:
+            generation_breaker.release()
+        raise
+    else:
+        if first_token_latency is None:
+            first_token_latency = time.monotonic() - started
+        generation_breaker.record_success(first_token_latency)
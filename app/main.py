@@ -1,11 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse
-from app.api.routes import router
+from app.api.routes import router, chat_flights
 from app.config import settings
+from app.retrieval.registry import retriever_registry
+from app.utils.executor import shutdown_executors
+from app.utils.micro_batcher import batcher_stats
+from app.utils.admission import admission
+from app.utils.memory import memory_usage
+from app.embeddings.embedding_cache import query_embedding_cache
+from app.llm.answer_cache import answer_cache
+from app.llm.vertex_r2d2_client import VertexR2D2Client
+from app.llm.upstream import upstream_scheduler, close_http_clients
+from app.llm.circuit_breaker import generation_breaker, intent_breaker
 
-app = FastAPI(title="RAG PoC Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the retriever once and share it across requests; watch for new builds
+    retriever_registry.start()
+    # Keep the Helix token fresh off the request path
+    if settings.MODE == "vertex":
+        VertexR2D2Client.start_refresher()
+    yield
+    VertexR2D2Client.stop_refresher()
+    retriever_registry.stop()
+    shutdown_executors()
+    await close_http_clients()
+
+app = FastAPI(title="RAG PoC Backend", version="1.0.0", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -40,7 +64,21 @@ async def favicon():
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "mode": settings.MODE, "retrieval": settings.RETRIEVAL_MODE}
+    return {
+        "status": "ok",
+        "mode": settings.MODE,
+        "retrieval": settings.RETRIEVAL_MODE,
+        "index": retriever_registry.status(),
+        "memory": memory_usage(),
+        "embeddingCache": query_embedding_cache.stats(),
+        "batching": batcher_stats(),
+        "answerCache": answer_cache.stats(),
+        "coalescing": chat_flights.stats(),
+        "admission": admission.stats(),
+        "auth": VertexR2D2Client.status(),
+        "upstream": upstream_scheduler.stats(),
+        "circuits": {"generation": generation_breaker.stats(), "intent": intent_breaker.stats()},
+    }
 
 if __name__ == "__main__":
     import uvicorn
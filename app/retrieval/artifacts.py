@@ -0,0 +1,101 @@
+import json
+import os
+import time
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, Optional
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+
+# Files whose change means a new index build has landed (used when no manifest exists)
+TRACKED_FILES = ["faiss.index", "faiss.params.json", "chunk_store", "chunks.jsonl", "tfidf", "tfidf.pkl", "bm25", "bm25.npz"]
+
+
+def atomic_write_path(path: Path) -> Path:
+    """Temporary sibling path to write to before os.replace()-ing it into place."""
+    return path.with_name(f".{path.name}.tmp")
+
+
+def replace_path(tmp_path: Path, final_path: Path):
+    """Moves a staged file or directory into place. Directories are swapped via rename."""
+    if not tmp_path.is_dir():
+        os.replace(tmp_path, final_path)
+        return
+    old_path = final_path.with_name(f".{final_path.name}.old")
+    if old_path.exists():
+        shutil.rmtree(old_path)
+    if final_path.exists():
+        os.replace(final_path, old_path)
+    os.replace(tmp_path, final_path)
+    # Open memory maps of the old build stay valid after the files are unlinked
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def save_arrays(directory: Path, **arrays: np.ndarray):
+    """Writes each array as <name>.npy in directory, a layout that can be memory-mapped on load."""
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(directory / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+
+
+def load_arrays(directory: Path, *names: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Reads arrays written by save_arrays(). With mmap they are read-only views of the files,
+    so every process serving the same build shares one copy through the page cache.
+    """
+    mode = "r" if mmap else None
+    return {name: np.load(directory / f"{name}.npy", mmap_mode=mode, allow_pickle=False) for name in names}
+
+
+def write_manifest(artifacts_dir: Path, **info) -> Dict[str, Any]:
+    """
+    Writes manifest.json describing the build. Must be the LAST file written by a build,
+    since the retriever registry treats a new manifest version as "build complete".
+    """
+    manifest = {
+        "version": time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}",
+        "builtAt": time.time(),
+    }
+    manifest.update(info)
+
+    manifest_file = artifacts_dir / MANIFEST_NAME
+    tmp_file = atomic_write_path(manifest_file)
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+    return manifest
+
+
+def read_manifest(artifacts_dir: Path) -> Optional[Dict[str, Any]]:
+    manifest_file = artifacts_dir / MANIFEST_NAME
+    if not manifest_file.exists():
+        return None
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Partially written or unreadable; treat as "no new build yet"
+        return None
+
+
+def index_version(artifacts_dir: Path) -> Optional[str]:
+    """
+    Returns an identifier of the build currently on disk.
+    Prefers the manifest version; falls back to a fingerprint of artifact mtimes/sizes
+    for artifacts produced before manifests existed.
+    """
+    manifest = read_manifest(artifacts_dir)
+    if manifest and manifest.get("version"):
+        return str(manifest["version"])
+
+    parts = []
+    for name in TRACKED_FILES:
+        path = artifacts_dir / name
+        if path.exists():
+            stat = path.stat()
+            parts.append(f"{name}:{stat.st_mtime_ns}:{stat.st_size}")
+    if not parts:
+        return None
+    return "fs-" + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12]
@@ -1,5 +1,16 @@
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.utils.executor import get_executor, run_blocking
+
+def retrieval_executor() -> ThreadPoolExecutor:
+    """Bounded pool shared by all retrievers for blocking (network) and CPU-heavy stages."""
+    return get_executor("retrieval", settings.RETRIEVAL_WORKERS)
+
+def retrieval_io_executor() -> ThreadPoolExecutor:
+    """Pool for stages that mostly wait on the network (query embedding), kept apart from CPU work."""
+    return get_executor("retrieval-io", settings.RETRIEVAL_IO_WORKERS)
 
 class BaseRetriever(ABC):
     @abstractmethod
@@ -9,3 +20,11 @@ class BaseRetriever(ABC):
         Returns a list of dicts with keys: 'chunkId', 'text', 'score', 'meta'.
         """
         pass
+
+    async def aretrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Non-blocking variant of retrieve() for use on the event loop.
+        By default runs retrieve() on the retrieval executor; retrievers with
+        distinct I/O and CPU stages override this to schedule them separately.
+        """
+        return await run_blocking(retrieval_executor(), self.retrieve, query, top_k=top_k)
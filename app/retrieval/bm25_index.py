@@ -0,0 +1,151 @@
+import re
+import math
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Tuple
+import numpy as np
+from app.retrieval.artifacts import save_arrays, load_arrays
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Inverted index with precomputed BM25 impacts.
+
+    Postings are stored as three flat arrays (CSR layout):
+      - term_offsets[t] .. term_offsets[t + 1] is the slice of postings for term t
+      - doc_ids: chunk positions, sorted within each term
+      - impacts: BM25 contribution of the term to that chunk (idf * saturated tf)
+
+    A query only touches the postings of its own terms, so its cost depends on
+    how common the query terms are rather than on total corpus size.
+    """
+
+    def __init__(self, vocab: List[str], term_offsets: np.ndarray, doc_ids: np.ndarray,
+                 impacts: np.ndarray, num_docs: int, k1: float, b: float):
+        self.vocab = {term: i for i, term in enumerate(vocab)}
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.impacts = impacts
+        self.num_docs = num_docs
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Builds the index in a single pass over the chunk texts."""
+        postings = {}  # term -> ([doc_id, ...], [tf, ...])
+        doc_lens = []
+
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = ([], [])
+                entry[0].append(doc_id)
+                entry[1].append(tf)
+
+        num_docs = len(doc_lens)
+        lens = np.asarray(doc_lens, dtype=np.float32)
+        avg_len = float(lens.mean()) if num_docs else 0.0
+        # Length normalisation term per document, shared by all of its postings
+        norm = k1 * (1 - b + b * lens / avg_len) if avg_len else np.zeros_like(lens)
+
+        vocab = sorted(postings)
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for i, term in enumerate(vocab):
+            term_offsets[i + 1] = term_offsets[i] + len(postings[term][0])
+
+        doc_ids = np.empty(term_offsets[-1], dtype=np.int32)
+        impacts = np.empty(term_offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            ids, tfs = postings.pop(term)
+            start, end = term_offsets[i], term_offsets[i + 1]
+            ids_np = np.asarray(ids, dtype=np.int32)
+            tfs_np = np.asarray(tfs, dtype=np.float32)
+            df = len(ids)
+            idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+            doc_ids[start:end] = ids_np
+            impacts[start:end] = idf * tfs_np * (k1 + 1) / (tfs_np + norm[ids_np])
+
+        logger.info(f"Built BM25 index: {num_docs} chunks, {len(vocab)} terms, {len(doc_ids)} postings")
+        return cls(vocab, term_offsets, doc_ids, impacts, num_docs, k1, b)
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """Returns [(chunk position, score), ...] for the best top_k chunks, highest first."""
+        query_terms = Counter(tokenize(query))
+        id_slices, score_slices = [], []
+        for term, qtf in query_terms.items():
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.term_offsets[t], self.term_offsets[t + 1]
+            id_slices.append(self.doc_ids[start:end])
+            score_slices.append(self.impacts[start:end] * qtf if qtf > 1 else self.impacts[start:end])
+
+        if not id_slices or top_k <= 0:
+            return []
+
+        if len(id_slices) == 1:
+            candidates, scores = id_slices[0], score_slices[0]
+        else:
+            # Sum the per-term contributions of every chunk that matched any query term
+            all_ids = np.concatenate(id_slices)
+            all_scores = np.concatenate(score_slices)
+            if len(all_ids) * 8 > self.num_docs:
+                # Common terms: a dense accumulator is cheaper than sorting the postings
+                scores = np.bincount(all_ids, weights=all_scores, minlength=self.num_docs)
+                candidates = np.flatnonzero(scores)
+                scores = scores[candidates]
+            else:
+                candidates, inverse = np.unique(all_ids, return_inverse=True)
+                scores = np.bincount(inverse, weights=all_scores)
+
+        # Partial selection (O(n)) of the top_k, then sort only those
+        if len(scores) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+    def save(self, path: Path):
+        """Writes the on-disk format: a directory of .npy arrays, memory-mappable on load."""
+        vocab_blob = np.frombuffer("\n".join(self.vocab).encode("utf-8"), dtype=np.uint8)
+        save_arrays(
+            path,
+            vocab=vocab_blob,
+            term_offsets=self.term_offsets,
+            doc_ids=self.doc_ids,
+            impacts=self.impacts,
+            params=np.array([self.num_docs, self.k1, self.b], dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "BM25Index":
+        """
+        Loads a directory written by save(); with mmap the postings stay in the page cache,
+        shared by every worker. Also reads the older single-.npz format (always copied).
+        """
+        if path.is_dir():
+            data = load_arrays(path, "vocab", "term_offsets", "doc_ids", "impacts", "params", mmap=mmap)
+            return cls._from_arrays(data)
+        with np.load(path) as data:
+            return cls._from_arrays({name: data[name] for name in data.files})
+
+    @classmethod
+    def _from_arrays(cls, data) -> "BM25Index":
+        vocab_bytes = data["vocab"].tobytes()
+        vocab = vocab_bytes.decode("utf-8").split("\n") if vocab_bytes else []
+        num_docs, k1, b = data["params"]
+        return cls(vocab, data["term_offsets"], data["doc_ids"], data["impacts"], int(num_docs), float(k1), float(b))
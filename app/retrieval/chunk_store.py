@@ -0,0 +1,234 @@
+import json
+import mmap
+import bisect
+import hashlib
+import logging
+from collections import deque
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
+import numpy as np
+from app.utils.text_chunker import TextChunker
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_DIR = "chunk_store"
+
+# One fixed-size record per chunk: owning document and UTF-8 byte offsets into that document's text
+CHUNK_DTYPE = np.dtype([("doc", "<i4"), ("start", "<u4"), ("end", "<u4")])
+# Per chunk: first and last page (or section) it covers, 1-based; 0 when the source has no pages
+PAGE_DTYPE = np.dtype([("first", "<u4"), ("last", "<u4")])
+
+
+class ChunkStoreWriter:
+    """
+    Writes the binary chunk store used by the retrievers:
+      - docs.jsonl:      document table, one metadata dict per document
+      - text.bin:        UTF-8 text of every document, concatenated
+      - doc_offsets.bin: int64 byte offset of each document in text.bin (plus a final end offset)
+      - chunks.bin:      one CHUNK_DTYPE record per chunk
+      - pages.bin:       one PAGE_DTYPE record per chunk
+
+    Each document's text is stored once; overlapping chunks are just overlapping offset ranges.
+    Documents are appended as they come, so memory use does not grow with the corpus.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._docs = open(path / "docs.jsonl", "w", encoding="utf-8")
+        self._text = open(path / "text.bin", "wb")
+        self._offsets = open(path / "doc_offsets.bin", "wb")
+        self._chunks = open(path / "chunks.bin", "wb")
+        self._pages = open(path / "pages.bin", "wb")
+        self._text_pos = 0
+        self._digest = hashlib.sha256()
+        self.num_docs = 0
+        self.num_chunks = 0
+
+    def add_document(self, pieces: Iterable[str], meta: Dict[str, Any], chunker: TextChunker,
+                     pages: Optional[List[Tuple[int, int]]] = None) -> int:
+        """
+        Appends a document whose text arrives as an iterable of pieces (pages, file blocks).
+        Pieces are written out as the chunker consumes them, so only the chunking window is
+        held in memory. pages: [(page number, char offset where it starts)] in text order.
+        Returns the number of chunks added.
+        """
+        np.array([self._text_pos], dtype="<i8").tofile(self._offsets)
+        # Pieces a chunk may still point into, as (char offset, piece)
+        window = deque()
+        written = [0, 0]
+        # Char and byte offset of the previous chunk start; chunk starts only move forward
+        cursor = [0, 0]
+
+        def tee() -> Iterator[str]:
+            for piece in pieces:
+                data = piece.encode("utf-8")
+                self._text.write(data)
+                self._digest.update(data)
+                window.append((written[0], piece))
+                written[0] += len(piece)
+                written[1] += len(data)
+                yield piece
+
+        def advance(char_offset: int) -> int:
+            """Byte offset of char_offset, encoding only the text since the previous chunk start."""
+            chars, nbytes = cursor
+            for piece_chars, piece in window:
+                piece_end = piece_chars + len(piece)
+                if piece_end <= chars:
+                    continue
+                if piece_chars >= char_offset:
+                    break
+                lo, hi = max(chars, piece_chars) - piece_chars, min(char_offset, piece_end) - piece_chars
+                nbytes += len(piece[lo:hi].encode("utf-8"))
+            cursor[0], cursor[1] = char_offset, nbytes
+            return nbytes
+
+        page_starts = [offset for _, offset in pages] if pages else []
+        spans, page_spans = [], []
+        for start, end, text in chunker.iter_stream(tee()):
+            start_byte = advance(start)
+            # Drop pieces that end before this chunk: neither it nor a later one points into them
+            while len(window) > 1 and window[0][0] + len(window[0][1]) <= start:
+                window.popleft()
+            spans.append((start_byte, start_byte + len(text.encode("utf-8"))))
+            if page_starts:
+                first = bisect.bisect_right(page_starts, start) - 1
+                last = bisect.bisect_right(page_starts, end - 1) - 1
+                page_spans.append((pages[max(first, 0)][0], pages[max(last, 0)][0]))
+            else:
+                page_spans.append((0, 0))
+
+        records = np.empty(len(spans), dtype=CHUNK_DTYPE)
+        records["doc"] = self.num_docs
+        records["start"] = [start for start, _ in spans]
+        records["end"] = [end for _, end in spans]
+        page_records = np.array(page_spans, dtype=PAGE_DTYPE) if page_spans else np.empty(0, dtype=PAGE_DTYPE)
+
+        doc_line = json.dumps({"meta": meta, "firstChunk": self.num_chunks, "numChunks": len(spans)}) + "\n"
+        self._docs.write(doc_line)
+        records.tofile(self._chunks)
+        page_records.tofile(self._pages)
+        for part in (doc_line.encode("utf-8"), records.tobytes(), page_records.tobytes()):
+            self._digest.update(part)
+
+        self._text_pos += written[1]
+        self.num_docs += 1
+        self.num_chunks += len(spans)
+        return len(spans)
+
+    @property
+    def content_hash(self) -> str:
+        """Fingerprint of everything written so far; identical input gives an identical store."""
+        return self._digest.hexdigest()
+
+    def close(self):
+        # Final end offset so document i spans doc_offsets[i]:doc_offsets[i + 1]
+        np.array([self._text_pos], dtype="<i8").tofile(self._offsets)
+        for f in (self._docs, self._text, self._offsets, self._chunks, self._pages):
+            f.close()
+        logger.info(f"Chunk store written to {self.path}: {self.num_docs} documents, {self.num_chunks} chunks")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ChunkStore:
+    """
+    Read side of the chunk store. Offsets and text are memory-mapped; a chunk dict
+    ({'chunkId', 'text', 'meta'}) is only materialized when it is indexed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.docs = []
+        with open(path / "docs.jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                self.docs.append(json.loads(line))
+
+        self.doc_offsets = np.fromfile(path / "doc_offsets.bin", dtype="<i8")
+        chunks_file = path / "chunks.bin"
+        if chunks_file.stat().st_size:
+            self.records = np.memmap(chunks_file, dtype=CHUNK_DTYPE, mode="r")
+        else:
+            self.records = np.empty(0, dtype=CHUNK_DTYPE)
+        # Stores built before page tracking have no pages.bin
+        pages_file = path / "pages.bin"
+        if pages_file.exists() and pages_file.stat().st_size:
+            self.pages = np.memmap(pages_file, dtype=PAGE_DTYPE, mode="r")
+        else:
+            self.pages = None
+
+        self._text_file = open(path / "text.bin", "rb")
+        if self.doc_offsets[-1] > 0:
+            self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._text = b""
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def text(self, idx: int) -> str:
+        doc, start, end = self.records[idx]
+        base = int(self.doc_offsets[doc])
+        return self._text[base + int(start):base + int(end)].decode("utf-8")
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        if idx < 0:
+            idx += len(self)
+        doc = self.docs[int(self.records[idx]["doc"])]
+        meta = dict(doc["meta"])
+        if self.pages is not None and self.pages[idx]["first"]:
+            meta["page"] = int(self.pages[idx]["first"])
+            meta["pageEnd"] = int(self.pages[idx]["last"])
+        return {
+            "text": self.text(idx),
+            "meta": meta,
+            "chunkId": f"{meta.get('docId')}_{idx - doc['firstChunk']}",
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def iter_texts(self) -> Iterator[str]:
+        for idx in range(len(self)):
+            yield self.text(idx)
+
+    def close(self):
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text_file.close()
+
+
+def chunks_location(artifacts_dir: Path) -> Path:
+    """The chunk store if the build produced one, otherwise the legacy chunks.jsonl."""
+    store_dir = artifacts_dir / CHUNK_STORE_DIR
+    if store_dir.is_dir():
+        return store_dir
+    return artifacts_dir / "chunks.jsonl"
+
+
+def load_chunks(path: Path) -> Union[ChunkStore, List[Dict[str, Any]]]:
+    """
+    Opens chunks for a retriever. Both return types support len() and integer indexing
+    yielding chunk dicts, so retrievers don't care which one they get.
+    """
+    if path.is_dir():
+        return ChunkStore(path)
+
+    chunks = []
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                chunks.append(json.loads(line))
+    return chunks
+
+
+def iter_chunk_texts(chunks: Union[ChunkStore, List[Dict[str, Any]]]) -> Iterator[str]:
+    if isinstance(chunks, ChunkStore):
+        return chunks.iter_texts()
+    return (c['text'] for c in chunks)
@@ -1,34 +1,55 @@
 import logging
 import os
+from typing import Optional
 from app.config import settings
 from app.retrieval.base import BaseRetriever
 from app.retrieval.retriever_tfidf import TfidfRetriever
 from app.retrieval.retriever_brute import BruteRetriever
+from app.retrieval.chunk_store import chunks_location
 
 logger = logging.getLogger(__name__)
 
+def _get_faiss_retriever() -> Optional[BaseRetriever]:
+    """Returns the FAISS Vertex retriever, or None if its artifacts are missing or fail to load."""
+    try:
+        from app.retrieval.retriever_faiss_vertex import FaissVertexRetriever
+        index_path = settings.ARTIFACTS_DIR / "faiss.index"
+        chunks_path = chunks_location(settings.ARTIFACTS_DIR)
+
+        if index_path.exists() and chunks_path.exists():
+            logger.info("Initializing FAISS Vertex Retriever")
+            return FaissVertexRetriever(index_path=index_path, chunks_path=chunks_path)
+        logger.warning("FAISS index files not found.")
+    except Exception as e:
+        logger.error(f"Failed to initialize FAISS Vertex Retriever: {e}")
+    return None
+
 def get_retriever() -> BaseRetriever:
     """
     Returns the configured retriever based on settings.
     Default fallback order: FAISS (Vertex) -> TF-IDF -> Brute Force.
+    'hybrid' fuses FAISS with the BM25 (brute) retriever and degrades to BM25 alone.
     """
     mode = settings.RETRIEVAL_MODE.lower()
-    
+
+    if mode == "hybrid":
+        from app.retrieval.retriever_hybrid import HybridRetriever
+        lexical = BruteRetriever()
+        vector = _get_faiss_retriever()
+        if vector is None:
+            logger.warning("Hybrid mode without a vector index. Using lexical retrieval only.")
+            return lexical
+        return HybridRetriever([
+            ("vector", vector, settings.HYBRID_VECTOR_WEIGHT),
+            ("lexical", lexical, settings.HYBRID_LEXICAL_WEIGHT),
+        ])
+
     if mode == "faiss":
-        try:
-            from app.retrieval.retriever_faiss_vertex import FaissVertexRetriever
-            index_path = settings.DATA_DIR / "artifacts" / "faiss.index"
-            chunks_path = settings.DATA_DIR / "artifacts" / "chunks.jsonl"
-            
-            if index_path.exists() and chunks_path.exists():
-                logger.info("Initializing FAISS Vertex Retriever")
-                return FaissVertexRetriever(index_path=index_path, chunks_path=chunks_path)
-            else:
-                logger.warning("FAISS index files not found. Falling back to TF-IDF.")
-                mode = "tfidf"
-        except Exception as e:
-            logger.error(f"Failed to initialize FAISS Vertex Retriever: {e}")
-            mode = "tfidf"
+        retriever = _get_faiss_retriever()
+        if retriever is not None:
+            return retriever
+        logger.warning("Falling back to TF-IDF.")
+        mode = "tfidf"
 
     if mode == "tfidf":
         try:
@@ -36,5 +57,5 @@ def get_retriever() -> BaseRetriever:
         except Exception as e:
             logger.error(f"Failed to initialize TF-IDF Retriever: {e}")
             mode = "brute"
-            
+
     return BruteRetriever()
@@ -0,0 +1,195 @@
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def params_path(index_path: Path) -> Path:
+    """Search/build settings are saved next to the index: faiss.index -> faiss.params.json."""
+    return index_path.with_name(index_path.stem + ".params.json")
+
+
+def default_params(index_type: str, num_vectors: int, dimension: int) -> Dict[str, Any]:
+    """Reasonable starting points; every value can be overridden from build_index.py."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}'. Choose from {INDEX_TYPES}")
+
+    params: Dict[str, Any] = {"indexType": index_type}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # ~4*sqrt(N) lists, but keep >= 39 training points per list as FAISS recommends
+        nlist = int(4 * np.sqrt(num_vectors))
+        nlist = max(1, min(nlist, num_vectors // 39))
+        params.update({
+            "nlist": nlist,
+            "nprobe": min(16, nlist),
+            "trainSize": min(num_vectors, max(64 * nlist, 10000)),
+        })
+    if index_type == "ivf_pq":
+        # Largest sub-quantizer count <= 64 that divides the dimension
+        pq_m = next(m for m in range(min(64, dimension), 0, -1) if dimension % m == 0)
+        params.update({"pqM": pq_m, "pqBits": 8})
+    if index_type == "hnsw":
+        params.update({"hnswM": 32, "efConstruction": 200, "efSearch": 64})
+    return params
+
+
+def create_index(dimension: int, params: Dict[str, Any]) -> faiss.Index:
+    """Builds an empty index for inner product (= cosine on normalized vectors)."""
+    index_type = params["indexType"]
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dimension)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["hnswM"], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params["efConstruction"]
+        return index
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"], faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFPQ(
+            quantizer, dimension, params["nlist"], params["pqM"], params["pqBits"], faiss.METRIC_INNER_PRODUCT
+        )
+    return index
+
+
+def min_training_points(params: Dict[str, Any]) -> int:
+    index_type = params["indexType"]
+    if index_type == "ivf_flat":
+        return params["nlist"]
+    if index_type == "ivf_pq":
+        return max(params["nlist"], 2 ** params["pqBits"])
+    return 0
+
+
+def train_index(index: faiss.Index, sample: np.ndarray):
+    if index.is_trained:
+        return
+    start = time.time()
+    index.train(sample)
+    logger.info(f"Trained index on {len(sample)} vectors in {time.time() - start:.1f}s")
+
+
+def training_sample(vectors: np.ndarray, params: Dict[str, Any], seed: int = 0) -> np.ndarray:
+    size = params.get("trainSize") or len(vectors)
+    if size >= len(vectors):
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[np.sort(rng.choice(len(vectors), size=size, replace=False))]
+
+
+def apply_search_params(index: faiss.Index, params: Dict[str, Any]):
+    """Applies query-time settings (nprobe / efSearch) to a loaded index."""
+    if "nprobe" in params:
+        try:
+            faiss.extract_index_ivf(index).nprobe = int(params["nprobe"])
+        except RuntimeError:
+            logger.warning("nprobe set but index is not IVF; ignoring.")
+    if "efSearch" in params:
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = int(params["efSearch"])
+        else:
+            logger.warning("efSearch set but index is not HNSW; ignoring.")
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = "flat",
+                      overrides: Optional[Dict[str, Any]] = None,
+                      add_batch: int = 65536) -> Tuple[faiss.Index, Dict[str, Any]]:
+    """
+    Creates, trains and fills an index of the requested type from normalized vectors.
+    Falls back to a flat index when there are too few vectors to train the requested one.
+    vectors may be a np.memmap; it is read in add_batch slices rather than copied whole.
+    """
+    num_vectors, dimension = vectors.shape
+    params = default_params(index_type, num_vectors, dimension)
+    params.update({k: v for k, v in (overrides or {}).items() if v is not None and k in params})
+
+    if num_vectors < min_training_points(params):
+        logger.warning(
+            f"{num_vectors} vectors is too few to train '{index_type}' "
+            f"(need {min_training_points(params)}). Using a flat index."
+        )
+        params = default_params("flat", num_vectors, dimension)
+
+    index = create_index(dimension, params)
+    train_index(index, np.ascontiguousarray(training_sample(vectors, params)))
+    for start in range(0, num_vectors, add_batch):
+        index.add(np.ascontiguousarray(vectors[start:start + add_batch]))
+    apply_search_params(index, params)
+    return index, params
+
+
+def save_params(path: Path, params: Dict[str, Any]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+
+def read_index(path: Path, params: Dict[str, Any], mmap: bool = True) -> Tuple[faiss.Index, bool]:
+    """
+    Reads an index, memory-mapping its bulk data when possible: the inverted lists of IVF
+    indexes, the stored vectors of flat and HNSW ones. Mapped pages live in the page cache,
+    so every worker serving the same file shares one copy.
+    Returns (index, mapped); falls back to a private in-memory copy when mapping fails.
+    """
+    if mmap:
+        if params.get("indexType", "flat").startswith("ivf"):
+            flags = faiss.IO_FLAG_MMAP
+        else:
+            # Older FAISS releases can't map flat code storage
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        if flags:
+            try:
+                return faiss.read_index(str(path), flags | faiss.IO_FLAG_READ_ONLY), True
+            except RuntimeError as e:
+                logger.warning(f"Could not memory-map {path.name}, reading it into memory: {e}")
+    return faiss.read_index(str(path)), False
+
+
+def load_params(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {"indexType": "flat"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def evaluate_index(index: faiss.Index, vectors: np.ndarray, k: int = 10,
+                   num_queries: int = 200, seed: int = 0) -> Dict[str, float]:
+    """
+    Measures recall@k of index against exact (flat) search, plus single-query latency of both.
+    Corpus vectors are used as queries since no query log is available at build time.
+    """
+    num_queries = min(num_queries, len(vectors))
+    rng = np.random.default_rng(seed)
+    queries = np.ascontiguousarray(vectors[np.sort(rng.choice(len(vectors), size=num_queries, replace=False))])
+    k = min(k, len(vectors))
+
+    def timed_search(search):
+        ids, timings = [], []
+        for q in queries:
+            start = time.perf_counter()
+            found = search(q.reshape(1, -1))
+            timings.append((time.perf_counter() - start) * 1000)
+            ids.append(found[0])
+        return np.array(ids), np.array(timings)
+
+    # Exact brute-force search straight over the vectors (no second in-memory copy as a flat index)
+    exact_ids, exact_ms = timed_search(lambda q: faiss.knn(q, vectors, k, metric=faiss.METRIC_INNER_PRODUCT)[1])
+    approx_ids, approx_ms = timed_search(lambda q: index.search(q, k)[1])
+    hits = [len(set(a) & set(e)) / k for a, e in zip(approx_ids, exact_ids)]
+
+    return {
+        "k": k,
+        "queries": num_queries,
+        "recall": float(np.mean(hits)),
+        "flatMsMean": float(exact_ms.mean()),
+        "flatMsP95": float(np.percentile(exact_ms, 95)),
+        "indexMsMean": float(approx_ms.mean()),
+        "indexMsP95": float(np.percentile(approx_ms, 95)),
+    }
@@ -0,0 +1,121 @@
+import os
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+from app.config import settings
+from app.retrieval.base import BaseRetriever
+from app.retrieval.factory import get_retriever
+from app.retrieval.artifacts import index_version
+from app.utils.memory import memory_usage, format_memory
+
+logger = logging.getLogger(__name__)
+
+class RetrieverRegistry:
+    """
+    Process-wide holder of the warm retriever.
+
+    The retriever is built once (at app startup) and shared by every request.
+    A background thread polls the artifacts directory and, when a new build lands,
+    loads it off the request path and swaps the reference atomically. Requests that
+    already hold the old retriever finish on it; new requests get the new one.
+    """
+
+    def __init__(self, artifacts_dir: Path, watch_interval: float):
+        self.artifacts_dir = artifacts_dir
+        self.watch_interval = watch_interval
+        self._retriever: Optional[BaseRetriever] = None
+        self._version: Optional[str] = None
+        self._loaded_at: float = 0
+        self._load_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._last_error: Optional[str] = None
+
+    def start(self):
+        """Loads the retriever and starts the artifact watcher. Called from the app lifespan."""
+        self.reload(force=True)
+        if self.watch_interval > 0 and not self._watcher:
+            self._stop_event.clear()
+            self._watcher = threading.Thread(target=self._watch, name="retriever-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._watcher:
+            self._watcher.join(timeout=self.watch_interval + 1)
+            self._watcher = None
+
+    def get(self) -> BaseRetriever:
+        """Returns the currently serving retriever, loading it on first use if start() was not called."""
+        retriever = self._retriever
+        if retriever is None:
+            self.reload(force=True)
+            retriever = self._retriever
+        return retriever
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._version
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Loads the build on disk if its version differs from the serving one.
+        Returns True if a swap happened. On failure the previous retriever keeps serving.
+        """
+        with self._load_lock:
+            disk_version = index_version(self.artifacts_dir)
+            if not force and self._retriever is not None and disk_version == self._version:
+                return False
+
+            start = time.time()
+            try:
+                retriever = get_retriever()
+            except Exception as e:
+                self._last_error = str(e)
+                logger.error(f"Failed to load retriever for index version {disk_version}: {e}")
+                if self._retriever is None:
+                    raise
+                return False
+
+            # A build that landed while we were loading will be picked up on the next poll
+            if index_version(self.artifacts_dir) != disk_version:
+                logger.warning("Artifacts changed during load; retrying on next poll.")
+                if self._retriever is not None:
+                    return False
+
+            previous = self._version
+            self._retriever = retriever
+            self._version = disk_version
+            self._loaded_at = time.time()
+            self._last_error = None
+            logger.info(
+                f"Serving index version {disk_version} ({type(retriever).__name__}), "
+                f"previous {previous}, loaded in {time.time() - start:.2f}s"
+            )
+            # Memory-mapped artifacts show up as file-backed/shared pages, the rest is per worker
+            logger.info(f"Worker {os.getpid()} memory: {format_memory(memory_usage())}")
+            return True
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "version": self._version,
+            "retriever": type(self._retriever).__name__ if self._retriever else None,
+            "loadedAt": self._loaded_at or None,
+            "watching": self._watcher is not None,
+            "lastError": self._last_error,
+        }
+
+    def _watch(self):
+        while not self._stop_event.wait(self.watch_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Retriever watcher error: {e}")
+
+
+retriever_registry = RetrieverRegistry(
+    artifacts_dir=settings.ARTIFACTS_DIR,
+    watch_interval=settings.INDEX_WATCH_INTERVAL,
+)
@@ -1,47 +1,45 @@
-import json
 import logging
-import re
-from typing import List, Dict, Any, Set
-from pathlib import Path
+from typing import List, Dict, Any
 from app.config import settings
 from app.retrieval.base import BaseRetriever
+from app.retrieval.bm25_index import BM25Index
+from app.retrieval.chunk_store import chunks_location, load_chunks, iter_chunk_texts
 
 logger = logging.getLogger(__name__)
 
 class BruteRetriever(BaseRetriever):
+    """
+    Local lexical retriever (no Vertex required), scored with BM25 over an inverted index.
+    Uses the bm25 index from build_index.py (or an older bm25.npz) when it matches the chunks,
+    otherwise builds it at load.
+    """
+
     def __init__(self):
         try:
-            chunks_path = settings.DATA_DIR / "artifacts" / "chunks.jsonl"
-            self.chunks = []
-            if chunks_path.exists():
-                with open(chunks_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        self.chunks.append(json.loads(line))
-            
+            bm25_path = settings.ARTIFACTS_DIR / "bm25"
+            if not bm25_path.exists():
+                bm25_path = settings.ARTIFACTS_DIR / "bm25.npz"
+            self.chunks = load_chunks(chunks_location(settings.ARTIFACTS_DIR))
+
+            self.index = None
+            if bm25_path.exists():
+                index = BM25Index.load(bm25_path, mmap=settings.INDEX_MMAP)
+                if index.num_docs == len(self.chunks):
+                    self.index = index
+                else:
+                    logger.warning(f"{bm25_path.name} covers {index.num_docs} chunks, expected {len(self.chunks)}. Rebuilding in memory.")
+            if self.index is None:
+                self.index = BM25Index.build(iter_chunk_texts(self.chunks))
+
             logger.info(f"BruteRetriever initialized with {len(self.chunks)} chunks.")
         except Exception as e:
             logger.error(f"Failed to initialize BruteRetriever: {e}")
             raise e
 
-    def _tokenize(self, text: str) -> Set[str]:
-        return set(re.findall(r'\w+', text.lower()))
-
     def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        query_tokens = self._tokenize(query)
-        if not query_tokens:
-            return []
-            
-        scored_chunks = []
-        for chunk in self.chunks:
-            chunk_tokens = self._tokenize(chunk['text'])
-            intersection = query_tokens.intersection(chunk_tokens)
-            score = len(intersection) / len(query_tokens) # partial Jaccard-ish
-            
-            if score > 0:
-                chunk_copy = chunk.copy()
-                chunk_copy['score'] = score
-                scored_chunks.append(chunk_copy)
-                
-        # Sort by score desc
-        scored_chunks.sort(key=lambda x: x['score'], reverse=True)
-        return scored_chunks[:top_k]
+        results = []
+        for idx, score in self.index.search(query, top_k=top_k):
+            chunk = self.chunks[idx].copy()
+            chunk['score'] = score
+            results.append(chunk)
+        return results
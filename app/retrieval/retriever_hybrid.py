@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Tuple
+from app.config import settings
+from app.retrieval.base import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+class HybridRetriever(BaseRetriever):
+    """
+    Runs a vector and a lexical retriever concurrently and fuses their rankings.
+
+    Each leg gets the same deadline (HYBRID_LEG_TIMEOUT); a leg that misses it or fails
+    is dropped from the fusion, so a slow query embedding never holds up lexical results.
+    """
+
+    def __init__(self, legs: List[Tuple[str, BaseRetriever, float]]):
+        # legs: [(name, retriever, weight), ...]
+        self.legs = legs
+        self.fusion = settings.HYBRID_FUSION.lower()
+        self.rrf_k = settings.HYBRID_RRF_K
+        self.leg_timeout = settings.HYBRID_LEG_TIMEOUT
+        self.candidates = settings.HYBRID_CANDIDATES
+        # Timed-out legs keep their worker until they finish, so leave headroom beyond 2 legs/request
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(len(legs), settings.HYBRID_WORKERS), thread_name_prefix="hybrid-leg"
+        )
+        logger.info(f"HybridRetriever initialized with legs {[name for name, _, _ in legs]} ({self.fusion} fusion)")
+
+    def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        num_candidates = max(top_k, self.candidates)
+        start = time.time()
+        futures = {
+            self._executor.submit(retriever.retrieve, query, top_k=num_candidates): (name, weight)
+            for name, retriever, weight in self.legs
+        }
+        done, not_done = wait(futures, timeout=self.leg_timeout)
+
+        rankings = []
+        for future in done:
+            name, weight = futures[future]
+            try:
+                rankings.append((name, weight, future.result()))
+            except Exception as e:
+                logger.error(f"Hybrid leg '{name}' failed: {e}")
+        for future in not_done:
+            name, _ = futures[future]
+            logger.warning(f"Hybrid leg '{name}' exceeded {self.leg_timeout}s; using the other legs only.")
+
+        logger.info(f"Hybrid retrieval legs finished in {time.time() - start:.3f}s")
+        return self.fuse(rankings, top_k)
+
+    async def aretrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Event-loop variant: legs run as concurrent coroutines, each bounded by the leg timeout."""
+        num_candidates = max(top_k, self.candidates)
+        start = time.time()
+
+        async def run_leg(name: str, retriever: BaseRetriever, weight: float):
+            try:
+                results = await asyncio.wait_for(retriever.aretrieve(query, top_k=num_candidates), self.leg_timeout)
+                return name, weight, results
+            except asyncio.TimeoutError:
+                logger.warning(f"Hybrid leg '{name}' exceeded {self.leg_timeout}s; using the other legs only.")
+            except Exception as e:
+                logger.error(f"Hybrid leg '{name}' failed: {e}")
+            return None
+
+        outcomes = await asyncio.gather(*(run_leg(*leg) for leg in self.legs))
+        logger.info(f"Hybrid retrieval legs finished in {time.time() - start:.3f}s")
+        return self.fuse([o for o in outcomes if o is not None], top_k)
+
+    def fuse(self, rankings: List[Tuple[str, float, List[Dict[str, Any]]]], top_k: int) -> List[Dict[str, Any]]:
+        """Merges per-leg rankings by reciprocal-rank fusion or weighted min-max normalized scores."""
+        fused: Dict[str, Dict[str, Any]] = {}
+        for name, weight, results in rankings:
+            if not results:
+                continue
+            scores = [r.get('score', 0.0) for r in results]
+            low, high = min(scores), max(scores)
+            for rank, chunk in enumerate(results, 1):
+                if self.fusion == "weighted":
+                    norm = (chunk.get('score', 0.0) - low) / (high - low) if high > low else 1.0
+                    contribution = weight * norm
+                else:
+                    contribution = weight / (self.rrf_k + rank)
+
+                entry = fused.get(chunk['chunkId'])
+                if entry is None:
+                    entry = fused[chunk['chunkId']] = dict(chunk, score=0.0, legScores={})
+                entry['score'] += contribution
+                entry['legScores'][name] = chunk.get('score', 0.0)
+
+        ranked = sorted(fused.values(), key=lambda c: c['score'], reverse=True)
+        return ranked[:top_k]
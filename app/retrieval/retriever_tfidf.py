@@ -1,28 +1,66 @@
-import json
 import pickle
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from pathlib import Path
+import numpy as np
+from scipy.sparse import csr_matrix
 from app.config import settings
+from app.retrieval.artifacts import save_arrays, load_arrays
 from app.retrieval.base import BaseRetriever
-from sklearn.metrics.pairwise import cosine_similarity
+from app.retrieval.chunk_store import chunks_location, load_chunks
+from sklearn.metrics.pairwise import linear_kernel
 
 logger = logging.getLogger(__name__)
 
+TFIDF_DIR = "tfidf"
+LEGACY_TFIDF_FILE = "tfidf.pkl"
+
+
+def save_tfidf(directory: Path, vectorizer, tfidf_matrix):
+    """
+    Writes the fitted vectorizer (small: vocabulary and idf) as a pickle and the document
+    matrix as its CSR arrays, so the matrix can be memory-mapped and shared between workers.
+    """
+    matrix = csr_matrix(tfidf_matrix)
+    save_arrays(
+        directory,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape, dtype=np.int64),
+    )
+    with open(directory / "vectorizer.pkl", "wb") as f:
+        pickle.dump(vectorizer, f)
+
+
+def load_tfidf(artifacts_dir: Path, mmap: bool = True) -> Tuple[Any, csr_matrix]:
+    """Returns (vectorizer, matrix); reads the older single-pickle format (always copied) too."""
+    directory = artifacts_dir / TFIDF_DIR
+    if not directory.is_dir():
+        with open(artifacts_dir / LEGACY_TFIDF_FILE, "rb") as f:
+            return pickle.load(f)
+
+    with open(directory / "vectorizer.pkl", "rb") as f:
+        vectorizer = pickle.load(f)
+    arrays = load_arrays(directory, "data", "indices", "indptr", "shape", mmap=mmap)
+    # copy=False keeps the memory-mapped arrays as the matrix storage
+    matrix = csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=tuple(int(n) for n in arrays["shape"]),
+        copy=False,
+    )
+    return vectorizer, matrix
+
+
 class TfidfRetriever(BaseRetriever):
     def __init__(self):
         try:
-            artifacts_dir = settings.DATA_DIR / "artifacts"
-            
-            with open(artifacts_dir / "tfidf.pkl", "rb") as f:
-                self.vectorizer, self.tfidf_matrix = pickle.load(f)
-                
-            chunks_path = artifacts_dir / "chunks.jsonl"
-            self.chunks = []
-            with open(chunks_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    self.chunks.append(json.loads(line))
-                    
+            artifacts_dir = settings.ARTIFACTS_DIR
+
+            self.vectorizer, self.tfidf_matrix = load_tfidf(artifacts_dir, mmap=settings.INDEX_MMAP)
+
+            self.chunks = load_chunks(chunks_location(artifacts_dir))
+
             logger.info(f"TfidfRetriever initialized with {len(self.chunks)} chunks.")
         except Exception as e:
             logger.error(f"Failed to initialize TfidfRetriever: {e}")
@@ -30,16 +68,18 @@ class TfidfRetriever(BaseRetriever):
 
     def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
         query_vec = self.vectorizer.transform([query])
-        similarities = cosine_similarity(query_vec, self.tfidf_matrix).flatten()
-        
+        # TfidfVectorizer rows are already L2-normalized, so the dot product is the cosine.
+        # (cosine_similarity would re-normalize a private copy of the whole matrix per query)
+        similarities = linear_kernel(query_vec, self.tfidf_matrix).flatten()
+
         # Get top K indices
         top_indices = similarities.argsort()[-top_k:][::-1]
-        
+
         results = []
         for idx in top_indices:
             if similarities[idx] > 0:
                 chunk = self.chunks[idx].copy()
                 chunk['score'] = float(similarities[idx])
                 results.append(chunk)
-                
+
         return results
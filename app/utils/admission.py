@@ -0,0 +1,143 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, Iterable
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    def __init__(self, stage: str, reason: str, retry_after: int):
+        super().__init__(f"{stage} stage overloaded: {reason}")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Permit:
+    """One admitted request in a stage; release() is idempotent."""
+
+    def __init__(self, gate: "StageGate"):
+        self._gate = gate
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._gate._release()
+
+
+class StageGate:
+    """
+    At most `limit` requests in a pipeline stage at once. Requests over the limit wait in a
+    FIFO queue of at most queue_size; a request is turned away (Overloaded) when the queue
+    is full, or when it has waited `deadline` seconds without getting in.
+    Used from the event loop only.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, deadline: float, retry_after: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._waiters = deque()
+        self._stats = {"admitted": 0, "rejected": 0, "timedOut": 0, "waitMsTotal": 0.0}
+
+    def saturated(self) -> bool:
+        """True when a new request would be rejected right away."""
+        return self._in_flight >= self.limit and len(self._waiters) >= self.queue_size
+
+    def _overloaded(self, reason: str) -> Overloaded:
+        return Overloaded(self.name, reason, self.retry_after)
+
+    async def acquire(self) -> Permit:
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            return Permit(self)
+        if len(self._waiters) >= self.queue_size:
+            self._stats["rejected"] += 1
+            raise self._overloaded("queue full")
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait({future}, timeout=self.deadline)
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        if not future.done():
+            self._abandon(future)
+            self._stats["timedOut"] += 1
+            raise self._overloaded(f"no slot within {self.deadline:g}s")
+        self._stats["admitted"] += 1
+        self._stats["waitMsTotal"] += (time.monotonic() - started) * 1000
+        return Permit(self)
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            # The slot was handed over just as this waiter gave up: pass it on
+            self._release()
+            return
+        future.cancel()
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def _release(self):
+        # Hand the slot straight to the oldest waiter, so in-flight stays at the limit
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        s = self._stats
+        waited = s["admitted"]
+        return {
+            "limit": self.limit,
+            "inFlight": self._in_flight,
+            "queued": len(self._waiters),
+            "queueSize": self.queue_size,
+            "admitted": s["admitted"],
+            "rejected": s["rejected"],
+            "timedOut": s["timedOut"],
+            "waitMsMean": s["waitMsTotal"] / waited if waited else 0.0,
+        }
+
+
+class AdmissionController:
+    """Stage gates of the chat pipeline: 'retrieval' (intent detection and retrieval) and 'generation'."""
+
+    def __init__(self, gates: Iterable[StageGate]):
+        self.gates = {gate.name: gate for gate in gates}
+
+    def check(self, *stages: str):
+        """Fails fast, before any work, if a stage the request will need is saturated."""
+        for stage in stages:
+            gate = self.gates[stage]
+            if gate.saturated():
+                gate._stats["rejected"] += 1
+                raise gate._overloaded("queue full")
+
+    async def acquire(self, stage: str) -> Permit:
+        return await self.gates[stage].acquire()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+admission = AdmissionController([
+    StageGate("retrieval", settings.ADMISSION_RETRIEVAL_LIMIT, settings.ADMISSION_QUEUE_SIZE,
+              settings.ADMISSION_QUEUE_TIMEOUT, settings.ADMISSION_RETRY_AFTER),
+    StageGate("generation", settings.ADMISSION_GENERATION_LIMIT, settings.ADMISSION_QUEUE_SIZE,
+              settings.ADMISSION_QUEUE_TIMEOUT, settings.ADMISSION_RETRY_AFTER),
+])
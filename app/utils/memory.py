@@ -0,0 +1,63 @@
+import os
+import resource
+import sys
+from typing import Dict, Any
+
+_SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Anonymous")
+
+
+def _read_smaps_rollup() -> Dict[str, int]:
+    """Totals from /proc/self/smaps_rollup in kB (Linux 4.14+); empty when unavailable."""
+    totals = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].rstrip(":") in _SMAPS_FIELDS:
+                    totals[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        pass
+    return totals
+
+
+def memory_usage() -> Dict[str, Any]:
+    """
+    Resident memory of this process in MB.
+
+    - rssMb: everything resident, counting shared pages in full
+    - sharedMb: resident pages other processes (the other workers) also map right now
+    - privateMb: pages only this process maps
+    - fileBackedMb: resident pages of mapped files (index artifacts, libraries); they are
+      shareable even when only one worker has touched them so far
+    - pssMb: proportional share, i.e. shared pages divided by the number of processes mapping
+      them. Summed over all workers this is the real footprint of the deployment.
+    """
+    smaps = _read_smaps_rollup()
+    usage: Dict[str, Any] = {"pid": os.getpid()}
+    if not smaps:
+        # No per-mapping accounting (not Linux): peak resident size only
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        usage["maxRssMb"] = round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+        return usage
+
+    def mb(*fields: str) -> float:
+        return round(sum(smaps.get(field, 0) for field in fields) / 1024, 1)
+
+    usage.update(
+        rssMb=mb("Rss"),
+        pssMb=mb("Pss"),
+        sharedMb=mb("Shared_Clean", "Shared_Dirty"),
+        privateMb=mb("Private_Clean", "Private_Dirty"),
+        fileBackedMb=round(mb("Rss") - mb("Anonymous"), 1),
+        anonymousMb=mb("Anonymous"),
+    )
+    return usage
+
+
+def format_memory(usage: Dict[str, Any]) -> str:
+    if "rssMb" not in usage:
+        return f"max RSS {usage['maxRssMb']} MB"
+    return (
+        f"RSS {usage['rssMb']} MB (shared {usage['sharedMb']}, private {usage['privateMb']}; "
+        f"file-backed {usage['fileBackedMb']}, anonymous {usage['anonymousMb']}), PSS {usage['pssMb']} MB"
+    )
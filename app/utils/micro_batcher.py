@@ -0,0 +1,111 @@
+import time
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+_batchers: "weakref.WeakValueDictionary[str, MicroBatcher]" = weakref.WeakValueDictionary()
+
+
+class _Batch:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.futures: List[Future] = []
+        self.arrivals: List[float] = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Turns concurrent single calls into one batch call: call(item) blocks until
+    batch_fn(items) has run on a batch containing item, and returns that item's result.
+
+    The first caller of a batch leads it and runs batch_fn on its own thread. If
+    max_running batches are already running, it waits for one to finish while later
+    callers join its batch (up to max_batch). If fewer are running, it waits at most
+    max_wait seconds for company. A caller arriving when nothing is running doesn't
+    wait at all, so batching only costs latency under concurrent load.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], List[Any]], max_batch: int, max_wait: float,
+                 max_running: int = 1):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.max_running = max(1, max_running)
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._open = None
+        self._running = 0
+        self._stats = {"batches": 0, "items": 0, "maxBatchSize": 0, "waitMsTotal": 0.0, "waitMsMax": 0.0}
+        _batchers[name] = self
+
+    def call(self, item: Any) -> Any:
+        future = Future()
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+                should_wait = 0 < self._running < self.max_running and self.max_wait > 0 and self.max_batch > 1
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.arrivals.append(time.monotonic())
+            if len(batch.items) >= self.max_batch:
+                self._open = None
+                batch.full.set()
+        if not leader:
+            return future.result()
+
+        if should_wait:
+            batch.full.wait(self.max_wait)
+        with self._lock:
+            while self._running >= self.max_running:
+                self._slot_free.wait()
+            if self._open is batch:
+                self._open = None
+            self._running += 1
+        self._run(batch)
+        return future.result()
+
+    def _run(self, batch: _Batch):
+        started = time.monotonic()
+        try:
+            results = self.batch_fn(batch.items)
+            if len(results) != len(batch.items):
+                raise RuntimeError(f"{self.name}: batch of {len(batch.items)} returned {len(results)} results")
+        except BaseException as e:
+            for future in batch.futures:
+                future.set_exception(e)
+        else:
+            for future, result in zip(batch.futures, results):
+                future.set_result(result)
+        finally:
+            waits = [(started - arrival) * 1000 for arrival in batch.arrivals]
+            with self._lock:
+                self._running -= 1
+                self._slot_free.notify()
+                stats = self._stats
+                stats["batches"] += 1
+                stats["items"] += len(batch.items)
+                stats["maxBatchSize"] = max(stats["maxBatchSize"], len(batch.items))
+                stats["waitMsTotal"] += sum(waits)
+                stats["waitMsMax"] = max(stats["waitMsMax"], max(waits))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = self._stats
+            return {
+                "batches": s["batches"],
+                "items": s["items"],
+                "meanBatchSize": s["items"] / s["batches"] if s["batches"] else 0.0,
+                "maxBatchSize": s["maxBatchSize"],
+                "waitMsMean": s["waitMsTotal"] / s["items"] if s["items"] else 0.0,
+                "waitMsMax": s["waitMsMax"],
+            }
+
+
+def batcher_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of every live batcher, by name."""
+    return {name: batcher.stats() for name, batcher in list(_batchers.items())}
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcast:
+    """
+    Append-only event buffer with any number of independent readers. Every reader starts
+    at the first event, so one that joins late gets everything produced so far replayed
+    before the live events.
+    """
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, item: Any):
+        self.items.append(item)
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.finished = True
+        self.error = error
+        self._wake()
+
+    async def read(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            if position < len(self.items):
+                position += 1
+                yield self.items[position - 1]
+                continue
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class _Flight:
+    def __init__(self):
+        self.broadcast = Broadcast()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    Runs one producer per key however many callers ask for it concurrently; every caller
+    reads the producer's events through its own subscription.
+
+    The producer runs as its own task, so a subscriber going away never affects the
+    others. When the last subscriber leaves, the producer is cancelled. A key is free
+    again as soon as its producer finishes; later callers start a new one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {"leaders": 0, "joined": 0, "cancelled": 0}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def join(self, key: Hashable, produce: Callable[[], AsyncIterator[Any]],
+             on_finish: Optional[Callable[[], None]] = None) -> Tuple[AsyncIterator[Any], bool]:
+        """
+        Returns (subscription, leader); leader is True when this call started the producer.
+        on_finish runs when a producer started by this call ends, however it ends.
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, produce()))
+            if on_finish is not None:
+                flight.task.add_done_callback(lambda _: on_finish())
+            self._stats["leaders"] += 1
+        else:
+            self._stats["joined"] += 1
+        # Counted now rather than on first read, so a producer can't be cancelled between
+        # another caller's join and its first read
+        flight.subscribers += 1
+        return self._subscribe(key, flight), leader
+
+    async def _run(self, key: Hashable, flight: _Flight, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                flight.broadcast.publish(item)
+            flight.broadcast.finish()
+        except asyncio.CancelledError as e:
+            flight.broadcast.finish(e)
+        except Exception as e:
+            logger.error(f"{self.name}: shared producer failed: {e}")
+            flight.broadcast.finish(e)
+        finally:
+            self._release(key, flight)
+            await source.aclose()
+
+    async def _subscribe(self, key: Hashable, flight: _Flight) -> AsyncIterator[Any]:
+        try:
+            async for item in flight.broadcast.read():
+                yield item
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                self._stats["cancelled"] += 1
+                self._release(key, flight)
+                flight.task.cancel()
+
+    def _release(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, inFlight=len(self._flights))
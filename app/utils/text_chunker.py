@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Tuple
 import re
 
 class TextChunker:
@@ -6,20 +6,20 @@ class TextChunker:
         self.chunk_size = chunk_size
         self.overlap = overlap
 
-    def chunk_text(self, text: str, meta: Dict) -> List[Dict]:
+    def iter_spans(self, text: str) -> Iterator[Tuple[int, int]]:
         """
-        Splits text into chunks with overlap.
+        Yields (start, end) character offsets of each chunk, whitespace-trimmed.
+        text[start:end] is exactly the chunk text returned by chunk_text().
         """
         if not text:
-            return []
-            
-        chunks = []
+            return
+
         start = 0
         text_len = len(text)
 
         while start < text_len:
             end = min(start + self.chunk_size, text_len)
-            
+
             # If not at the end, try to break at a newline or space
             if end < text_len:
                 # Look for last newline in the chunk
@@ -31,15 +31,78 @@ class TextChunker:
                     last_space = text.rfind(' ', start, end)
                     if last_space != -1:
                         end = last_space + 1
-            
-            chunk_text = text[start:end].strip()
-            if chunk_text:
-                chunks.append({
-                    "text": chunk_text,
-                    "meta": meta,
-                    "chunkId": f"{meta.get('docId')}_{len(chunks)}"
-                })
-            
+
+            raw = text[start:end]
+            stripped = raw.strip()
+            if stripped:
+                lead = len(raw) - len(raw.lstrip())
+                yield start + lead, start + lead + len(stripped)
+
             start += (self.chunk_size - self.overlap)
-            
+
+    def iter_stream(self, pieces: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+        """
+        Streaming form of iter_spans: consumes the text as an iterable of pieces (pages,
+        sections, file blocks) and yields (start, end, chunk text), offsets being into the
+        concatenated text. Only the current window is buffered, never the whole document;
+        the chunks are exactly those iter_spans() gives for "".join(pieces).
+        """
+        pieces = iter(pieces)
+        buffer = ""        # text[buffer_start:], as much as has been read
+        buffer_start = 0
+        exhausted = False
+        start = 0
+
+        while True:
+            # One char past the window tells whether the window reaches the end of the text
+            while not exhausted and buffer_start + len(buffer) <= start + self.chunk_size:
+                piece = next(pieces, None)
+                if piece is None:
+                    exhausted = True
+                else:
+                    buffer += piece
+
+            text_len = buffer_start + len(buffer)
+            if start >= text_len:
+                return
+
+            local = start - buffer_start
+            end = min(local + self.chunk_size, len(buffer))
+
+            # If not at the end, try to break at a newline or space
+            if end < len(buffer):
+                last_newline = buffer.rfind('\n', local, end)
+                if last_newline != -1:
+                    end = last_newline + 1
+                else:
+                    last_space = buffer.rfind(' ', local, end)
+                    if last_space != -1:
+                        end = last_space + 1
+
+            raw = buffer[local:end]
+            stripped = raw.strip()
+            if stripped:
+                lead = len(raw) - len(raw.lstrip())
+                yield start + lead, start + lead + len(stripped), stripped
+
+            start += (self.chunk_size - self.overlap)
+            # Text before the window start is never looked at again. Dropping it copies the
+            # rest of the buffer, so only do it once it is at least half the buffer: a large
+            # piece (one huge page) is then copied a few times, not once per chunk
+            consumed = start - buffer_start
+            if consumed > 0 and consumed * 2 >= len(buffer):
+                buffer = buffer[consumed:]
+                buffer_start = start
+
+    def chunk_text(self, text: str, meta: Dict) -> List[Dict]:
+        """
+        Splits text into chunks with overlap.
+        """
+        chunks = []
+        for start, end in self.iter_spans(text):
+            chunks.append({
+                "text": text[start:end],
+                "meta": meta,
+                "chunkId": f"{meta.get('docId')}_{len(chunks)}"
+            })
         return chunks
@@ -1,18 +1,24 @@
 import os
 import sys
+import shutil
 import json
-import pickle
 import argparse
 import logging
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 
 # Add backend to path to import app modules
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.config import settings
+from app.retrieval.artifacts import atomic_write_path, replace_path, write_manifest
+from app.retrieval.chunk_store import ChunkStore, ChunkStoreWriter, CHUNK_STORE_DIR
+from app.retrieval.bm25_index import BM25Index
+from app.retrieval.retriever_tfidf import TFIDF_DIR, LEGACY_TFIDF_FILE, save_tfidf
+from app.retrieval.faiss_index import INDEX_TYPES, build_faiss_index, evaluate_index, params_path, save_params
 # Import the new Vertex Embedder
 from app.embeddings.vertex_embedder import VertexEmbedder
+from app.embeddings.embedding_store import EmbeddingStore, embed_with_store
 import numpy as np
 import faiss
 
@@ -20,14 +26,101 @@ import faiss
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def build_index():
+def read_blocks(path: Path, block_chars: int = 1 << 16) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        for block in iter(lambda: f.read(block_chars), ""):
+            yield block
+
+def iter_documents(interim_dir: Path) -> Iterator[Tuple[Iterator[str], Dict, Optional[List]]]:
+    """
+    Yields (text blocks, meta, page offsets) one interim document at a time, in a stable order.
+    The text is read lazily in blocks; page offsets come from ingest and are kept out of the
+    metadata copied into every chunk.
+    """
+    for txt_file in sorted(interim_dir.glob("*.txt")):
+        meta_file = txt_file.with_suffix(".meta.json")
+        meta = {}
+        if meta_file.exists():
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+        pages = meta.pop("pageOffsets", None)
+        yield read_blocks(txt_file), meta, pages
+
+def write_checkpoint(checkpoint_file: Path, state: Dict):
+    tmp_file = atomic_write_path(checkpoint_file)
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, checkpoint_file)
+
+def embed_chunks(store: ChunkStore, corpus_hash: str, vectors_file: Path, checkpoint_file: Path,
+                 batch_size: int) -> np.memmap:
+    """
+    Streams chunk texts from the chunk store through the embedder in batches and appends
+    the normalized vectors to an on-disk float32 spool (vectors_file).
+
+    Progress is checkpointed after every batch. If a previous run over the same corpus died
+    midway, embedding resumes after the last completed batch; vectors fetched before the
+    crash are also in the content-hash embedding store, so nothing is paid for twice.
+    """
+    num_chunks = len(store)
+    embedder = VertexEmbedder()
+    embedding_store = EmbeddingStore(Path(settings.EMBED_STORE_PATH))
+
+    vectors = None
+    done = 0
+    if checkpoint_file.exists() and vectors_file.exists():
+        with open(checkpoint_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("corpus") == corpus_hash and state.get("model") == embedder.model:
+            done = state["embedded"]
+            vectors = np.memmap(vectors_file, dtype="float32", mode="r+", shape=(num_chunks, state["dimension"]))
+            logger.info(f"Resuming embedding from checkpoint: {done}/{num_chunks} chunks already embedded")
+
+    reused_total, fetched_total = 0, 0
+    try:
+        for start in range(done, num_chunks, batch_size):
+            end = min(start + batch_size, num_chunks)
+            texts = [store.text(i) for i in range(start, end)]
+            batch, reused, fetched = embed_with_store(texts, embedding_store, embedder.model, embedder.embed_texts)
+            reused_total += reused
+            fetched_total += fetched
+
+            # Normalize for Cosine Similarity
+            faiss.normalize_L2(batch)
+            if vectors is None:
+                vectors = np.memmap(vectors_file, dtype="float32", mode="w+", shape=(num_chunks, batch.shape[1]))
+                logger.info(f"Embedding dimension: {batch.shape[1]}")
+            vectors[start:end] = batch
+            vectors.flush()
+            write_checkpoint(checkpoint_file, {
+                "corpus": corpus_hash,
+                "model": embedder.model,
+                "dimension": int(batch.shape[1]),
+                "embedded": end,
+            })
+            logger.info(f"Embedded {end}/{num_chunks} chunks")
+    finally:
+        embedding_store.close()
+
+    logger.info(f"Embeddings: {reused_total} reused from {settings.EMBED_STORE_PATH}, {fetched_total} fetched from Vertex")
+    return vectors
+
+def build_index(index_type: str = "flat", index_options: Dict = None, eval_k: int = 10, eval_queries: int = 200):
+    """
+    Streaming build: documents -> chunk store -> embedding batches -> vector spool -> FAISS.
+    Working memory is bounded by one chunking window plus one embedding batch, not by corpus size
+    (the FAISS and BM25 structures being built are the only corpus-sized objects).
+    """
     logger.info("Starting index build process...")
 
     # Paths
-    artifacts_dir = settings.DATA_DIR / "artifacts"
+    artifacts_dir = settings.ARTIFACTS_DIR
     interim_dir = settings.DATA_DIR / "interim"
-    chunks_file = artifacts_dir / "chunks.jsonl"
+    chunk_store_dir = artifacts_dir / CHUNK_STORE_DIR
     faiss_index_file = artifacts_dir / "faiss.index"
+    # Build scratch space, kept after a failed run so the next one can resume
+    vectors_file = artifacts_dir / ".build_vectors.f32"
+    checkpoint_file = artifacts_dir / ".build_checkpoint.json"
     
     # Ensure artifacts directory exists
     artifacts_dir.mkdir(parents=True, exist_ok=True)
@@ -37,69 +130,82 @@ def build_index():
         logger.error(f"No processed documents found in {interim_dir}. Please run 'python scripts/ingest_docs.py' first.")
         return
     
-    # 1. Load Chunks
-    # Ideally, we should reload from source texts and re-chunk. 
-    # But for now, we assume chunks.jsonl is already populated by ingest_docs.py (or we read from interim).
-    # Since ingest_docs creates interim txt files, let's assume we need to generate chunks.jsonl first?
-    # Previous implementation of ingest_docs.py does NOT create chunks.jsonl, build_index.py DOES.
-    # So we need to read from data/interim/*.txt and chunk them first.
-    
+    # 1. Chunk documents into the chunk store
+    # Chunks are recorded as offsets into each document's text (see app/retrieval/chunk_store.py),
+    # so the overlap between neighbouring chunks is not stored twice.
     from app.utils.text_chunker import TextChunker
     chunker = TextChunker(chunk_size=settings.CHUNK_SIZE, overlap=settings.CHUNK_OVERLAP)
     
-    all_chunks = []
-    
+    # Everything is written to temporary files first and swapped in at the end,
+    # so a running server never sees a half-written build.
+    staged = {}
+    staged[chunk_store_dir] = atomic_write_path(chunk_store_dir)
+    if staged[chunk_store_dir].exists():
+        shutil.rmtree(staged[chunk_store_dir])
+
     logger.info("Reading processed documents from interim...")
-    for txt_file in interim_dir.glob("*.txt"):
-        with open(txt_file, "r", encoding="utf-8") as f:
-            text = f.read()
-            
-        meta_file = txt_file.with_suffix(".meta.json")
-        meta = {}
-        if meta_file.exists():
-            with open(meta_file, "r") as f:
-                meta = json.load(f)
-                
-        # Chunking
-        doc_chunks = chunker.chunk_text(text, meta)
-        all_chunks.extend(doc_chunks)
+    with ChunkStoreWriter(staged[chunk_store_dir]) as writer:
+        for blocks, meta, pages in iter_documents(interim_dir):
+            writer.add_document(blocks, meta, chunker, pages)
+    num_chunks = writer.num_chunks
+    corpus_hash = writer.content_hash
         
-    logger.info(f"Created {len(all_chunks)} chunks.")
-    
-    # Save chunks.jsonl
-    with open(chunks_file, "w", encoding="utf-8") as f:
-        for chunk in all_chunks:
-            f.write(json.dumps(chunk) + "\n")
+    logger.info(f"Created {num_chunks} chunks.")
             
-    if not all_chunks:
+    if not num_chunks:
         logger.warning("No chunks to index.")
+        shutil.rmtree(staged[chunk_store_dir])
         return
 
+    store = ChunkStore(staged[chunk_store_dir])
+
+    # Lexical index for the local (no-Vertex) retriever; cheap, so always built
+    bm25_dir = artifacts_dir / "bm25"
+    staged[bm25_dir] = atomic_write_path(bm25_dir)
+    if staged[bm25_dir].exists():
+        shutil.rmtree(staged[bm25_dir])
+    BM25Index.build(store.iter_texts()).save(staged[bm25_dir])
+    logger.info(f"BM25 index saved to {bm25_dir}")
+
+    built_type = "faiss"
+
     # 2. Build Index using Vertex Embeddings
     try:
         logger.info(f"Generating embeddings using {settings.VERTEX_EMBEDDING_MODEL}...")
-        embedder = VertexEmbedder()
-        
-        texts = [c['text'] for c in all_chunks]
-        embeddings = embedder.embed_texts(texts)
-        
-        # Convert to numpy and normalize for Cosine Similarity
-        embeddings_np = np.array(embeddings).astype('float32')
-        faiss.normalize_L2(embeddings_np)
+        embeddings_np = embed_chunks(store, corpus_hash, vectors_file, checkpoint_file, settings.BUILD_BATCH_SIZE)
         
-        dimension = embeddings_np.shape[1]
-        logger.info(f"Embedding dimension: {dimension}")
+        # Inner Product equals Cosine Similarity on normalized vectors
+        index, index_params = build_faiss_index(embeddings_np, index_type, index_options)
+        logger.info(f"Built '{index_params['indexType']}' index with params {index_params}")
         
-        # Use IndexFlatIP (Inner Product) which equals Cosine Similarity on normalized vectors
-        index = faiss.IndexFlatIP(dimension)
-        index.add(embeddings_np)
+        if index_params["indexType"] != "flat" and eval_queries > 0:
+            report = evaluate_index(index, embeddings_np, k=eval_k, num_queries=eval_queries)
+            logger.info(
+                f"Recall@{report['k']} vs flat over {report['queries']} queries: {report['recall']:.3f} | "
+                f"latency/query: {report['indexMsMean']:.2f} ms (p95 {report['indexMsP95']:.2f}) "
+                f"vs flat {report['flatMsMean']:.2f} ms (p95 {report['flatMsP95']:.2f})"
+            )
+            index_params["evaluation"] = report
         
-        # Save FAISS index
-        faiss.write_index(index, str(faiss_index_file))
+        # Save FAISS index and its search settings (applied by FaissVertexRetriever at load)
+        staged[faiss_index_file] = atomic_write_path(faiss_index_file)
+        faiss.write_index(index, str(staged[faiss_index_file]))
+        faiss_params_file = params_path(faiss_index_file)
+        staged[faiss_params_file] = atomic_write_path(faiss_params_file)
+        save_params(staged[faiss_params_file], index_params)
+        built_type = f"faiss:{index_params['indexType']}"
         logger.info(f"FAISS index saved to {faiss_index_file}")
         
+        # Vector index done: the resume scratch space is no longer needed
+        del index, embeddings_np
+        for scratch in (vectors_file, checkpoint_file):
+            if scratch.exists():
+                scratch.unlink()
+        
     except Exception as e:
         logger.error(f"Failed to build FAISS index with Vertex Embeddings: {e}")
+        if checkpoint_file.exists():
+            logger.info("Embedding progress was checkpointed; re-run build_index.py to resume.")
         # We can implement a fallback or just fail. 
         # Since requirements say "Keep FAISS retrieval if available", we should try to succeed.
         # But if Vertex is down during build, we can't really build a vector index. 
@@ -109,15 +215,69 @@ def build_index():
         from sklearn.feature_extraction.text import TfidfVectorizer
         try:
             vectorizer = TfidfVectorizer()
-            tfidf_matrix = vectorizer.fit_transform(texts)
+            tfidf_matrix = vectorizer.fit_transform(store.iter_texts())
             
-            with open(artifacts_dir / "tfidf.pkl", "wb") as f:
-                pickle.dump((vectorizer, tfidf_matrix), f)
+            tfidf_dir = artifacts_dir / TFIDF_DIR
+            staged[tfidf_dir] = atomic_write_path(tfidf_dir)
+            if staged[tfidf_dir].exists():
+                shutil.rmtree(staged[tfidf_dir])
+            save_tfidf(staged[tfidf_dir], vectorizer, tfidf_matrix)
+            built_type = "tfidf"
             logger.info("TF-IDF index built as fallback.")
         except Exception as tfidf_e:
             logger.error(f"TF-IDF build also failed: {tfidf_e}")
 
-    logger.info("Index build complete.")
+    store.close()
+
+    # Swap the new artifacts into place, then publish the manifest last
+    for final_path, tmp_path in staged.items():
+        replace_path(tmp_path, final_path)
+    # Superseded by the chunk store and by the memory-mappable array directories
+    superseded = [artifacts_dir / "chunks.jsonl", artifacts_dir / "bm25.npz"]
+    if artifacts_dir / TFIDF_DIR in staged:
+        superseded.append(artifacts_dir / LEGACY_TFIDF_FILE)
+    if faiss_index_file not in staged:
+        # A vector index from an earlier build no longer lines up with the new chunks
+        superseded += [faiss_index_file, params_path(faiss_index_file)]
+    for stale_file in superseded:
+        if stale_file.exists():
+            stale_file.unlink()
+    manifest = write_manifest(
+        artifacts_dir,
+        chunks=num_chunks,
+        indexType=built_type,
+        embeddingModel=settings.VERTEX_EMBEDDING_MODEL,
+    )
+
+    logger.info(f"Index build complete. Version: {manifest['version']}")
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build search indices from ingested documents")
+    parser.add_argument("--index-type", default="flat", choices=INDEX_TYPES, help="FAISS index type")
+    parser.add_argument("--train-size", type=int, help="Vectors sampled to train IVF indices")
+    parser.add_argument("--nlist", type=int, help="IVF: number of inverted lists")
+    parser.add_argument("--nprobe", type=int, help="IVF: lists probed per query")
+    parser.add_argument("--pq-m", type=int, help="IVF-PQ: number of sub-quantizers (must divide the dimension)")
+    parser.add_argument("--pq-bits", type=int, help="IVF-PQ: bits per sub-quantizer code")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW: neighbours per node")
+    parser.add_argument("--ef-construction", type=int, help="HNSW: build-time search depth")
+    parser.add_argument("--ef-search", type=int, help="HNSW: query-time search depth")
+    parser.add_argument("--eval-k", type=int, default=10, help="k for the recall@k report")
+    parser.add_argument("--eval-queries", type=int, default=200, help="Queries for the recall/latency report (0 disables)")
+    args = parser.parse_args()
+
+    build_index(
+        index_type=args.index_type,
+        index_options={
+            "trainSize": args.train_size,
+            "nlist": args.nlist,
+            "nprobe": args.nprobe,
+            "pqM": args.pq_m,
+            "pqBits": args.pq_bits,
+            "hnswM": args.hnsw_m,
+            "efConstruction": args.ef_construction,
+            "efSearch": args.ef_search,
+        },
+        eval_k=args.eval_k,
+        eval_queries=args.eval_queries,
+    )
@@ -1,10 +1,13 @@
 import os
 import argparse
 import sys
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import json
 import logging
-from typing import List
+from typing import List, Dict, Any, Iterator
 
 # Setup robust path handling - MUST be before importing from 'app'
 BASE_DIR = Path(__file__).parent.parent
@@ -26,35 +29,146 @@ from bs4 import BeautifulSoup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def parse_pdf(file_path: Path) -> str:
-    try:
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        logger.error(f"Error parsing PDF {file_path}: {e}")
-        return ""
+MANIFEST_NAME = "manifest.json"
 
-def parse_docx(file_path: Path) -> str:
-    try:
-        doc = Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
-    except Exception as e:
-        logger.error(f"Error parsing DOCX {file_path}: {e}")
-        return ""
+def parse_pdf(file_path: Path) -> Iterator[str]:
+    """Yields the text of each page; pages are extracted lazily as the caller consumes them."""
+    reader = PdfReader(file_path)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+def parse_docx(file_path: Path) -> Iterator[str]:
+    """Yields one section per heading (text before the first heading is section 1)."""
+    doc = Document(file_path)
+    section = []
+    for para in doc.paragraphs:
+        if para.style is not None and para.style.name.startswith("Heading") and section:
+            yield "\n".join(section)
+            section = []
+        section.append(para.text)
+    if section:
+        yield "\n".join(section)
+
+def parse_html(file_path: Path) -> Iterator[str]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f, 'html.parser')
+    yield soup.get_text(separator=' ', strip=True)
+
+SUPPORTED_EXTENSIONS = {'.pdf': parse_pdf, '.docx': parse_docx, '.html': parse_html}
+# What the parser's units are called in citations
+PAGE_UNITS = {'.pdf': 'page', '.docx': 'section', '.html': 'section'}
+
+def file_hash(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(output_path: Path) -> Dict[str, Any]:
+    manifest_file = output_path / MANIFEST_NAME
+    if manifest_file.exists():
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"files": {}}
+
+def save_manifest(output_path: Path, manifest: Dict[str, Any]):
+    manifest_file = output_path / MANIFEST_NAME
+    tmp_file = manifest_file.with_name(f".{MANIFEST_NAME}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+def make_doc_id(file_path: Path, input_path: Path) -> str:
+    """
+    Readable and unique per source: the file stem plus a hash of the path relative to the
+    input directory, so a/guide.pdf, b/guide.pdf and guide.html never share outputs.
+    """
+    relative = file_path.relative_to(input_path).as_posix()
+    return f"{file_path.stem}-{hashlib.sha1(relative.encode('utf-8')).hexdigest()[:8]}"
+
+def remove_outputs(output_path: Path, outputs: List[str], known: Dict[str, Any]):
+    """Deletes interim outputs that no manifest entry references any more."""
+    referenced = {name for entry in known.values() for name in entry.get("outputs", [])}
+    for name in outputs:
+        path = output_path / name
+        if name not in referenced and path.exists():
+            path.unlink()
 
-def parse_html(file_path: Path) -> str:
+def process_file(file_path: Path, output_path: Path, doc_id: str) -> Dict[str, Any]:
+    """
+    Parses one source file and writes its interim text + metadata. Runs in a worker process.
+    Pages are normalized and written one at a time; their start offsets in the interim text
+    are kept in the metadata so chunks can be mapped back to pages.
+    """
+    start = time.time()
+    ext = file_path.suffix.lower()
+    parser = SUPPORTED_EXTENSIONS[ext]
+    result = {"path": str(file_path), "ok": False, "outputs": [], "seconds": 0.0}
+
+    output_file = output_path / f"{doc_id}.txt"
+    tmp_file = output_file.with_name(f".{output_file.name}.tmp")
+    page_offsets = []
+    length = 0
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'html.parser')
-            return soup.get_text(separator=' ', strip=True)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for page_number, page_text in enumerate(parser(file_path), 1):
+                # Normalize whitespace
+                page_text = " ".join(page_text.split())
+                if not page_text:
+                    continue
+                if length:
+                    f.write(" ")
+                    length += 1
+                page_offsets.append([page_number, length])
+                f.write(page_text)
+                length += len(page_text)
     except Exception as e:
-        logger.error(f"Error parsing HTML {file_path}: {e}")
-        return ""
+        logger.error(f"Error parsing {file_path}: {e}")
+        length = 0
+
+    if length:
+        os.replace(tmp_file, output_file)
+        
+        # Save metadata
+        meta_file = output_path / f"{doc_id}.meta.json"
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "sourcePath": str(file_path),
+                "docTitle": file_path.name,
+                "docId": doc_id,
+                "pageUnit": PAGE_UNITS[ext],
+                "pageOffsets": page_offsets
+            }, f)
+        
+        result.update(ok=True, docId=doc_id, outputs=[output_file.name, meta_file.name])
+    elif tmp_file.exists():
+        tmp_file.unlink()
+    result["seconds"] = time.time() - start
+    return result
+
+def log_summary(stats: Dict[str, Dict[str, float]], wall_seconds: float):
+    logger.info("Ingestion throughput by file type:")
+    total_files, total_bytes = 0, 0
+    for ext, s in sorted(stats.items()):
+        if not s["files"]:
+            continue
+        mb = s["bytes"] / 1e6
+        rate = s["files"] / s["seconds"] if s["seconds"] else 0.0
+        mb_rate = mb / s["seconds"] if s["seconds"] else 0.0
+        logger.info(
+            f"  {ext}: {s['files']} parsed ({s['failed']} failed), {mb:.1f} MB, "
+            f"{s['seconds']:.1f}s parse time, {rate:.2f} files/s, {mb_rate:.2f} MB/s per worker"
+        )
+        total_files += s["files"]
+        total_bytes += s["bytes"]
+    if total_files and wall_seconds:
+        logger.info(
+            f"  overall: {total_files} files in {wall_seconds:.1f}s wall, "
+            f"{total_files / wall_seconds:.2f} files/s, {total_bytes / 1e6 / wall_seconds:.2f} MB/s"
+        )
 
-def ingest_docs(input_dir: str, output_dir: str):
+def ingest_docs(input_dir: str, output_dir: str, workers: int = 1, force: bool = False):
     input_path = Path(input_dir).resolve()
     output_path = Path(output_dir).resolve()
     
@@ -69,56 +183,119 @@ def ingest_docs(input_dir: str, output_dir: str):
         return
 
     output_path.mkdir(parents=True, exist_ok=True)
+    start_time = time.time()
     
-    supported_extensions = {'.pdf': parse_pdf, '.docx': parse_docx, '.html': parse_html}
+    # Without a manifest the directory may hold outputs of the old stem-named layout
+    legacy_layout = not (output_path / MANIFEST_NAME).exists()
+    manifest = load_manifest(output_path)
+    known = manifest["files"]
     
     count = 0
     skipped = 0
+    unchanged = 0
     total_files = 0
+    to_process = []
+    seen = set()
     
+    # 1. Decide what needs parsing: new files and files whose content changed
     for file_path in input_path.rglob('*'):
         if file_path.is_file():
             total_files += 1
-            if file_path.suffix.lower() in supported_extensions:
-                parser = supported_extensions[file_path.suffix.lower()]
-                logger.info(f"Processing {file_path.name}...")
-                
-                text = parser(file_path)
-                if text:
-                    # Normalize whitespace
-                    text = " ".join(text.split())
-                    
-                    doc_id = file_path.stem
-                    output_file = output_path / f"{doc_id}.txt"
-                    
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write(text)
-                    
-                    # Save metadata
-                    meta_file = output_path / f"{doc_id}.meta.json"
-                    with open(meta_file, 'w', encoding='utf-8') as f:
-                        json.dump({
-                            "sourcePath": str(file_path),
-                            "docTitle": file_path.name,
-                            "docId": doc_id
-                        }, f)
-                    
-                    count += 1
-                else:
-                    logger.warning(f"Failed to extract text from {file_path.name}")
-                    skipped += 1
-            else:
+            if file_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
                 skipped += 1
+                continue
+
+            key = str(file_path)
+            seen.add(key)
+            stat = file_path.stat()
+            entry = known.get(key)
+            # Entries from before doc ids were path-based are re-parsed under the new id
+            if entry and not force and entry.get("docId") == make_doc_id(file_path, input_path):
+                if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                    unchanged += 1
+                    continue
+                # Touched but maybe not modified: compare content before re-parsing
+                digest = file_hash(file_path)
+                if entry["sha256"] == digest:
+                    entry["mtime"] = stat.st_mtime
+                    unchanged += 1
+                    continue
+            else:
+                digest = file_hash(file_path)
+            to_process.append((file_path, {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest}))
+
+    # 2. Files removed from the source directory: their interim outputs are dropped once
+    # parsing is done (step 4), unless a remaining entry still references them
+    stale_outputs = []
+    removed = [key for key in known if key not in seen]
+    for key in removed:
+        stale_outputs += known.pop(key).get("outputs", [])
+        logger.info(f"Removing interim outputs for deleted source {key}")
+
+    # 3. Parse, in a process pool when workers > 1
+    stats = {ext: {"files": 0, "failed": 0, "bytes": 0, "seconds": 0.0} for ext in SUPPORTED_EXTENSIONS}
+
+    def record(file_path: Path, info: Dict[str, Any], result: Dict[str, Any]):
+        nonlocal count, skipped
+        ext_stats = stats[file_path.suffix.lower()]
+        ext_stats["files"] += 1
+        ext_stats["bytes"] += info["size"]
+        ext_stats["seconds"] += result["seconds"]
+        previous = known.pop(str(file_path), None)
+        if previous:
+            stale_outputs.extend(previous.get("outputs", []))
+        if result["ok"]:
+            known[str(file_path)] = dict(info, docId=result["docId"], outputs=result["outputs"])
+            count += 1
+        else:
+            logger.warning(f"Failed to extract text from {file_path.name}")
+            ext_stats["failed"] += 1
+            skipped += 1
+
+    if workers > 1 and len(to_process) > 1:
+        logger.info(f"Processing {len(to_process)} files with {workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(process_file, fp, output_path, make_doc_id(fp, input_path)): (fp, info) for fp, info in to_process}
+            for future in as_completed(futures):
+                file_path, info = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Worker failed on {file_path.name}: {e}")
+                    result = {"ok": False, "seconds": 0.0}
+                record(file_path, info, result)
+    else:
+        for file_path, info in to_process:
+            logger.info(f"Processing {file_path.name}...")
+            record(file_path, info, process_file(file_path, output_path, make_doc_id(file_path, input_path)))
+
+    # 4. Outputs of deleted, failed or renamed sources that nothing references any more.
+    # On the first run with a manifest that includes unlisted outputs of the old layout
+    # ({stem}.txt), which build_index would otherwise index next to their replacements.
+    if legacy_layout:
+        referenced = {name for entry in known.values() for name in entry["outputs"]}
+        legacy = sorted(
+            p.name for pattern in ("*.txt", "*.meta.json") for p in output_path.glob(pattern)
+            if p.name not in referenced
+        )
+        if legacy:
+            logger.info(f"Removing {len(legacy)} interim outputs of the previous layout: {legacy}")
+        stale_outputs += legacy
+    remove_outputs(output_path, stale_outputs, known)
+    save_manifest(output_path, manifest)
                 
     logger.info(f"Found {total_files} total files in {input_path}")
-    logger.info(f"Ingested {count} documents to {output_path}")
-    if total_files > 0 and count == 0:
-        logger.warning(f"Found {total_files} files but ingested 0. Ensure files have extensions: {list(supported_extensions.keys())}")
+    logger.info(f"Ingested {count} documents to {output_path} ({unchanged} unchanged, {len(removed)} removed)")
+    log_summary(stats, time.time() - start_time)
+    if total_files > 0 and count == 0 and unchanged == 0:
+        logger.warning(f"Found {total_files} files but ingested 0. Ensure files have extensions: {list(SUPPORTED_EXTENSIONS.keys())}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingest documents")
     parser.add_argument("--input", default=str(settings.DATA_DIR / "source"), help="Input directory containing docs")
     parser.add_argument("--output", default=str(settings.DATA_DIR / "interim"), help="Output directory for text")
+    parser.add_argument("--workers", type=int, default=settings.INGEST_WORKERS, help="Parser processes (1 = no pool)")
+    parser.add_argument("--force", action="store_true", help="Re-parse every file, ignoring the manifest")
     args = parser.parse_args()
     
-    ingest_docs(args.input, args.output)
+    ingest_docs(args.input, args.output, workers=args.workers, force=args.force)
@@ -0,0 +1,93 @@
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+from typing import List, Dict
+
+# Add backend to path to import app modules
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.config import settings
+from app.llm.intent_classifier import IntentClassifier, load_labeled_queries
+import numpy as np
+from sklearn.metrics import classification_report
+from sklearn.model_selection import train_test_split
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def latency_ms(fn, queries: List[str]) -> Dict[str, float]:
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"mean": float(np.mean(timings)), "p95": float(np.percentile(timings, 95))}
+
+def label_with_llm(queries: List[str]) -> List[str]:
+    from app.llm.intent_router import classify_with_llm
+    labels = []
+    for i, q in enumerate(queries, 1):
+        labels.append(classify_with_llm(q))
+        if i % 25 == 0:
+            logger.info(f"LLM labeled {i}/{len(queries)} queries")
+    return labels
+
+def train_intent(data_file: Path, output_file: Path, threshold: float, test_size: float, compare_llm: bool, seed: int):
+    queries, labels = load_labeled_queries(data_file)
+    logger.info(f"Loaded {len(queries)} labeled queries from {data_file}")
+
+    train_q, test_q, train_y, test_y = train_test_split(
+        queries, labels, test_size=test_size, random_state=seed, stratify=labels
+    )
+    classifier = IntentClassifier.train(train_q, train_y)
+
+    # Held-out accuracy, and what the confidence threshold does to it
+    predictions = classifier.predict_many(test_q)
+    predicted = [intent for intent, _ in predictions]
+    accuracy = float(np.mean([p == y for p, y in zip(predicted, test_y)]))
+    logger.info(f"Held-out accuracy: {accuracy:.3f} on {len(test_q)} queries")
+    logger.info("\n" + classification_report(test_y, predicted, zero_division=0))
+    for t in sorted({0.5, 0.6, 0.7, 0.8, 0.9, threshold}):
+        confident = [(p, y) for (p, c), y in zip(predictions, test_y) if c >= t]
+        confident_accuracy = float(np.mean([p == y for p, y in confident])) if confident else 0.0
+        marker = " <- configured" if t == threshold else ""
+        logger.info(
+            f"  threshold {t:.2f}: {len(confident) / len(test_q):6.1%} answered locally, "
+            f"{confident_accuracy:.3f} accurate; the rest go to the LLM{marker}"
+        )
+
+    local = latency_ms(classifier.predict, test_q)
+    logger.info(f"Classifier latency/query: {local['mean']:.2f} ms (p95 {local['p95']:.2f})")
+
+    if compare_llm:
+        start = time.perf_counter()
+        llm_labels = label_with_llm(test_q)
+        llm_ms = (time.perf_counter() - start) * 1000 / len(test_q)
+        agreement = float(np.mean([p == l for p, l in zip(predicted, llm_labels)]))
+        llm_accuracy = float(np.mean([l == y for l, y in zip(llm_labels, test_y)]))
+        logger.info(
+            f"LLM: {llm_accuracy:.3f} accurate vs file labels, {llm_ms:.0f} ms/query; "
+            f"classifier agrees with the LLM on {agreement:.1%}"
+        )
+
+    # Ship a model trained on every labeled query
+    IntentClassifier.train(queries, labels).save(output_file)
+    logger.info(f"Intent classifier saved to {output_file}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local intent classifier")
+    parser.add_argument("--data", default=str(Path(__file__).parent.parent / "sample_data" / "intent_queries.jsonl"),
+                        help="JSONL file of {\"query\", \"intent\"} lines")
+    parser.add_argument("--output", default=settings.INTENT_MODEL_PATH, help="Where to write the model")
+    parser.add_argument("--threshold", type=float, default=settings.INTENT_CONFIDENCE_THRESHOLD,
+                        help="Confidence needed to skip the LLM (for the report)")
+    parser.add_argument("--test-size", type=float, default=0.25, help="Held-out fraction for the report")
+    parser.add_argument("--compare-llm", action="store_true",
+                        help="Also label the held-out queries with the LLM and compare (needs Vertex access)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    train_intent(Path(args.data), Path(args.output), args.threshold, args.test_size, args.compare_llm, args.seed)
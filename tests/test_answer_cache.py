@@ -0,0 +1,40 @@
+from app.embeddings.embedding_cache import normalize_query
+from app.llm.answer_cache import AnswerCache
+
+
+def test_normalize_query_ignores_case_whitespace_and_trailing_punctuation():
+    assert normalize_query("  How do I   export a Report?") == "how do i export a report"
+    assert normalize_query("how do i export a report ?!") == "how do i export a report"
+    assert normalize_query("How do I export a report.") == "how do i export a report"
+
+
+def test_normalize_query_keeps_meaningful_symbols():
+    assert normalize_query("How do I configure C++?") != normalize_query("How do I configure C#?")
+    assert normalize_query("Is 2+2 > 3?") != normalize_query("Is 2-2 > 3?")
+    assert normalize_query("What does v1.2/api return?") == "what does v1.2/api return"
+
+
+def test_exact_hit_does_not_cross_symbol_variants():
+    cache = AnswerCache(max_entries=8, ttl=60, similarity_threshold=0)
+    cache.put("How do I configure C++?", 3, "v1", "RAG_QUERY", [], ["use cmake"])
+    assert cache.get("how do i configure c++", 3, "v1")["tokens"] == ["use cmake"]
+    assert cache.get("How do I configure C#?", 3, "v1") is None
+
+
+def test_similar_lookup_tracks_puts_evictions_and_versions():
+    cache = AnswerCache(max_entries=2, ttl=60, similarity_threshold=0.9)
+    cache.put("reset password", 3, "v1", "RAG_QUERY", [], ["a"], [1.0, 0.0, 0.0])
+    cache.put("export report", 3, "v1", "RAG_QUERY", [], ["b"], [0.0, 1.0, 0.0])
+    assert cache.get_similar([0.99, 0.05, 0.0], 3, "v1")["tokens"] == ["a"]
+    assert cache.get_similar([0.99, 0.05, 0.0], 5, "v1") is None
+
+    # The hit above made "reset password" recently used, so "export report" is evicted
+    cache.put("delete user", 3, "v1", "RAG_QUERY", [], ["c"], [0.0, 0.0, 1.0])
+    assert cache.get_similar([0.0, 1.0, 0.0], 3, "v1") is None
+    assert cache.get_similar([0.0, 0.1, 1.0], 3, "v1")["tokens"] == ["c"]
+
+    # A new index version drops every older entry
+    cache.put("new build", 3, "v2", "RAG_QUERY", [], ["d"], [0.0, 1.0, 0.0])
+    assert cache.get_similar([1.0, 0.0, 0.0], 3, "v1") is None
+    assert cache.get_similar([0.0, 1.0, 0.0], 3, "v2")["tokens"] == ["d"]
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,34 @@
+import asyncio
+
+from app.api import routes
+from app.api.pipeline import CANNED_REPLIES, chat_pipeline, collect
+from app.config import settings
+from app.llm import intent_router
+from app.llm.intent_router import Intent
+
+
+def test_local_intent_is_classified_once_per_request(monkeypatch):
+    calls = []
+
+    def predict(query):
+        calls.append(query)
+        return Intent.GREETING
+
+    monkeypatch.setattr(settings, "MODE", "none")
+    monkeypatch.setattr(settings, "CHAT_COALESCING", False)
+    monkeypatch.setattr(intent_router, "predict_local_intent", predict)
+
+    async def scenario():
+        run = chat_pipeline.start("hello there", 3, "session")
+        events, rejection = await routes.start_pipeline(run)
+        assert rejection is None
+        meta, answer, result = await collect(events)
+        run.record(result)
+        return run, meta, answer
+
+    run, meta, answer = asyncio.run(scenario())
+    # Admission (is_cheap_request) and the intent stage share one classification
+    assert calls == ["hello there"]
+    assert meta["intent"] == Intent.GREETING
+    assert answer == CANNED_REPLIES[Intent.GREETING]
+    assert "intent" in run.timer.report()
@@ -0,0 +1,60 @@
+import random
+import time
+
+import pytest
+
+from app.retrieval.chunk_store import ChunkStore, ChunkStoreWriter
+from app.utils.text_chunker import TextChunker
+
+WORDS = ["alpha", "béta", "γάμμα", "δ", "日本語", "emoji🙂", "x", "\n", "  "]
+
+
+def random_text(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def split_randomly(rng, text, max_piece):
+    pieces, i = [], 0
+    while i < len(text):
+        step = rng.randint(1, max_piece)
+        pieces.append(text[i:i + step])
+        i += step
+    return pieces
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_streamed_chunks_match_chunking_the_whole_text(seed):
+    rng = random.Random(seed)
+    chunker = TextChunker(chunk_size=120, overlap=30)
+    text = random_text(rng, 2000)
+    for max_piece in (1, 50, 400, len(text)):
+        streamed = list(chunker.iter_stream(split_randomly(rng, text, max_piece)))
+        assert [(start, end) for start, end, _ in streamed] == list(chunker.iter_spans(text))
+        assert all(text[start:end] == chunk for start, end, chunk in streamed)
+
+
+def test_chunk_store_byte_offsets_with_multibyte_text(tmp_path):
+    rng = random.Random(7)
+    chunker = TextChunker(chunk_size=120, overlap=30)
+    docs = [random_text(rng, 800) for _ in range(3)]
+    with ChunkStoreWriter(tmp_path / "store") as writer:
+        for i, text in enumerate(docs):
+            writer.add_document(split_randomly(rng, text, 300), {"docId": f"d{i}"}, chunker)
+
+    store = ChunkStore(tmp_path / "store")
+    expected = [text[start:end] for text in docs for start, end in chunker.iter_spans(text)]
+    assert list(store.iter_texts()) == expected
+    store.close()
+
+
+def test_one_huge_page_is_chunked_in_linear_time(tmp_path):
+    text = random_text(random.Random(1), 600_000)  # about 4 MB, multibyte, as a single piece
+    chunker = TextChunker(chunk_size=1000, overlap=200)
+    started = time.perf_counter()
+    with ChunkStoreWriter(tmp_path / "store") as writer:
+        count = writer.add_document([text], {"docId": "big"}, chunker)
+    # Re-slicing the buffer and re-encoding the prefix per chunk took ~40s here
+    assert time.perf_counter() - started < 5
+    store = ChunkStore(tmp_path / "store")
+    assert count == len(store) and store.text(count - 1) == text[list(chunker.iter_spans(text))[-1][0]:].strip()
+    store.close()
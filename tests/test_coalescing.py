@@ -0,0 +1,41 @@
+import asyncio
+
+from app.api.pipeline import chat_pipeline
+from app.api.routes import flight_key
+from app.utils.singleflight import SingleFlight
+
+
+def key(query, top_k=3):
+    return flight_key(chat_pipeline.start(query, top_k, "session"))
+
+
+def test_flight_key_separates_symbol_variants():
+    assert key("How do I configure C++?") != key("How do I configure C#?")
+    assert key("Is 2+2 > 3?") != key("Is 2-2 > 3?")
+
+
+def test_flight_key_joins_trivial_variants():
+    assert key("How do I configure C++?") == key("  how do I configure c++")
+    assert key("export report") != key("export report", top_k=5)
+
+
+def test_identical_requests_share_one_producer():
+    async def scenario():
+        flights = SingleFlight("test")
+        runs = []
+
+        async def produce():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            yield "answer"
+
+        first, leader = flights.join(key("C++?"), produce)
+        second, joined_leader = flights.join(key("c++"), produce)
+        other, other_leader = flights.join(key("C#?"), produce)
+        results = [[item async for item in sub] for sub in (first, second, other)]
+        return leader, joined_leader, other_leader, results, len(runs)
+
+    leader, joined_leader, other_leader, results, runs = asyncio.run(scenario())
+    assert (leader, joined_leader, other_leader) == (True, False, True)
+    assert results == [["answer"]] * 3
+    assert runs == 2
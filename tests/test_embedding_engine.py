@@ -0,0 +1,137 @@
+import random
+import threading
+import time
+
+import pytest
+
+from app.embeddings.embedding_engine import EmbeddingEngine
+from app.llm.upstream import UpstreamScheduler, BATCH_EMBED
+
+
+class FakeEmbeddingServer:
+    """Embeds text i as [i]; calls can be made slow, rate limited or failing."""
+
+    def __init__(self, delay=0.0, rate_limited_calls=0, max_texts=None, error=None):
+        self.delay = delay
+        self.rate_limited_calls = rate_limited_calls
+        self.max_texts = max_texts
+        self.error = error
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            self.batch_sizes.append(len(batch))
+            limited = self.rate_limited_calls > 0
+            if limited:
+                self.rate_limited_calls -= 1
+        if self.delay:
+            time.sleep(random.uniform(0, self.delay))
+        if limited:
+            raise RuntimeError("429 RESOURCE_EXHAUSTED")
+        if self.error:
+            raise RuntimeError(self.error)
+        if self.max_texts is not None and len(batch) > self.max_texts:
+            raise RuntimeError("400 request too large")
+        return [[float(text)] for text in batch]
+
+
+def texts(n):
+    return [str(i) for i in range(n)]
+
+
+def engine(server, **options):
+    params = dict(concurrency=4, max_batch=8, max_batch_chars=0, retry=1)
+    params.update(options)
+    return EmbeddingEngine(server, **params)
+
+
+def test_results_keep_input_order_with_batches_finishing_out_of_order():
+    vectors = engine(FakeEmbeddingServer(delay=0.01)).embed(texts(200))
+    assert vectors == [[float(i)] for i in range(200)]
+
+
+def test_waiting_on_in_flight_batches_does_not_spin():
+    server = FakeEmbeddingServer(delay=0.02)
+    wall, cpu = time.monotonic(), time.process_time()
+    engine(server, max_batch=4).embed(texts(400))
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    assert cpu < wall * 0.5
+
+
+def test_rate_limit_shrinks_batches_and_in_flight_then_completes():
+    server = FakeEmbeddingServer(rate_limited_calls=1)
+    eng = engine(server, concurrency=4, max_batch=8)
+    vectors = eng.embed(texts(64))
+    assert vectors == [[float(i)] for i in range(64)]
+    stats = eng.stats()
+    assert stats["rateLimited"] == 1
+    # The batch after the 429 is smaller than the ones before it; sizes grow back on success
+    assert server.batch_sizes[:4] == [8, 8, 8, 8]
+    assert server.batch_sizes[4] < 8
+    assert stats["batchSize"] <= 8
+
+
+def test_failing_batch_is_split_until_it_succeeds():
+    server = FakeEmbeddingServer(max_texts=2)
+    eng = engine(server, concurrency=1, max_batch=8, retry=1)
+    vectors = eng.embed(texts(8))
+    assert vectors == [[float(i)] for i in range(8)]
+    assert eng.stats()["splits"] == 3
+    assert server.batch_sizes == [8, 4, 2, 2, 4, 2, 2]
+
+
+def test_single_text_that_keeps_failing_raises():
+    eng = engine(FakeEmbeddingServer(max_texts=0), concurrency=1, retry=1)
+    with pytest.raises(RuntimeError, match="request too large"):
+        eng.embed(texts(2))
+
+
+@pytest.mark.parametrize("error", [
+    "400 INVALID_ARGUMENT. Request contains an invalid argument.",
+    "403 PERMISSION_DENIED. Permission denied on resource project.",
+    "404 NOT_FOUND. Publisher model was not found.",
+])
+def test_client_errors_raise_without_retrying_or_splitting(error):
+    server = FakeEmbeddingServer(error=error)
+    eng = engine(server, concurrency=1, max_batch=8, retry=3)
+    with pytest.raises(RuntimeError, match=error.split(".")[0]):
+        eng.embed(texts(8))
+    assert server.batch_sizes == [8]
+    assert eng.stats()["splits"] == 0
+
+
+def test_auth_error_is_retried_once_after_a_token_refresh():
+    refreshes = []
+    server = FakeEmbeddingServer(error="401 UNAUTHENTICATED")
+    eng = engine(server, concurrency=1, max_batch=8, retry=3, on_auth_error=lambda: refreshes.append(1))
+    with pytest.raises(RuntimeError, match="401"):
+        eng.embed(texts(8))
+    assert server.batch_sizes == [8, 8]
+    assert len(refreshes) == 2
+
+
+def test_transient_errors_are_retried_then_split():
+    server = FakeEmbeddingServer(error="503 UNAVAILABLE")
+    eng = engine(server, concurrency=1, max_batch=2, retry=1)
+    with pytest.raises(RuntimeError, match="503"):
+        eng.embed(texts(2))
+    assert server.batch_sizes == [2, 1]
+
+
+def test_rate_limit_backoff_is_left_to_the_upstream_scheduler():
+    scheduler = UpstreamScheduler(max_concurrency=4, limits={}, backoff=0.05)
+    server = FakeEmbeddingServer(rate_limited_calls=1)
+
+    def call(batch):
+        with scheduler.slot(BATCH_EMBED):
+            return server(batch)
+
+    eng = engine(call, concurrency=1, max_batch=8, rate_limit_pause=scheduler.paused_until)
+    started = time.monotonic()
+    vectors = eng.embed(texts(16))
+    elapsed = time.monotonic() - started
+    assert vectors == [[float(i)] for i in range(16)]
+    assert eng.stats()["rateLimited"] == 1
+    # Only the scheduler's 0.05s pause, not the engine's own 0.5s on top of it
+    assert 0.05 <= elapsed < 0.4
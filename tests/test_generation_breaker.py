@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app.api.pipeline import until_deadline
+from app.llm import vertex_stream
+from app.llm.circuit_breaker import CircuitBreaker
+from app.llm.upstream import UpstreamScheduler, GENERATE
+from app.llm.vertex_r2d2_client import VertexR2D2Client
+
+
+class StalledStream:
+    """A generate_content_stream response that never produces a chunk."""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(3600)
+
+
+class FakeModels:
+    async def generate_content_stream(self, **kwargs):
+        return StalledStream()
+
+
+class FakeClient:
+    class aio:
+        models = FakeModels()
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker("generation", window=10, min_calls=1, failure_rate=0.5,
+                             slow_seconds=0.05, open_seconds=30)
+    monkeypatch.setattr(vertex_stream, "generation_breaker", breaker)
+    monkeypatch.setattr(vertex_stream, "upstream_scheduler", UpstreamScheduler(1, {GENERATE: 1}, backoff=0.1))
+    monkeypatch.setattr(VertexR2D2Client, "get_client", classmethod(lambda cls: FakeClient()))
+    return breaker
+
+
+async def generate_until(seconds: float):
+    deadline = asyncio.get_running_loop().time() + seconds
+    with pytest.raises(asyncio.TimeoutError):
+        async for _ in until_deadline(vertex_stream.generate_response_stream("q", []), deadline):
+            pass
+
+
+def test_timeout_waiting_for_a_generation_slot_is_not_a_failure(breaker):
+    async def scenario():
+        async with vertex_stream.upstream_scheduler.aslot(GENERATE):
+            await generate_until(0.2)
+
+    asyncio.run(scenario())
+    assert breaker.stats()["recentCalls"] == 0
+    assert breaker.state == "closed"
+
+
+def test_stream_that_stalls_upstream_is_a_failure(breaker):
+    asyncio.run(generate_until(0.2))
+    stats = breaker.stats()
+    assert (stats["recentCalls"], stats["failureRate"]) == (1, 1.0)
+    assert breaker.state == "open"
@@ -0,0 +1,60 @@
+import json
+
+from scripts.ingest_docs import ingest_docs
+
+
+def write_html(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"<html><body><p>{text}</p></body></html>", encoding="utf-8")
+
+
+def interim_texts(output_dir):
+    texts = {}
+    for meta_file in output_dir.glob("*.meta.json"):
+        meta = json.loads(meta_file.read_text(encoding="utf-8"))
+        texts[meta["sourcePath"]] = (output_dir / f"{meta['docId']}.txt").read_text(encoding="utf-8")
+    return texts
+
+
+def test_sources_with_the_same_stem_get_separate_outputs(tmp_path):
+    source, interim = tmp_path / "source", tmp_path / "interim"
+    write_html(source / "a" / "guide.html", "alpha guide")
+    write_html(source / "b" / "guide.html", "beta guide")
+    ingest_docs(str(source), str(interim), workers=2)
+
+    texts = interim_texts(interim)
+    assert texts == {
+        str(source / "a" / "guide.html"): "alpha guide",
+        str(source / "b" / "guide.html"): "beta guide",
+    }
+
+
+def test_deleting_a_source_keeps_the_outputs_of_others(tmp_path):
+    source, interim = tmp_path / "source", tmp_path / "interim"
+    write_html(source / "a" / "guide.html", "alpha guide")
+    write_html(source / "b" / "guide.html", "beta guide")
+    ingest_docs(str(source), str(interim))
+
+    (source / "a" / "guide.html").unlink()
+    ingest_docs(str(source), str(interim))
+
+    assert interim_texts(interim) == {str(source / "b" / "guide.html"): "beta guide"}
+    assert len(list(interim.glob("*.txt"))) == 1
+
+
+def test_first_run_replaces_outputs_of_the_stem_named_layout(tmp_path):
+    source, interim = tmp_path / "source", tmp_path / "interim"
+    write_html(source / "guide.html", "new guide")
+    # What the old ingest wrote: {stem}.txt / {stem}.meta.json and no manifest
+    interim.mkdir()
+    (interim / "guide.txt").write_text("old guide", encoding="utf-8")
+    (interim / "guide.meta.json").write_text(json.dumps({
+        "sourcePath": str(source / "guide.html"), "docTitle": "guide.html", "docId": "guide",
+    }), encoding="utf-8")
+    (interim / "removed.txt").write_text("source is gone", encoding="utf-8")
+    (interim / "notes.md").write_text("not an ingest output", encoding="utf-8")
+    ingest_docs(str(source), str(interim))
+
+    assert interim_texts(interim) == {str(source / "guide.html"): "new guide"}
+    assert len(list(interim.glob("*.txt"))) == 1
+    assert (interim / "notes.md").exists()
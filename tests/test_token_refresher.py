@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+
+from app.config import settings
+from app.llm.vertex_r2d2_client import VertexR2D2Client
+
+
+@pytest.fixture
+def helix(monkeypatch, tmp_path):
+    """
+    VertexR2D2Client with a clean token state and a stub client factory. The returned
+    function installs a stub HELIX_TOKEN_CMD that appends a line to a calls file per run.
+    """
+    monkeypatch.setattr(VertexR2D2Client, "_client", None)
+    monkeypatch.setattr(VertexR2D2Client, "_token", None)
+    monkeypatch.setattr(VertexR2D2Client, "_token_expiry", 0)
+    monkeypatch.setattr(VertexR2D2Client, "_token_refreshed_at", 0)
+    monkeypatch.setattr(VertexR2D2Client, "_stats", {
+        "refreshes": 0, "failures": 0, "lastRefreshMs": None, "maxRefreshMs": None, "lastError": None,
+    })
+    monkeypatch.setattr(VertexR2D2Client, "_create_client", classmethod(lambda cls: setattr(cls, "_client", object())))
+    monkeypatch.setattr(settings, "SSL_CERT_FILE", None)
+    monkeypatch.setattr(settings, "HELIX_TOKEN_TIMEOUT", 5)
+    calls = tmp_path / "calls"
+
+    def use_command(command: str):
+        monkeypatch.setattr(settings, "HELIX_TOKEN_CMD", f"echo run >> {calls}; {command}")
+
+    use_command.calls = lambda: len(calls.read_text().splitlines()) if calls.exists() else 0
+    yield use_command
+    VertexR2D2Client.stop_refresher()
+
+
+def test_concurrent_callers_share_one_token_command(helix):
+    helix("sleep 0.3 && echo tok")
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(VertexR2D2Client.get_client())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert helix.calls() == 1
+    assert len(clients) == 8 and len({id(c) for c in clients}) == 1
+    assert VertexR2D2Client._token == "tok"
+    assert VertexR2D2Client.status()["refreshes"] == 1
+
+
+def test_refresher_renews_before_expiry(helix, monkeypatch):
+    helix("date +%s%N")
+    monkeypatch.setattr(settings, "HELIX_TOKEN_LIFETIME", 2.0)
+    monkeypatch.setattr(settings, "TOKEN_REFRESH_MARGIN", 1.5)
+
+    VertexR2D2Client.start_refresher()
+    deadline = time.time() + 2
+    while VertexR2D2Client._token is None and time.time() < deadline:
+        time.sleep(0.01)
+    first_token, first_expiry = VertexR2D2Client._token, VertexR2D2Client._token_expiry
+    assert first_token is not None
+
+    # Renewed inside the margin, well before the first token expires
+    while VertexR2D2Client._token == first_token and time.time() < first_expiry:
+        time.sleep(0.01)
+    assert VertexR2D2Client._token != first_token
+    assert time.time() < first_expiry
+    assert helix.calls() == 2
+
+    # Request path finds a valid token and never runs the command itself
+    VertexR2D2Client.get_client()
+    assert helix.calls() == 2
+    status = VertexR2D2Client.status()
+    assert status["refresher"] and status["refreshes"] == 2 and status["failures"] == 0
+
+
+def test_failures_are_counted_and_the_current_token_stays_in_use(helix, monkeypatch):
+    helix("false")
+    with pytest.raises(RuntimeError):
+        VertexR2D2Client.get_client()
+    helix("true")
+    with pytest.raises(ValueError):
+        VertexR2D2Client.get_client()
+    status = VertexR2D2Client.status()
+    assert (status["refreshes"], status["failures"]) == (0, 2)
+    assert "empty token" in status["lastError"]
+    assert status["tokenExpiresIn"] is None
+
+    # Background renewal fails: the token is still valid, so callers keep the client
+    monkeypatch.setattr(settings, "HELIX_TOKEN_LIFETIME", 10.0)
+    monkeypatch.setattr(settings, "TOKEN_REFRESH_MARGIN", 10.0)
+    helix("echo tok")
+    client = VertexR2D2Client.get_client()
+    helix("exit 3")
+    calls_before = helix.calls()
+    VertexR2D2Client.start_refresher()
+    deadline = time.time() + 2
+    while VertexR2D2Client.status()["failures"] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    status = VertexR2D2Client.status()
+    assert status["failures"] == 3 and status["refreshes"] == 1
+    assert helix.calls() == calls_before + 1
+    assert VertexR2D2Client.get_client() is client
+
+
+def test_auth_errors_right_after_a_refresh_are_ignored(helix, monkeypatch):
+    helix("echo tok")
+    monkeypatch.setattr(settings, "TOKEN_MIN_REFRESH_INTERVAL", 30)
+    client = VertexR2D2Client.get_client()
+    VertexR2D2Client.refresh_on_error()
+    assert VertexR2D2Client.get_client() is client
+    assert helix.calls() == 1
+
+    monkeypatch.setattr(settings, "TOKEN_MIN_REFRESH_INTERVAL", 0)
+    VertexR2D2Client.refresh_on_error()
+    assert VertexR2D2Client.get_client() is not client
+    assert helix.calls() == 2
+
+
+def test_expired_token_is_not_served_while_background_refresh_keeps_failing(helix, monkeypatch):
+    monkeypatch.setattr(settings, "HELIX_TOKEN_LIFETIME", 0.5)
+    monkeypatch.setattr(settings, "TOKEN_REFRESH_MARGIN", 0.5)
+    helix("echo tok")
+    client = VertexR2D2Client.get_client()
+    helix("exit 3")
+    VertexR2D2Client.start_refresher()
+    expiry = VertexR2D2Client._token_expiry
+    while time.time() < expiry + 0.05:
+        time.sleep(0.01)
+
+    # The refresher is backing off; the request path refreshes itself instead of
+    # handing out the expired client
+    assert VertexR2D2Client.status()["failures"] >= 1
+    assert VertexR2D2Client.status()["tokenExpiresIn"] == 0.0
+    with pytest.raises(RuntimeError):
+        VertexR2D2Client.get_client()
+
+    helix("echo tok2")
+    assert VertexR2D2Client.get_client() is not client
+    assert VertexR2D2Client._token == "tok2"
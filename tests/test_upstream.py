@@ -0,0 +1,71 @@
+import threading
+import time
+
+from app.llm.upstream import UpstreamScheduler, GENERATE, INTENT, BATCH_EMBED
+
+
+def hold_slot(scheduler, operation, entered, release):
+    def run():
+        with scheduler.slot(operation):
+            entered.set()
+            release.wait(5)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_call_with_room_is_not_queued_behind_a_blocked_operation():
+    scheduler = UpstreamScheduler(max_concurrency=8, limits={INTENT: 1, GENERATE: 5}, backoff=0.1)
+    release = threading.Event()
+    first, second = threading.Event(), threading.Event()
+    hold_slot(scheduler, INTENT, first, release)
+    assert first.wait(1)
+    # Queued behind the intent limit
+    hold_slot(scheduler, INTENT, second, release)
+    time.sleep(0.05)
+    assert not second.is_set()
+    assert scheduler.stats()["operations"][INTENT]["queued"] == 1
+
+    generating = threading.Event()
+    hold_slot(scheduler, GENERATE, generating, release)
+    try:
+        assert generating.wait(1), "generation waited for an unrelated intent call to finish"
+        assert not second.is_set()
+    finally:
+        release.set()
+    assert second.wait(1)
+
+
+def test_queued_calls_start_by_priority():
+    scheduler = UpstreamScheduler(max_concurrency=1, limits={}, backoff=0.1)
+    release = threading.Event()
+    busy = threading.Event()
+    hold_slot(scheduler, BATCH_EMBED, busy, release)
+    assert busy.wait(1)
+
+    order = []
+    def call(operation):
+        with scheduler.slot(operation):
+            order.append(operation)
+    threads = [threading.Thread(target=call, args=(op,)) for op in (BATCH_EMBED, INTENT, GENERATE)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert order == [GENERATE, INTENT, BATCH_EMBED]
+
+
+def test_rate_limit_pauses_new_calls():
+    scheduler = UpstreamScheduler(max_concurrency=4, limits={}, backoff=0.2)
+    try:
+        with scheduler.slot(INTENT):
+            raise RuntimeError("429 RESOURCE_EXHAUSTED")
+    except RuntimeError:
+        pass
+    started = time.monotonic()
+    with scheduler.slot(GENERATE):
+        pass
+    assert time.monotonic() - started >= 0.15
+    assert scheduler.stats()["operations"][INTENT]["rateLimited"] == 1